@@ -27,9 +27,13 @@ setup(
     license='Commercial',
     packages=[
         'tortuga_test_lib',
+        'tortuga_test_lib.bench',
         'tortuga_test_lib.cloud_provider',
+        'tortuga_test_lib.remote',
         'tortuga_test_lib.robot',
-        'tortuga_test_lib.robot.scripts'
+        'tortuga_test_lib.robot.scripts',
+        'tortuga_test_lib.testing',
+        'tortuga_test_lib.util'
     ],
     package_dir={
         '': 'src'
@@ -49,6 +53,7 @@ setup(
     entry_points={
         'console_scripts': [
             'start-remote-test-server=tortuga_test_lib.robot.scripts.start_remote_test_server:main',
+            'cleanup-leaked-vms=tortuga_test_lib.robot.scripts.cleanup_leaked_vms:main',
         ]
     }
 )
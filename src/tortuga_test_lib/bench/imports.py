@@ -0,0 +1,138 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks the cold import time of each library against a budget, and that
+heavy dependencies are not loaded until they are used. Exits non-zero if
+any library is over budget.
+
+    python -m tortuga_test_lib.bench.imports
+
+"""
+import argparse
+import json
+import subprocess
+import sys
+from typing import Dict, List
+
+
+#
+# The budget for the cold import of each library, in seconds
+#
+BUDGETS = {
+    'tortuga_test_lib.robot.Tortuga': 0.15,
+    'tortuga_test_lib.robot.CloudProvider': 0.15,
+    'tortuga_test_lib.robot.TortugaRemote': 0.15,
+}
+
+#
+# Modules that must only be imported by the keywords that need them
+#
+LAZY_MODULES = ['asyncio', 'boto3', 'botocore', 'bs4', 'crypt', 'oic', 'pam',
+                'requests', 'yaml']
+
+_MEASURE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'elapsed': elapsed,
+    'loaded': [m for m in {lazy!r} if m in sys.modules]
+}}))
+'''
+
+
+def measure(module: str, repeat: int = 5) -> dict:
+    """
+    Measures the cold import time of a module, each time in a new
+    interpreter.
+
+    :param str module: the module to import
+    :param int repeat: the number of times to measure
+
+    :return dict: the best import time in seconds, and the lazy modules
+                  that were loaded by the import
+
+    """
+    best = None
+    loaded: List[str] = []
+    for _ in range(repeat):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            _MEASURE.format(module=module, lazy=LAZY_MODULES)
+        ])
+        result = json.loads(output)
+        if best is None or result['elapsed'] < best:
+            best = result['elapsed']
+        loaded = result['loaded']
+
+    return {'elapsed': best, 'loaded': loaded}
+
+
+def run(budgets: Dict[str, float] = None, repeat: int = 5) -> Dict[str, dict]:
+    """
+    Runs the benchmark.
+
+    :param Dict[str, float] budgets: the budget for each module, defaults
+                                     to BUDGETS
+    :param int repeat:               the number of times to measure each
+                                     module
+
+    :return Dict[str, dict]: the result for each module, with the import
+                             time, budget, loaded lazy modules, and whether
+                             it passed
+
+    """
+    results = {}
+    for module, budget in (budgets or BUDGETS).items():
+        result = measure(module, repeat)
+        result['budget'] = budget
+        result['passed'] = result['elapsed'] <= budget and \
+            not result['loaded']
+        results[module] = result
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        '\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1,
+                        help='multiply all budgets, for slow machines')
+    parser.add_argument('--json', action='store_true',
+                        help='output the results as JSON')
+    args = parser.parse_args()
+
+    budgets = {module: budget * args.scale
+               for module, budget in BUDGETS.items()}
+    results = run(budgets, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for module, result in results.items():
+            print('{:<40} {:>7.1f}ms / {:>5.0f}ms {}{}'.format(
+                module, result['elapsed'] * 1000, result['budget'] * 1000,
+                'ok' if result['passed'] else 'FAIL',
+                ' (loaded {})'.format(', '.join(result['loaded']))
+                if result['loaded'] else ''))
+
+    if not all(result['passed'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the throughput and latency of the library keywords offline,
+against local stand-ins for EC2, the identity provider and the tortuga CLI,
+and compares the results with a saved baseline.
+
+    python -m tortuga_test_lib.bench.keywords --save baseline.json
+    python -m tortuga_test_lib.bench.keywords --baseline baseline.json
+
+The VM benchmarks call the AWS launcher directly, as the keywords also
+wait for SSH, which the fake instances do not run.
+
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from tortuga_test_lib.util.loadtest import run_load
+
+
+BENCHMARKS = [
+    'launch_vm',
+    'delete_vm',
+    'run_command',
+    'parse_file',
+    'parse_file_cached',
+    'openid_authenticate'
+]
+
+VM_ARGS = ('us-east-1', 'sg-bench', 'subnet-bench', 'ami-bench',
+           't2.micro', 'bench')
+
+
+class _Context:
+    """
+    The stand-ins, and state, shared between the benchmarks of a run.
+
+    """
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        self.tmp_dir = tempfile.mkdtemp(prefix='tortuga-test-lib-bench-')
+        self.instances: List[tuple] = []
+        self._launcher = None
+        self._tortuga = None
+        self._idp = None
+
+    @property
+    def launcher(self):
+        if self._launcher is None:
+            from tortuga_test_lib.testing.ec2 import FakeAwsLauncher, FakeEc2
+            self._launcher = FakeAwsLauncher(FakeEc2(
+                latency=self.options['ec2_latency'],
+                boot_time=self.options['ec2_boot_time']
+            ), key_mode=self.options['key_mode'])
+
+        return self._launcher
+
+    @property
+    def tortuga(self):
+        if self._tortuga is None:
+            from tortuga_test_lib.robot.Tortuga import Tortuga
+            self._tortuga = Tortuga(
+                cli_backend=self.options['cli_backend'])
+
+        return self._tortuga
+
+    @property
+    def idp(self):
+        if self._idp is None:
+            from tortuga_test_lib.testing.idp import LocalIdp
+            self._idp = LocalIdp(users={'bench': 'bench'},
+                                 latency=self.options['idp_latency']).start()
+
+        return self._idp
+
+    def close(self):
+        for instance in self.instances:
+            self.launcher.delete_vm(VM_ARGS[0], instance[0])
+        for instance in self.instances:
+            if os.path.exists(instance[3]):
+                os.unlink(instance[3])
+        if self._idp is not None:
+            self._idp.stop()
+        if self._tortuga is not None and self._tortuga._cli_pool is not None:
+            self._tortuga._cli_pool.shutdown()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def _launch_vm(ctx: _Context) -> Tuple[Callable, List[tuple]]:
+    launcher = ctx.launcher
+
+    def launch():
+        ctx.instances.append(launcher.launch_vm(*VM_ARGS))
+        return True
+
+    return launch, [()]
+
+
+def _delete_vm(ctx: _Context) -> Tuple[Callable, List[tuple]]:
+    #
+    # Deletes the instances launched by the launch_vm benchmark, or
+    # launches some to delete if it was not run
+    #
+    while len(ctx.instances) < ctx.options['iterations']:
+        ctx.instances.append(ctx.launcher.launch_vm(*VM_ARGS))
+    instances, ctx.instances = ctx.instances, []
+
+    def delete(instance):
+        ctx.launcher.delete_vm(VM_ARGS[0], instance[0])
+        if os.path.exists(instance[3]):
+            os.unlink(instance[3])
+        return True
+
+    return delete, [(instance,) for instance in instances]
+
+
+def _run_command(ctx: _Context) -> Tuple[Callable, List[tuple]]:
+    from tortuga_test_lib.testing import cli
+
+    bin_dir = os.path.join(ctx.tmp_dir, 'bin')
+    cli.install(bin_dir)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['TORTUGA_TEST_FAKE_CLI_LATENCY'] = \
+        str(ctx.options['cli_latency'])
+
+    if ctx.options['cli_backend'] == 'forkserver':
+        ctx.tortuga._get_cli_pool().entry_points.update(cli.ENTRY_POINTS)
+
+    def run(cmd):
+        return ctx.tortuga.run_command(cmd) is not None
+
+    return run, [('get-node-list',), ('get-node-status',),
+                 ('get-software-profile-list',)]
+
+
+def _write_parse_file(ctx: _Context) -> str:
+    path = os.path.join(ctx.tmp_dir, 'nodes.yaml')
+    if not os.path.exists(path):
+        with open(path, 'w') as fp:
+            for i in range(ctx.options['records']):
+                fp.write('- name: compute-{0:05d}.private\n'
+                         '  state: Installed\n'
+                         '  softwareprofile: Compute\n'
+                         '  hardwareprofile: aws\n'
+                         '  nics: [{{ip: 10.0.{1}.{2}}}]\n'.format(
+                             i, i // 256 % 256, i % 256))
+
+    return path
+
+
+def _parse_file(ctx: _Context) -> Tuple[Callable, List[tuple]]:
+    path = _write_parse_file(ctx)
+
+    def parse():
+        return ctx.tortuga.parse_file(path, 'yaml') is not None
+
+    return parse, [()]
+
+
+def _parse_file_cached(ctx: _Context) -> Tuple[Callable, List[tuple]]:
+    path = _write_parse_file(ctx)
+
+    def parse():
+        return ctx.tortuga.parse_file(path, 'yaml', cache=True) is not None
+
+    return parse, [()]
+
+
+def _openid_authenticate(ctx: _Context) -> Tuple[Callable, List[tuple]]:
+    #
+    # Skips the benchmark if the OpenID client isn't installed
+    #
+    for module in ['bs4', 'oic']:
+        if importlib.util.find_spec(module) is None:
+            raise ImportError('No module named {!r}'.format(module))
+    tortuga, idp = ctx.tortuga, ctx.idp
+
+    def authenticate():
+        tortuga.openid_authenticate(idp.issuer, 'bench', 'bench',
+                                    idp.client_redirect, 'bench', 'bench')
+        return True
+
+    return authenticate, [()]
+
+
+_SETUP = {
+    'launch_vm': _launch_vm,
+    'delete_vm': _delete_vm,
+    'run_command': _run_command,
+    'parse_file': _parse_file,
+    'parse_file_cached': _parse_file_cached,
+    'openid_authenticate': _openid_authenticate
+}
+
+
+def run(benchmarks: List[str] = None, iterations: int = 50,
+        concurrency: int = 1, ec2_latency: float = 0.005,
+        ec2_boot_time: float = 0, cli_latency: float = 0,
+        idp_latency: float = 0, records: int = 2000,
+        key_mode: str = 'instance',
+        cli_backend: str = 'subprocess') -> Dict[str, Any]:
+    """
+    Runs the benchmarks.
+
+    :param List[str] benchmarks: the benchmarks to run, defaults to all of
+                                 them
+    :param int iterations:       the number of calls for each benchmark
+    :param int concurrency:      the number of calls to make at once
+    :param float ec2_latency:    the fake EC2 API latency, in seconds
+    :param float ec2_boot_time:  the fake EC2 instance boot time, in
+                                 seconds
+    :param float cli_latency:    the fake tortuga CLI latency, in seconds
+    :param float idp_latency:    the identity provider latency, in seconds
+    :param int records:          the number of records in the parsed file
+    :param str key_mode:         the AWS launcher key mode
+    :param str cli_backend:      the tortuga CLI backend
+
+    :return Dict[str, Any]: the options, and the results for each
+                            benchmark, with the throughput in calls per
+                            second, and the latency percentiles in seconds,
+                            or the reason it was skipped
+
+    """
+    options = {
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'ec2_latency': ec2_latency,
+        'ec2_boot_time': ec2_boot_time,
+        'cli_latency': cli_latency,
+        'idp_latency': idp_latency,
+        'records': records,
+        'key_mode': key_mode,
+        'cli_backend': cli_backend
+    }
+    results = {}
+    ctx = _Context(options)
+
+    try:
+        for name in benchmarks or BENCHMARKS:
+            try:
+                func, args = _SETUP[name](ctx)
+            except ImportError as ex:
+                results[name] = {'skipped': str(ex)}
+                continue
+
+            if name == 'delete_vm':
+                calls = len(args)
+            else:
+                calls = iterations
+            result = run_load(func, args, concurrency=concurrency,
+                              iterations=calls)
+            del result['successes'], result['failures']
+            results[name] = result
+    finally:
+        ctx.close()
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'options': options,
+        'results': results
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float = 0.2) -> List[Dict[str, Any]]:
+    """
+    Compares results with a baseline.
+
+    :param dict current:    the results of run
+    :param dict baseline:   the baseline results of run
+    :param float tolerance: the fraction the p50 latency may rise, or the
+                            throughput fall, by before it is a regression
+
+    :return List[Dict[str, Any]]: for each benchmark in both, the p50
+                                  latency and throughput, the baseline's,
+                                  and whether it regressed
+
+    """
+    comparisons = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base or 'skipped' in result or 'skipped' in base:
+            continue
+
+        p50, base_p50 = result['latency']['p50'], base['latency']['p50']
+        comparisons.append({
+            'benchmark': name,
+            'p50': p50,
+            'baseline_p50': base_p50,
+            'throughput': result['throughput'],
+            'baseline_throughput': base['throughput'],
+            'regressed': p50 > base_p50 * (1 + tolerance) or
+            result['throughput'] < base['throughput'] * (1 - tolerance)
+        })
+
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        '\n')[0])
+    parser.add_argument('--benchmark', action='append', dest='benchmarks',
+                        choices=BENCHMARKS)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--ec2-latency', type=float, default=0.005)
+    parser.add_argument('--ec2-boot-time', type=float, default=0)
+    parser.add_argument('--cli-latency', type=float, default=0)
+    parser.add_argument('--idp-latency', type=float, default=0)
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--key-mode', default='instance',
+                        choices=['instance', 'shared'])
+    parser.add_argument('--cli-backend', default='subprocess',
+                        choices=['subprocess', 'forkserver'])
+    parser.add_argument('--save', metavar='PATH',
+                        help='save the results, to use as a baseline')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare the results with a saved baseline, '
+                             'and exit with 1 if any regressed')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--json', action='store_true',
+                        help='output the results as JSON')
+    args = parser.parse_args()
+
+    current = run(args.benchmarks, args.iterations, args.concurrency,
+                  args.ec2_latency, args.ec2_boot_time, args.cli_latency,
+                  args.idp_latency, args.records, args.key_mode,
+                  args.cli_backend)
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(current, fp, indent=2)
+
+    comparisons = []
+    if args.baseline:
+        with open(args.baseline) as fp:
+            comparisons = compare(current, json.load(fp), args.tolerance)
+
+    if args.json:
+        print(json.dumps(dict(current, comparisons=comparisons), indent=2))
+    else:
+        print('{:<20} {:>8} {:>10} {:>10} {:>10} {:>7}'.format(
+            'benchmark', 'calls', 'calls/s', 'p50 ms', 'p95 ms', 'errors'))
+        for name, result in current['results'].items():
+            if 'skipped' in result:
+                print('{:<20} skipped: {}'.format(name, result['skipped']))
+                continue
+            print('{:<20} {:>8} {:>10.1f} {:>10.2f} {:>10.2f} {:>7}'.format(
+                name, result['requests'], result['throughput'],
+                result['latency']['p50'] * 1000,
+                result['latency']['p95'] * 1000, result['error_count']))
+        if comparisons:
+            print()
+            print('{:<20} {:>12} {:>12} {:>10}'.format(
+                'benchmark', 'p50 change', 'rate change', ''))
+            for c in comparisons:
+                print('{:<20} {:>+11.1f}% {:>+11.1f}% {:>10}'.format(
+                    c['benchmark'],
+                    (c['p50'] / c['baseline_p50'] - 1) * 100,
+                    (c['throughput'] / c['baseline_throughput'] - 1) * 100,
+                    'REGRESSED' if c['regressed'] else ''))
+
+    if any(c['regressed'] for c in comparisons):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares password hashing throughput for each scheme, serially and on a
+process pool.
+
+    python -m tortuga_test_lib.bench.passwords --count 200
+
+"""
+import argparse
+import json
+import time
+from typing import Dict, List
+
+from tortuga_test_lib.util import passwords
+
+
+def run(count: int = 200, schemes: List[str] = None,
+        processes: int = None) -> Dict[str, Dict[str, float]]:
+    """
+    Runs the benchmark.
+
+    :param int count:          the number of passwords to hash per run
+    :param List[str] schemes:  the schemes to compare, defaults to all of
+                               them
+    :param int processes:      the number of worker processes for the
+                               parallel run
+
+    :return Dict[str, Dict[str, float]]: the hashes per second for each
+                                         scheme, serially and in parallel
+
+    """
+    plain = [passwords.generate_password() for _ in range(count)]
+    results = {}
+
+    for scheme in schemes or passwords.SCHEMES:
+        results[scheme] = {}
+        for mode, mode_processes in [('serial', 1), ('parallel', processes)]:
+            start = time.perf_counter()
+            try:
+                passwords.hash_passwords(plain, scheme,
+                                         processes=mode_processes)
+            except Exception as ex:
+                results[scheme]['error'] = str(ex)
+                break
+            results[scheme][mode] = count / (time.perf_counter() - start)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        '\n')[0])
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--scheme', action='append', dest='schemes',
+                        choices=passwords.SCHEMES)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--json', action='store_true',
+                        help='output the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.count, args.schemes, args.processes)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:<10} {:>12} {:>12}'.format('scheme', 'serial/s', 'parallel/s'))
+    for scheme, result in results.items():
+        if 'error' in result:
+            print('{:<10} {}'.format(scheme, result['error']))
+        else:
+            print('{:<10} {:>12.1f} {:>12.1f}'.format(
+                scheme, result['serial'], result['parallel']))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,15 +12,102 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Tuple
+import concurrent.futures
+import logging
+import os
+import shutil
+from typing import Callable, Iterable, List, Tuple
 import uuid
 
-import boto3
+from botocore.exceptions import ClientError
 
+from tortuga_test_lib import metrics
+
+from .aws_keys import AwsSharedKeyPair
+from .aws_poller import AwsInstancePoller
+from .aws_session import AwsSessionPool
+from .aws_teardown import AwsTeardownQueue
 from .base import CloudProviderLauncher
+from .journal import InstanceJournal
+from .ratelimit import ClientRateLimiter
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# How long to wait for instances to change state, and how much longer to
+# give the poller to report that the wait timed out
+#
+WAIT_TIMEOUT = 600
+WAIT_GRACE = 60
 
 
 class AwsLauncher(CloudProviderLauncher):
+    KEY_MODES = ['instance', 'shared']
+
+    def __init__(self, max_pool_connections: int = 50,
+                 max_attempts: int = 10,
+                 session_factory: Callable[..., object] = None,
+                 key_mode: str = 'instance', key_dir: str = None,
+                 journal_path: str = '~/.tortuga-test-lib/aws-instances.jsonl',
+                 api_rate: float = None):
+        """
+        Initialization.
+
+        :param int max_pool_connections: the maximum number of HTTP
+                                         connections kept open by each
+                                         client
+        :param int max_attempts:         the maximum number of attempts for
+                                         each API call, including retries
+        :param Callable session_factory: creates a boto3 session for a
+                                         region, i.e. a fake for testing
+        :param str key_mode:             "instance" creates a key pair for
+                                         each launch, "shared" generates
+                                         one key locally, and imports it
+                                         once per region for all launches
+        :param str key_dir:              in shared mode, the directory to
+                                         keep the key in between runs,
+                                         defaults to a temporary directory
+        :param str journal_path:         the journal of launched instances,
+                                         used to clean up after runs that
+                                         crashed, None keeps it in memory
+        :param float api_rate:           if set, rate limits the API calls
+                                         in each region, starting at this
+                                         many per second, and adapting to
+                                         throttling, rather than relying
+                                         on botocore's adaptive retries
+
+        """
+        if key_mode not in self.KEY_MODES:
+            raise Exception('Unsupported key mode: {}'.format(key_mode))
+
+        self.rate_limiter = None
+        if api_rate:
+            self.rate_limiter = ClientRateLimiter(float(api_rate))
+
+        self.session_pool = AwsSessionPool(
+            max_pool_connections=max_pool_connections,
+            max_attempts=max_attempts,
+            retry_mode='standard' if self.rate_limiter else 'adaptive',
+            session_factory=session_factory,
+            client_created=self.rate_limiter.install
+            if self.rate_limiter else None
+        )
+        self.key_mode = key_mode
+        self.journal = InstanceJournal(journal_path)
+        self._shared_key = AwsSharedKeyPair(
+            lambda region: self.session_pool.client('ec2', region),
+            key_dir=key_dir
+        )
+        self.poller = AwsInstancePoller(
+            lambda region: self.session_pool.client('ec2', region))
+        self._teardown_queue = AwsTeardownQueue(
+            lambda region: self.session_pool.client('ec2', region),
+            on_terminated=self._instance_terminated,
+            poller=self.poller
+        )
+
     def _build_identifier(self) -> str:
         """
 
@@ -41,55 +128,316 @@ class AwsLauncher(CloudProviderLauncher):
         #
         identifier = self._build_identifier()
         
-        ec2 = boto3.resource('ec2', region_name=region)
+        ec2 = self.session_pool.resource('ec2', region)
 
         #
         # Create the key pair
         #
-        private_key = self._create_key_pair(ec2, identifier)
+        key_pair, private_key = self._acquire_key_pair(ec2, region,
+                                                       identifier)
 
         #
         # Crate the instance
         #
-        instance_list = ec2.create_instances(
-            IamInstanceProfile={
-                'Name' : instance_profile
-            },
-            ImageId=image_id,
-            InstanceType=instance_type,
-            MinCount=1,
-            MaxCount=1,
-            KeyName=identifier,
-            TagSpecifications=[
-                {
-                    'ResourceType': 'instance',
-                    'Tags': [
-                        {
-                            'Key': 'Name',
-                            'Value': identifier
-                        },
-                        {
-                            'Key': 'KeyPair',
-                            'Value': identifier
-                        },
-                    ]
-                },
-            ],
-            SubnetId=subnet_id,
-            SecurityGroupIds=[
-                security_group_id
-            ]
-        )
-        instance = instance_list[0]
-        instance.wait_until_running()
+        try:
+            instance_list = self._create_instances(
+                ec2, identifier, 1, security_group_id, subnet_id, image_id,
+                instance_type, instance_profile, key_pair=key_pair)
+
+        except Exception:
+            self._release_key_pair(region, key_pair)
+            raise
+        instance_id = instance_list[0].id
+        self._journal_launched(region, [instance_id],
+                               key_pair or identifier, private_key)
+
+        #
+        # The poller returns the described instance, so the public
+        # hostname, and other associated data is populated
+        #
+        with metrics.phase('running_wait'):
+            instance = self._wait_result(self.poller.wait_for(
+                region, instance_id, ['running'],
+                fail_states=['shutting-down', 'terminated'],
+                timeout=WAIT_TIMEOUT
+            ))
+        self.journal.record([instance_id], state='running',
+                            hostname=instance['PublicDnsName'])
+
+        return instance_id, instance['PublicDnsName'], 'centos', private_key
+
+    def launch_vms(self,
+                   count: int,
+                   region: str,
+                   security_group_id: str,
+                   subnet_id: str,
+                   image_id: str,
+                   instance_type: str,
+                   instance_profile: str,
+                   **kwargs) -> List[Tuple[str, str, str, str]]:
+        #
+        # All of the instances in the batch share the same identifier, and
+        # therefore the same key pair
+        #
+        identifier = self._build_identifier()
+
+        ec2 = self.session_pool.resource('ec2', region)
+
+        key_pair, private_key = self._acquire_key_pair(ec2, region,
+                                                       identifier, count)
+
+        #
+        # Create all of the instances in a single request. A MinCount of 1
+        # lets EC2 launch fewer instances than requested if capacity is
+        # short, rather than failing the whole request.
+        #
+        try:
+            instance_list = self._create_instances(
+                ec2, identifier, count, security_group_id, subnet_id,
+                image_id, instance_type, instance_profile, min_count=1,
+                key_pair=key_pair)
+
+        except Exception:
+            self._release_key_pair(region, key_pair, count)
+            raise
+        instance_ids = [instance.id for instance in instance_list]
+        self._journal_launched(region, instance_ids, key_pair or identifier,
+                               private_key)
 
         #
-        # Re-load the instance so that the public hostname, and other
-        # associated data is populated
+        # Wait for all of the instances together, and split them into the
+        # ones that came up, and the ones that did not
         #
-        instance = ec2.Instance(instance.id)
+        futures = self.poller.wait_all(
+            region, instance_ids, ['running'],
+            fail_states=['shutting-down', 'terminated'],
+            timeout=WAIT_TIMEOUT)
+        running = []
+        failed = []
+        with metrics.phase('running_wait'):
+            for instance_id, future in zip(instance_ids, futures):
+                try:
+                    instance = self._wait_result(future)
+
+                except Exception as ex:
+                    logger.warning(str(ex))
+                    failed.append(instance_id)
+                    continue
+
+                running.append(instance)
+                self.journal.record([instance_id], state='running',
+                                    hostname=instance['PublicDnsName'])
+
+        #
+        # Instances that did not start go through the teardown queue, so
+        # their key pair references are released once they are terminated
+        #
+        if failed:
+            logger.warning('Cleaning up failed instances: {}'.format(
+                ', '.join(failed)))
+            for instance_id in failed:
+                self.queue_delete_vm(region, instance_id)
+
+        #
+        # Drop the references held for instances that were not launched
+        #
+        if self.key_mode == 'shared' and count > len(instance_ids):
+            self._shared_key.release(region, count - len(instance_ids))
+
+        if not running:
+            raise Exception('None of the {} instances started'.format(count))
 
-        return instance.id, instance.public_dns_name, 'centos', private_key
+        return [
+            (instance['InstanceId'], instance['PublicDnsName'], 'centos',
+             private_key)
+            for instance in running
+        ]
+
+    def _create_instances(self, ec2_resource, identifier: str, count: int,
+                          security_group_id: str, subnet_id: str,
+                          image_id: str, instance_type: str,
+                          instance_profile: str,
+                          min_count: int = None,
+                          key_pair: str = None) -> list:
+        """
+        Creates one or more instances, tagged with the identifier and
+        using the key pair of the same name, or a shared key pair.
+
+        :param ec2_resource:
+        :param str identifier:
+        :param int count:     the maximum number of instances to create
+        :param str security_group_id:
+        :param str subnet_id:
+        :param str image_id:
+        :param str instance_type:
+        :param str instance_profile:
+        :param int min_count: the minimum number of instances to create,
+                              defaults to count
+        :param str key_pair:  the name of a shared key pair, which is
+                              tagged as SharedKeyPair rather than KeyPair,
+                              so it is not deleted with the instance
+
+        :return list: the created instances
+
+        """
+        if min_count is None:
+            min_count = count
+
+        if key_pair is None:
+            key_pair_tag = {'Key': 'KeyPair', 'Value': identifier}
+            key_pair = identifier
+        else:
+            key_pair_tag = {'Key': 'SharedKeyPair', 'Value': key_pair}
+
+        with metrics.phase('instance_create'):
+            return ec2_resource.create_instances(
+                IamInstanceProfile={
+                    'Name' : instance_profile
+                },
+                ImageId=image_id,
+                InstanceType=instance_type,
+                MinCount=min_count,
+                MaxCount=count,
+                KeyName=key_pair,
+                TagSpecifications=[
+                    {
+                        'ResourceType': 'instance',
+                        'Tags': [
+                            {
+                                'Key': 'Name',
+                                'Value': identifier
+                            },
+                            key_pair_tag,
+                        ]
+                    },
+                ],
+                SubnetId=subnet_id,
+                SecurityGroupIds=[
+                    security_group_id
+                ]
+            )
+
+    def _acquire_key_pair(self, ec2_resource, region: str, identifier: str,
+                          count: int = 1) -> Tuple[str, str]:
+        """
+        Gets a key pair for new instances, depending on the key mode.
+
+        :param ec2_resource:
+        :param str region:
+        :param str identifier: the name for a new key pair
+        :param int count:      the number of instances that will use it
+
+        :return Tuple[str, str]: the shared key pair name, or None if a new
+                                 key pair was created, and the path to the
+                                 private key
+
+        """
+        if self.key_mode == 'shared':
+            return self._shared_key.acquire(region, count)
+
+        return None, self._create_key_pair(ec2_resource, identifier)
+
+    def _release_key_pair(self, region: str, key_pair: str, count: int = 1):
+        """
+        Releases a key pair from _acquire_key_pair, when the instances
+        could not be created.
+
+        """
+        if key_pair:
+            self._shared_key.release(region, count)
+
+    def _release_shared_key(self, region: str, key_pair: str):
+        """
+        Drops a terminated instance's reference to the shared key pair, if
+        it used it.
+
+        :param str region:
+        :param str key_pair: the instance's key pair
+
+        """
+        if key_pair and key_pair == self._shared_key.name:
+            self._shared_key.release(region)
+
+    def _instance_terminated(self, region: str, instance: dict):
+        """
+        Called by the teardown queue when an instance is terminated.
+
+        :param str region:
+        :param dict instance: the instance, as described by EC2
+
+        """
+        entry = self.journal.get(instance['InstanceId'])
+        self.journal.record([instance['InstanceId']], state='terminated')
+        self._release_instance_key(region, entry, instance.get('Tags'))
+
+    def _release_instance_key(self, region: str, entry: dict,
+                              tags: List[dict] = None):
+        """
+        Releases the key pair of an instance that has been terminated.
+
+        Instances launched together share a key pair, which is kept, along
+        with its private key, until nothing left in the journal uses it.
+        References to the shared key pair are dropped one at a time.
+
+        :param str region:
+        :param dict entry:  the instance's journal entry, or None if it
+                            isn't in the journal
+        :param list tags:   the instance's tags, used to find the key pair
+                            when it isn't in the journal
+
+        """
+        key_pair = None
+        shared_key_pair = None
+        if entry:
+            if entry.get('key_shared'):
+                shared_key_pair = entry.get('key_pair')
+            else:
+                key_pair = entry.get('key_pair')
+        else:
+            for tag in tags or []:
+                if tag['Key'] == 'KeyPair':
+                    key_pair = tag['Value']
+                elif tag['Key'] == 'SharedKeyPair':
+                    shared_key_pair = tag['Value']
+
+        if key_pair and not any(e.get('key_pair') == key_pair
+                                for e in self.journal.active()):
+            try:
+                self._delete_key_pair(
+                    self.session_pool.resource('ec2', region), key_pair)
+            except ClientError:
+                logger.warning('Error deleting key pair: {}'.format(
+                    key_pair), exc_info=True)
+            if entry and entry.get('key_path') and \
+                    os.path.exists(entry['key_path']):
+                os.unlink(entry['key_path'])
+
+        self._release_shared_key(region, shared_key_pair)
+
+    def _wait_result(self, future: concurrent.futures.Future) -> dict:
+        """
+        Gets the result of a poller wait, without blocking forever if the
+        poller never resolves it.
+
+        :param Future future: the wait, from the poller
+
+        :return dict: the instance, as described by EC2
+
+        """
+        try:
+            return future.result(WAIT_TIMEOUT + WAIT_GRACE)
+
+        except concurrent.futures.TimeoutError:
+            raise Exception(
+                'Timed out waiting for the instance poller after {} '
+                'seconds'.format(WAIT_TIMEOUT + WAIT_GRACE))
+
+    def _journal_launched(self, region: str, instance_ids: List[str],
+                          key_pair: str, key_path: str):
+        self.journal.record(instance_ids, region=region, key_pair=key_pair,
+                            key_path=key_path,
+                            key_shared=self.key_mode == 'shared',
+                            state='pending')
 
     def _create_key_pair(self, ec2_resource, key_pair_name: str) -> str:
         """
@@ -101,7 +449,8 @@ class AwsLauncher(CloudProviderLauncher):
         :return: the path to the private key
 
         """
-        key_pair = ec2_resource.create_key_pair(KeyName=key_pair_name)
+        with metrics.phase('key_pair_create'):
+            key_pair = ec2_resource.create_key_pair(KeyName=key_pair_name)
         private_key_path = '/tmp/{}.pem'.format(key_pair_name)
 
         with open(private_key_path, 'w') as fp:
@@ -110,29 +459,29 @@ class AwsLauncher(CloudProviderLauncher):
         return private_key_path
 
     def delete_vm(self, region: str, instance_id: str):
-        ec2 = boto3.resource('ec2', region_name=region)
+        ec2 = self.session_pool.resource('ec2', region)
         #
         # Get the instance
         #
         instance = ec2.Instance(instance_id)
 
         #
-        # Get the identifier
+        # Get the key pair from the journal, falling back to loading the
+        # instance tags for instances launched before it was kept
         #
-        key_pair = None
-        for tag in instance.tags:
-            if tag['Key'] == 'KeyPair':
-                key_pair = tag['Value']
-                break
+        entry = self.journal.get(instance_id)
+        tags = None if entry else instance.tags
 
         #
         # Terminate the instance
         #
-        instance.terminate()
-        instance.wait_until_terminated()
-
-        if key_pair:
-            self._delete_key_pair(ec2, key_pair)
+        self.journal.record([instance_id], state='terminating')
+        with metrics.phase('terminate_wait'):
+            instance.terminate()
+            self._wait_result(self.poller.wait_for(
+                region, instance_id, ['terminated'], timeout=WAIT_TIMEOUT))
+        self.journal.record([instance_id], state='terminated')
+        self._release_instance_key(region, entry, tags)
 
     def _delete_key_pair(self, ec2_resource, key_pair_name: str):
         """
@@ -142,5 +491,95 @@ class AwsLauncher(CloudProviderLauncher):
         :param key_pair_name:
 
         """
-        key_pair = ec2_resource.KeyPair(key_pair_name)
-        key_pair.delete()
+        with metrics.phase('key_pair_delete'):
+            key_pair = ec2_resource.KeyPair(key_pair_name)
+            key_pair.delete()
+
+    def queue_delete_vm(self, region: str, instance_id: str):
+        self.journal.record([instance_id], state='terminating')
+        self._teardown_queue.put(region, instance_id)
+
+    def cleanup_leaked_vms(self, exclude: Iterable[str] = (),
+                           include_live: bool = False,
+                           timeout: float = None,
+                           dry_run: bool = False,
+                           stale_after: float = None) -> List[str]:
+        #
+        # Find the instances in the journal that are still alive, and that
+        # were created by processes that have exited, or on other hosts a
+        # long time ago
+        #
+        exclude = set(exclude)
+        leaked = []
+        kept = []
+        for entry in self.journal.active():
+            if entry['instance_id'] in exclude or \
+                    (not include_live and
+                     self.journal.is_owner_alive(entry, stale_after)):
+                kept.append(entry)
+            else:
+                leaked.append(entry)
+
+        if dry_run or not leaked:
+            return [entry['instance_id'] for entry in leaked]
+
+        #
+        # Terminate all of them through the teardown queue, which batches
+        # them into one call per region, and releases their own key pairs
+        # once all of the instances using them are gone
+        #
+        logger.info('Cleaning up {} leaked instances'.format(len(leaked)))
+        for entry in leaked:
+            self.queue_delete_vm(entry['region'], entry['instance_id'])
+        if not self.flush_teardown(timeout):
+            logger.warning('Timed out waiting for leaked instances to '
+                           'terminate')
+
+        #
+        # Shared key pairs, and local keys, are cleaned up once nothing
+        # left in the journal uses them
+        #
+        in_use = {entry.get('key_pair') for entry in kept}
+        in_use.add(self._shared_key.name)
+        for region, key_pair in sorted({(entry['region'], entry['key_pair'])
+                                        for entry in leaked
+                                        if entry.get('key_shared')}):
+            if key_pair in in_use:
+                continue
+            logger.info('Deleting key pair: {}'.format(key_pair))
+            try:
+                self.session_pool.client('ec2', region).delete_key_pair(
+                    KeyName=key_pair)
+            except ClientError:
+                logger.warning('Error deleting key pair: {}'.format(
+                    key_pair), exc_info=True)
+
+        for entry in leaked:
+            key_path = entry.get('key_path')
+            if not key_path or entry.get('key_pair') in in_use:
+                continue
+            key_dir = os.path.dirname(key_path)
+            if os.path.basename(key_dir).startswith(
+                    'tortuga-test-lib-keys-'):
+                shutil.rmtree(key_dir, ignore_errors=True)
+            elif not entry.get('key_shared') and os.path.exists(key_path):
+                os.unlink(key_path)
+
+        self.journal.compact()
+
+        return [entry['instance_id'] for entry in leaked]
+
+    def flush_teardown(self, timeout: float = None) -> bool:
+        return self._teardown_queue.flush(timeout)
+
+    def get_stats(self) -> dict:
+        stats = {
+            'session_pool': self.session_pool.stats(),
+            'shared_key_pairs': self._shared_key.stats()
+        }
+        if self.rate_limiter:
+            stats['api_rate_limits'] = self.rate_limiter.stats()
+
+        stats['poller'] = self.poller.stats()
+
+        return stats
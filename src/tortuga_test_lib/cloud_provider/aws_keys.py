@@ -0,0 +1,221 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import Callable, Dict, Tuple
+
+from botocore.exceptions import ClientError
+
+from tortuga_test_lib import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class AwsSharedKeyPair:
+    """
+    A single SSH key, generated locally, and imported as an EC2 key pair
+    once per region, to be shared by many instances.
+
+    Each region's key pair is reference counted by the instances using it,
+    and deleted when the last of them is gone. The local key is kept in a
+    private directory, which is removed once no region is using it, unless
+    the directory was given, in which case the key is kept and reused, i.e.
+    for instances kept in a pool between runs.
+
+    """
+    def __init__(self, client_factory: Callable[[str], object],
+                 key_dir: str = None, key_type: str = 'rsa'):
+        """
+        Initialization.
+
+        :param Callable client_factory: returns an EC2 client for a region
+        :param str key_dir:             the directory to keep the key in,
+                                        defaults to a temporary directory
+        :param str key_type:            the ssh-keygen key type, rsa or
+                                        ed25519
+
+        """
+        self._client_factory = client_factory
+        self.key_dir = os.path.expanduser(key_dir) if key_dir else None
+        self.key_type = key_type
+
+        self.name: str = None
+        self.key_path: str = None
+        self._dir: str = None
+        self._public_key: bytes = None
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._atexit = False
+
+    def _generate(self):
+        """
+        Generates the key, or loads it if it already exists in the key
+        directory.
+
+        """
+        if self.key_dir:
+            os.makedirs(self.key_dir, mode=0o700, exist_ok=True)
+            self._dir = self.key_dir
+        else:
+            #
+            # mkdtemp creates the directory readable by the owner only
+            #
+            self._dir = tempfile.mkdtemp(prefix='tortuga-test-lib-keys-')
+
+        key_path = os.path.join(self._dir, 'id_{}'.format(self.key_type))
+        if not os.path.exists(key_path):
+            with metrics.phase('key_generate'):
+                proc = subprocess.run(
+                    ['ssh-keygen', '-q', '-t', self.key_type, '-N', '',
+                     '-C', 'tortuga-test-lib', '-f', key_path],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+            if proc.returncode != 0:
+                raise Exception('Unable to generate key: {}'.format(
+                    proc.stderr.decode().strip()))
+
+        with open('{}.pub'.format(key_path), 'rb') as fp:
+            self._public_key = fp.read()
+
+        #
+        # The name is derived from the key, so a kept key always maps to
+        # the same key pair
+        #
+        self.name = 'tortuga-test-lib-shared-{}'.format(
+            hashlib.sha256(self._public_key).hexdigest()[:16])
+        self.key_path = key_path
+
+        if not self._atexit:
+            atexit.register(self.close)
+            self._atexit = True
+
+    def acquire(self, region: str, count: int = 1) -> Tuple[str, str]:
+        """
+        Adds references to the key pair in a region, importing it if this
+        is the first.
+
+        :param str region:
+        :param int count:  the number of references to add, i.e. one for
+                           each instance
+
+        :return Tuple[str, str]: the key pair name, and the path to the
+                                 private key
+
+        """
+        with self._lock:
+            if self.key_path is None:
+                self._generate()
+
+            if region not in self._refs:
+                client = self._client_factory(region)
+                logger.info('Importing key pair {} into {}'.format(
+                    self.name, region))
+                try:
+                    with metrics.phase('key_pair_create'):
+                        client.import_key_pair(
+                            KeyName=self.name,
+                            PublicKeyMaterial=self._public_key
+                        )
+
+                except ClientError as ex:
+                    #
+                    # A kept key may still be registered from a previous run
+                    #
+                    if ex.response['Error']['Code'] != \
+                            'InvalidKeyPair.Duplicate':
+                        raise
+                self._refs[region] = 0
+
+            self._refs[region] += count
+
+            return self.name, self.key_path
+
+    def release(self, region: str, count: int = 1):
+        """
+        Removes references to the key pair in a region, deleting it when
+        none are left.
+
+        :param str region:
+        :param int count:  the number of references to remove
+
+        """
+        with self._lock:
+            #
+            # Instances kept in a pool from a previous run were never
+            # counted
+            #
+            if region not in self._refs:
+                return
+
+            self._refs[region] -= count
+            if self._refs[region] > 0:
+                return
+            del self._refs[region]
+
+            self._delete(region)
+            if not self._refs:
+                self._remove_local()
+
+    def _delete(self, region: str):
+        logger.info('Deleting key pair {} from {}'.format(self.name, region))
+        try:
+            with metrics.phase('key_pair_delete'):
+                self._client_factory(region).delete_key_pair(
+                    KeyName=self.name)
+
+        except ClientError:
+            logger.warning('Error deleting key pair: {}'.format(self.name),
+                           exc_info=True)
+
+    def _remove_local(self):
+        #
+        # Kept keys are left for the next run
+        #
+        if self.key_dir or self._dir is None:
+            return
+
+        shutil.rmtree(self._dir, ignore_errors=True)
+        self._dir = None
+        self.key_path = None
+        self.name = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return Dict[str, int]: the number of references in each region
+
+        """
+        with self._lock:
+            return dict(self._refs)
+
+    def close(self):
+        """
+        Called on exit, deletes the key pair from every region that still
+        has it, and removes the local key. Instances that are still running
+        keep working without the key pair.
+
+        """
+        with self._lock:
+            for region in list(self._refs):
+                self._delete(region)
+            self._refs = {}
+            self._remove_local()
@@ -0,0 +1,283 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List
+
+from tortuga_test_lib import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# EC2 limits the number of values in a single filter
+#
+DESCRIBE_BATCH_SIZE = 200
+
+
+def describe_instances(client, instance_ids: List[str]) -> List[dict]:
+    """
+    Describes instances in batches. Filtering by instance id, rather than
+    passing InstanceIds, means instances that don't exist, or aren't
+    visible yet, are left out, rather than failing the whole call.
+
+    :param client:                 the EC2 client
+    :param List[str] instance_ids:
+
+    :return List[dict]: the instances that were found
+
+    """
+    instances = []
+    for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+        paginator = client.get_paginator('describe_instances')
+        for page in paginator.paginate(Filters=[{
+            'Name': 'instance-id',
+            'Values': instance_ids[i:i + DESCRIBE_BATCH_SIZE]
+        }]):
+            for reservation in page['Reservations']:
+                instances.extend(reservation['Instances'])
+
+    return instances
+
+
+class _Wait:
+    def __init__(self, instance_id: str, states: Iterable[str],
+                 fail_states: Iterable[str], timeout: float):
+        self.instance_id = instance_id
+        self.states = set(states)
+        self.fail_states = set(fail_states)
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.future = Future()
+
+
+class AwsInstancePoller:
+    """
+    Waits for EC2 instances to reach a state, with one background thread
+    for each region polling all of the instances being waited on in a
+    single DescribeInstances call per tick.
+
+    The poll interval starts short, and backs off while nothing changes,
+    so state changes are seen quickly, while the number of API calls stays
+    the same however many instances are in flight.
+
+    """
+    def __init__(self, client_factory: Callable[[str], object],
+                 min_interval: float = 0.5, max_interval: float = 2,
+                 not_found_grace: float = 30):
+        """
+        Initialization.
+
+        :param Callable client_factory: returns an EC2 client for a region
+        :param float min_interval:      the shortest time between polls
+        :param float max_interval:      the longest time between polls
+        :param float not_found_grace:   how long a new instance may be
+                                        missing from the results before the
+                                        wait fails, as EC2 is eventually
+                                        consistent
+
+        """
+        self._client_factory = client_factory
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.not_found_grace = not_found_grace
+
+        self._waits: Dict[str, List[_Wait]] = {}
+        self._threads: Dict[str, threading.Thread] = {}
+        self._new: Dict[str, bool] = {}
+        self._cond = threading.Condition()
+        self._stats: Dict[str, int] = collections.Counter()
+
+    def wait_for(self, region: str, instance_id: str, states: Iterable[str],
+                 fail_states: Iterable[str] = (),
+                 timeout: float = 600) -> Future:
+        """
+        Waits for an instance to reach a state.
+
+        :param str region:
+        :param str instance_id:
+        :param Iterable[str] states:      the states to wait for, if
+                                          terminated is one of them, an
+                                          instance that no longer exists
+                                          has reached it
+        :param Iterable[str] fail_states: states that the instance will
+                                          not come back from
+        :param float timeout:             the maximum number of seconds to
+                                          wait
+
+        :return Future: resolves to the instance, as described by EC2, or
+                        fails if it reaches one of the fail states, or the
+                        timeout expires
+
+        """
+        wait = _Wait(instance_id, states, fail_states, timeout)
+        with self._cond:
+            self._waits.setdefault(region, []).append(wait)
+            self._new[region] = True
+            self._stats['waits'] += 1
+            thread = self._threads.get(region)
+            if thread is None:
+                thread = threading.Thread(
+                    target=self._run, args=(region,),
+                    name='aws-poller-{}'.format(region), daemon=True)
+                self._threads[region] = thread
+                thread.start()
+            self._cond.notify_all()
+
+        return wait.future
+
+    def wait_all(self, region: str, instance_ids: List[str],
+                 states: Iterable[str], fail_states: Iterable[str] = (),
+                 timeout: float = 600) -> List[Future]:
+        return [self.wait_for(region, instance_id, states, fail_states,
+                              timeout)
+                for instance_id in instance_ids]
+
+    def _run(self, region: str):
+        interval = self.min_interval
+        last_poll = time.monotonic()
+
+        while True:
+            with self._cond:
+                while True:
+                    if not self._waits.get(region):
+                        del self._threads[region]
+                        return
+
+                    #
+                    # New waits reset the interval, so they are seen
+                    # promptly
+                    #
+                    if self._new.get(region):
+                        self._new[region] = False
+                        interval = self.min_interval
+                    remaining = last_poll + interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                waits = list(self._waits[region])
+
+            last_poll = time.monotonic()
+            try:
+                changed = self._poll(region, waits)
+
+            except Exception as ex:
+                logger.exception('Error polling instances in {}'.format(
+                    region))
+                changed = self._expire(region, waits, ex)
+
+            if changed:
+                interval = self.min_interval
+            else:
+                interval = min(interval * 1.5, self.max_interval)
+
+    def _poll(self, region: str, waits: List[_Wait]) -> bool:
+        """
+        Polls the instances, and resolves the waits that are done.
+
+        :return bool: True if any waits were resolved
+
+        """
+        client = self._client_factory(region)
+        instance_ids = sorted({wait.instance_id for wait in waits})
+        with metrics.phase('instance_poll'):
+            instances = {instance['InstanceId']: instance for instance in
+                         describe_instances(client, instance_ids)}
+        with self._cond:
+            self._stats['polls'] += 1
+            self._stats['instances_polled'] += len(instance_ids)
+
+        now = time.monotonic()
+        done = []
+        for wait in waits:
+            instance = instances.get(wait.instance_id)
+            state = instance['State']['Name'] if instance else None
+
+            if state in wait.states:
+                wait.future.set_result(instance)
+
+            elif instance is None and 'terminated' in wait.states:
+                wait.future.set_result({'InstanceId': wait.instance_id,
+                                        'State': {'Name': 'terminated'}})
+
+            elif state in wait.fail_states:
+                wait.future.set_exception(Exception(
+                    'Instance {} entered state {}'.format(
+                        wait.instance_id, state)))
+
+            elif instance is None and \
+                    now - wait.started > self.not_found_grace:
+                wait.future.set_exception(Exception(
+                    'Instance not found: {}'.format(wait.instance_id)))
+
+            elif now > wait.deadline:
+                wait.future.set_exception(Exception(
+                    'Timed out waiting for instance {} to be {}'.format(
+                        wait.instance_id, ' or '.join(sorted(wait.states)))))
+
+            else:
+                continue
+
+            done.append(wait)
+
+        self._remove(region, done)
+
+        return bool(done)
+
+    def _expire(self, region: str, waits: List[_Wait],
+                error: Exception) -> bool:
+        """
+        Fails the waits that are past their deadline when polling fails,
+        so that a region that can't be polled doesn't block them forever.
+
+        :param str region:
+        :param List[_Wait] waits: the waits that were being polled
+        :param Exception error:   the error polling them
+
+        :return bool: True if any waits were expired
+
+        """
+        now = time.monotonic()
+        expired = [wait for wait in waits if now > wait.deadline]
+        for wait in expired:
+            wait.future.set_exception(Exception(
+                'Timed out waiting for instance {} to be {}: {}'.format(
+                    wait.instance_id, ' or '.join(sorted(wait.states)),
+                    error)))
+
+        self._remove(region, expired)
+
+        return bool(expired)
+
+    def _remove(self, region: str, done: List[_Wait]):
+        if not done:
+            return
+        with self._cond:
+            self._waits[region] = [wait for wait in self._waits[region]
+                                   if wait not in done]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return Dict[str, int]: the number of waits, polls, and instances
+                                polled, and the number being waited on
+
+        """
+        with self._cond:
+            return dict(self._stats, pending=sum(
+                len(waits) for waits in self._waits.values()))
@@ -0,0 +1,165 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from typing import Callable, Dict, Tuple
+
+import boto3
+from botocore.config import Config
+
+
+class AwsSessionPool:
+    """
+    A thread-safe cache of boto3 sessions, clients and resources, keyed by
+    region.
+
+    Creating a session, client or resource resolves credentials, loads
+    endpoint and service data, and sets up a new HTTP connection pool, so
+    they are created once and reused. Sessions and clients are shared
+    between threads. Resources are not thread-safe, so each thread gets its
+    own resource, built from the shared session.
+
+    """
+    def __init__(self, max_pool_connections: int = 50,
+                 max_attempts: int = 10, retry_mode: str = 'adaptive',
+                 session_factory: Callable[..., object] = None,
+                 client_created: Callable[[object, str, str], None] = None):
+        """
+        Initialization.
+
+        :param int max_pool_connections: the maximum number of HTTP
+                                         connections kept open by each
+                                         client
+        :param int max_attempts:         the maximum number of attempts for
+                                         each API call, including retries
+        :param str retry_mode:           the botocore retry mode, "adaptive"
+                                         also rate limits the client when
+                                         it is throttled
+        :param Callable session_factory: creates a session for a region,
+                                         given as region_name, defaults to
+                                         boto3.session.Session
+        :param Callable client_created:  called with each new client, and
+                                         the client of each new resource,
+                                         along with the service and region,
+                                         i.e. to register event handlers
+
+        """
+        self.session_factory = session_factory or boto3.session.Session
+        self.client_created = client_created
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={
+                'mode': retry_mode,
+                'max_attempts': max_attempts
+            }
+        )
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._sessions: Dict[str, boto3.session.Session] = {}
+        self._clients: Dict[Tuple[str, str], object] = {}
+        self._hits = {'session': 0, 'client': 0, 'resource': 0}
+        self._misses = {'session': 0, 'client': 0, 'resource': 0}
+
+    def session(self, region: str) -> boto3.session.Session:
+        """
+        Gets the session for a region.
+
+        :param str region:
+
+        :return boto3.session.Session: the session
+
+        """
+        with self._lock:
+            session = self._sessions.get(region)
+            if session is None:
+                self._misses['session'] += 1
+                session = self.session_factory(region_name=region)
+                self._sessions[region] = session
+            else:
+                self._hits['session'] += 1
+
+            return session
+
+    def client(self, service: str, region: str):
+        """
+        Gets the client for a service in a region.
+
+        :param str service: the service name, i.e. "ec2"
+        :param str region:
+
+        :return: the boto3 client
+
+        """
+        key = (service, region)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                self._misses['client'] += 1
+                client = self.session(region).client(service,
+                                                     config=self.config)
+                if self.client_created:
+                    self.client_created(client, service, region)
+                self._clients[key] = client
+            else:
+                self._hits['client'] += 1
+
+            return client
+
+    def resource(self, service: str, region: str):
+        """
+        Gets the resource for a service in a region, for the current thread.
+
+        :param str service: the service name, i.e. "ec2"
+        :param str region:
+
+        :return: the boto3 resource
+
+        """
+        resources = getattr(self._local, 'resources', None)
+        if resources is None:
+            resources = self._local.resources = {}
+
+        key = (service, region)
+        resource = resources.get(key)
+        with self._lock:
+            if resource is None:
+                self._misses['resource'] += 1
+                #
+                # Sessions aren't safe to use from several threads at once,
+                # so the resource is created while holding the lock
+                #
+                resource = self.session(region).resource(service,
+                                                         config=self.config)
+                if self.client_created:
+                    self.client_created(resource.meta.client, service,
+                                        region)
+                resources[key] = resource
+            else:
+                self._hits['resource'] += 1
+
+        return resource
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Gets the cache hit and miss counts.
+
+        :return Dict[str, Dict[str, int]]: the hits and misses, for each
+                                           of session, client and resource
+
+        """
+        with self._lock:
+            return {
+                'hits': dict(self._hits),
+                'misses': dict(self._misses)
+            }
@@ -0,0 +1,358 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import functools
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from botocore.exceptions import ClientError
+
+from .aws_poller import AwsInstancePoller, describe_instances
+
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class AwsTeardownQueue:
+    """
+    A background queue for terminating EC2 instances.
+
+    Instance ids are collected, and terminated in batches with a single
+    TerminateInstances call per region. The instances are then polled in
+    bulk, by the shared poller if there is one, and once they reach the
+    terminated state, on_terminated is called, i.e. to release their key
+    pairs. Instances that could not be terminated, for example because
+    the endpoint could not be reached, are queued again, and retried with
+    an increasing delay.
+
+    """
+    def __init__(self, client_factory: Callable[[str], object],
+                 batch_size: int = 100, batch_delay: float = 1,
+                 poll_interval: float = 5,
+                 on_terminated: Callable[[str, dict], None] = None,
+                 poller: AwsInstancePoller = None,
+                 max_retry_delay: float = 60):
+        """
+        Initialization.
+
+        :param Callable client_factory: returns an EC2 client for a region
+        :param int batch_size:          the maximum number of instances to
+                                        terminate in a single call
+        :param float batch_delay:       how long to wait for more instances
+                                        to be queued before terminating a
+                                        batch
+        :param float poll_interval:     how often to check the state of
+                                        terminating instances
+        :param Callable on_terminated:  called with the region, and the
+                                        described instance, once an
+                                        instance is terminated
+        :param AwsInstancePoller poller: polls the terminating instances,
+                                        rather than the queue's own thread
+        :param float max_retry_delay:   the longest time to wait before
+                                        retrying after an error
+
+        """
+        self._client_factory = client_factory
+        self._on_terminated = on_terminated
+        self._poller = poller
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.poll_interval = poll_interval
+        self.max_retry_delay = max_retry_delay
+
+        #
+        # Instances waiting to be terminated, and instances that are
+        # terminating, by region
+        #
+        self._pending: Dict[str, Set[str]] = {}
+        self._terminating: Dict[str, Set[str]] = {}
+
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._failures = 0
+
+    def put(self, region: str, instance_id: str):
+        """
+        Queues an instance to be terminated.
+
+        :param str region:
+        :param str instance_id:
+
+        """
+        with self._cond:
+            self._pending.setdefault(region, set()).add(instance_id)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='aws-teardown', daemon=True)
+                self._thread.start()
+                atexit.register(self._stop)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Blocks until all queued instances have been terminated, and
+        on_terminated has been called for them.
+
+        :param float timeout: the maximum number of seconds to wait, or
+                              None to wait forever
+
+        :return bool: True if the queue is empty, False if the timeout
+                      expired first
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while self._pending or self._terminating:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+
+        return True
+
+    def _stop(self):
+        """
+        Called on exit. Rather than waiting for instances to finish
+        terminating, the remaining instances are terminated, and
+        on_terminated is called for them straight away, so their key pairs
+        are released. Instances that are already running keep working
+        without the key pair.
+
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+
+        try:
+            self._terminate_pending()
+        except Exception:
+            logger.warning('Instances left to terminate on exit: {}'.format(
+                ', '.join(sorted(itertools.chain.from_iterable(
+                    self._pending.values())))))
+        with self._cond:
+            terminating = self._terminating
+            self._terminating = {}
+        for region, instance_ids in terminating.items():
+            client = self._client_factory(region)
+            for instance in self._describe(client, sorted(instance_ids)):
+                self._terminated(region, instance)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._pending or self._stopping or
+                           (self._terminating and not self._poller)):
+                    self._cond.wait()
+                if self._stopping:
+                    return
+
+                #
+                # Give callers a chance to queue more instances, so they
+                # can be terminated in the same batch
+                #
+                delay = self.batch_delay if self._pending \
+                    else self.poll_interval
+
+                #
+                # Back off after errors, so that an endpoint that is down
+                # isn't hammered
+                #
+                if self._failures:
+                    delay = max(delay, min(
+                        self.poll_interval * 2 ** (self._failures - 1),
+                        self.max_retry_delay))
+                deadline = time.monotonic() + delay
+                while not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+
+            try:
+                self._terminate_pending()
+                if not self._poller:
+                    self._reap_terminated()
+                self._failures = 0
+
+            except Exception:
+                logger.exception('Error processing the teardown queue')
+                self._failures += 1
+
+    def _terminate_pending(self):
+        with self._cond:
+            pending = self._pending
+            self._pending = {}
+
+        error = None
+        for region, instance_ids in pending.items():
+            remaining = set(instance_ids)
+            try:
+                client = self._client_factory(region)
+                for batch in _chunks(sorted(instance_ids), self.batch_size):
+                    terminated = self._terminate(client, batch)
+                    remaining.difference_update(batch)
+                    failed = set(batch).difference(terminated)
+                    with self._cond:
+                        self._terminating.setdefault(region, set()).update(
+                            terminated)
+                        #
+                        # Instances that could not be terminated are tried
+                        # again later
+                        #
+                        if failed:
+                            self._pending.setdefault(region, set()).update(
+                                failed)
+                        self._cond.notify_all()
+                    if failed:
+                        error = Exception(
+                            'Failed to terminate instances: {}'.format(
+                                ', '.join(sorted(failed))))
+
+                    #
+                    # Stop polling when exiting, the remaining key pairs are
+                    # deleted straight away
+                    #
+                    if self._poller and not self._stopping:
+                        for instance_id in terminated:
+                            self._poller.wait_for(
+                                region, instance_id, ['terminated']
+                            ).add_done_callback(functools.partial(
+                                self._polled, region, instance_id))
+
+            except Exception as ex:
+                #
+                # Put back the instances that were not terminated, rather
+                # than losing them, and carry on with the other regions
+                #
+                logger.warning('Error terminating instances in {}: '
+                               '{}'.format(region, ex))
+                error = ex
+                with self._cond:
+                    self._pending.setdefault(region, set()).update(remaining)
+                    self._cond.notify_all()
+
+        if error is not None:
+            raise error
+
+    def _terminate(self, client, instance_ids: List[str]) -> List[str]:
+        """
+        Terminates a batch of instances. If the batch fails, for example
+        because one of the instances no longer exists, the instances are
+        terminated one at a time.
+
+        :return List[str]: the instances that were terminated
+
+        """
+        logger.info('Terminating instances: {}'.format(
+            ', '.join(instance_ids)))
+        try:
+            client.terminate_instances(InstanceIds=instance_ids)
+            return instance_ids
+
+        except ClientError as ex:
+            if len(instance_ids) == 1:
+                #
+                # An instance that no longer exists is as good as
+                # terminated, and is reaped as such
+                #
+                if ex.response['Error']['Code'] == \
+                        'InvalidInstanceID.NotFound':
+                    return instance_ids
+                logger.warning('Error terminating instance: {}'.format(
+                    instance_ids[0]), exc_info=True)
+                return []
+
+        terminated = []
+        for instance_id in instance_ids:
+            terminated.extend(self._terminate(client, [instance_id]))
+
+        return terminated
+
+    def _describe(self, client, instance_ids: List[str]) -> List[dict]:
+        return describe_instances(client, instance_ids)
+
+    def _polled(self, region: str, instance_id: str, future):
+        """
+        Called by the poller when a terminating instance is done.
+
+        """
+        try:
+            self._terminated(region, future.result())
+
+        except Exception as ex:
+            logger.warning('Error waiting for instance {} to terminate: '
+                           '{}'.format(instance_id, ex))
+
+        with self._cond:
+            terminating = self._terminating.get(region)
+            if terminating is not None and instance_id in terminating:
+                terminating.discard(instance_id)
+                if not terminating:
+                    del self._terminating[region]
+                self._cond.notify_all()
+
+    def _reap_terminated(self):
+        with self._cond:
+            terminating = {region: sorted(instance_ids)
+                           for region, instance_ids
+                           in self._terminating.items()}
+
+        for region, instance_ids in terminating.items():
+            client = self._client_factory(region)
+            instances = {instance['InstanceId']: instance
+                         for instance in self._describe(client, instance_ids)}
+
+            done = []
+            for instance_id in instance_ids:
+                instance = instances.get(instance_id)
+                #
+                # Instances that can no longer be found are not coming back
+                #
+                if instance is None:
+                    self._terminated(region, {'InstanceId': instance_id})
+                    done.append(instance_id)
+
+                elif instance['State']['Name'] == 'terminated':
+                    self._terminated(region, instance)
+                    done.append(instance_id)
+
+            with self._cond:
+                self._terminating[region].difference_update(done)
+                if not self._terminating[region]:
+                    del self._terminating[region]
+                self._cond.notify_all()
+
+    def _terminated(self, region: str, instance: dict):
+        if self._on_terminated:
+            try:
+                self._on_terminated(region, instance)
+            except Exception:
+                logger.exception('Error handling terminated instance: '
+                                 '{}'.format(instance['InstanceId']))
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Tuple
+from typing import Iterable, List, Tuple
 
 
 class CloudProviderLauncher:
@@ -42,6 +42,38 @@ class CloudProviderLauncher:
         """
         raise NotImplementedError()
 
+    def launch_vms(self,
+                   count: int,
+                   region: str,
+                   security_group_id: str,
+                   subnet_id: str,
+                   image_id: str,
+                   instance_type: str,
+                   instance_profile: str,
+                   **kwargs) -> List[Tuple[str, str, str, str]]:
+        """
+        Launches several identical VM instances in a single request. If
+        some of the instances fail to start, they are cleaned up, and
+        only the ones that are running are returned.
+
+        :param int count: the number of instances to launch
+        :param str region:
+        :param str security_group_id:
+        :param str subnet_id:
+        :param str image_id:
+        :param str instance_type:
+        :param str instance_profile
+        :param kwargs:
+
+        :return List[Tuple[str, str, str, str]]: a list of tuples, each
+                                                 containing the instance id,
+                                                 the public hostname,
+                                                 the ssh username, and ssh
+                                                 key path
+
+        """
+        raise NotImplementedError()
+
     def delete_vm(self, region: str, instance_id: str):
         """
         Deletes a VM instance.
@@ -51,3 +83,64 @@ class CloudProviderLauncher:
 
         """
         raise NotImplementedError()
+
+    def queue_delete_vm(self, region: str, instance_id: str):
+        """
+        Queues a VM instance to be deleted in the background. Launchers
+        that don't support background deletion delete the instance
+        straight away.
+
+        :param str region:
+        :param str instance_id:
+
+        """
+        self.delete_vm(region, instance_id)
+
+    def flush_teardown(self, timeout: float = None) -> bool:
+        """
+        Waits for all queued VM instance deletions to finish.
+
+        :param float timeout: the maximum number of seconds to wait, or
+                              None to wait forever
+
+        :return bool: True if all deletions finished, False if the timeout
+                      expired first
+
+        """
+        return True
+
+    def cleanup_leaked_vms(self, exclude: Iterable[str] = (),
+                           include_live: bool = False,
+                           timeout: float = None,
+                           dry_run: bool = False,
+                           stale_after: float = None) -> List[str]:
+        """
+        Deletes the VM instances left behind by earlier runs, i.e. ones
+        that crashed before deleting them.
+
+        :param Iterable[str] exclude: instance ids to leave alone, i.e. the
+                                      ones kept in a pool
+        :param bool include_live:     also delete instances created by
+                                      processes that are still running
+        :param float timeout:         the maximum number of seconds to
+                                      wait for the deletions
+        :param bool dry_run:          only find the instances, without
+                                      deleting them
+        :param float stale_after:     how long instances launched from
+                                      other hosts, whose processes can't
+                                      be checked, are assumed to be in
+                                      use, in seconds
+
+        :return List[str]: the ids of the leaked instances
+
+        """
+        raise NotImplementedError()
+
+    def get_stats(self) -> dict:
+        """
+        Gets launcher statistics, such as cache hit rates.
+
+        :return dict: the statistics
+
+        """
+        return {}
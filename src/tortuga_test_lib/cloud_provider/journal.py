@@ -0,0 +1,313 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Instances in these states are gone, and no longer need cleaning up
+#
+FINAL_STATES = ['terminated']
+
+#
+# How long instances launched from other hosts are assumed to still be in
+# use, after their last journal record, in seconds
+#
+DEFAULT_STALE_AFTER = 12 * 3600
+
+
+def _boot_id() -> Optional[str]:
+    """
+    :return Optional[str]: an id that changes every time the host boots,
+                           or None if it isn't available
+
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as fp:
+            return fp.read().strip()
+
+    except OSError:
+        return None
+
+
+def _process_start_time(pid: int) -> Optional[int]:
+    """
+    Gets when a process started, in clock ticks since boot, which tells a
+    process apart from a later one that reuses its pid.
+
+    :param int pid:
+
+    :return Optional[int]: the start time, or None if it isn't available
+
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as fp:
+            stat = fp.read()
+
+    except OSError:
+        return None
+
+    #
+    # The command name, in brackets, may contain spaces, so the fields are
+    # counted from after it, starttime is field 22
+    #
+    try:
+        return int(stat[stat.rindex(')') + 2:].split()[19])
+
+    except (ValueError, IndexError):
+        return None
+
+
+class InstanceJournal:
+    """
+    An append-only journal of the instances a launcher creates, with the
+    region, key pair and key path of each one, and its latest state.
+
+    Every change is appended to a JSON lines file, under a file lock, so
+    the journal is shared between robot invocations, and records the
+    instances left behind by runs that crashed. An entry is the merge of
+    all of the records for an instance. Without a path, the journal is
+    only kept in memory.
+
+    """
+    def __init__(self, path: str = None,
+                 stale_after: float = DEFAULT_STALE_AFTER):
+        """
+        Initialization.
+
+        :param str path:          the path to the journal file
+        :param float stale_after: how long instances launched from other
+                                  hosts are assumed to be in use, after
+                                  their last record, in seconds
+
+        """
+        self.path = os.path.expanduser(path) if path else None
+        self.stale_after = stale_after
+        self._entries: Dict[str, dict] = {}
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+        self._owner = {
+            'host': socket.gethostname(),
+            'boot_id': _boot_id(),
+            'pid': os.getpid(),
+            'pid_start': _process_start_time(os.getpid())
+        }
+
+    def _refresh(self, fp):
+        """
+        Reads the records appended since the last read, including those
+        written by other processes.
+
+        """
+        fp.seek(self._offset)
+        for line in fp:
+            #
+            # Skip a partial line left by a writer that crashed
+            #
+            if not line.endswith('\n'):
+                break
+            self._offset += len(line.encode())
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            entry = self._entries.setdefault(record['instance_id'], {})
+            entry.update(record)
+
+    @contextlib.contextmanager
+    def _open(self):
+        """
+        Locks, and opens the journal file, and reads any new records.
+
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with open(self.path + '.lock', 'w') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'a+') as fp:
+                    #
+                    # If another process compacted the journal, it is a
+                    # new file, to be read from the start
+                    #
+                    inode = os.fstat(fp.fileno()).st_ino
+                    if inode != self._inode:
+                        self._inode = inode
+                        self._offset = 0
+                        self._entries = {}
+                    self._refresh(fp)
+
+                    yield fp
+
+            finally:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def record(self, instance_ids: Iterable[str], **fields):
+        """
+        Appends a record for one or more instances.
+
+        :param Iterable[str] instance_ids:
+        :param fields:                     the fields to set, i.e. region,
+                                           key_pair, key_path and state
+
+        """
+        records = []
+        for instance_id in instance_ids:
+            record = dict(fields, instance_id=instance_id,
+                          time=time.time())
+            if fields.get('state') == 'pending':
+                record.update(self._owner)
+            records.append(record)
+        if not records:
+            return
+
+        with self._lock:
+            if self.path is None:
+                for record in records:
+                    self._entries.setdefault(
+                        record['instance_id'], {}).update(record)
+                return
+
+            with self._open() as fp:
+                data = ''.join(json.dumps(record) + '\n'
+                               for record in records)
+                fp.write(data)
+                fp.flush()
+                self._offset += len(data.encode())
+                for record in records:
+                    self._entries.setdefault(
+                        record['instance_id'], {}).update(record)
+
+    def get(self, instance_id: str) -> Optional[dict]:
+        """
+        Gets the entry for an instance.
+
+        :param str instance_id:
+
+        :return Optional[dict]: the entry, or None if the instance is not
+                                in the journal
+
+        """
+        with self._lock:
+            #
+            # Only re-read the file if the instance was created by another
+            # process since the last read
+            #
+            if instance_id not in self._entries and self.path and \
+                    os.path.exists(self.path):
+                with self._open():
+                    pass
+            entry = self._entries.get(instance_id)
+
+            return dict(entry) if entry else None
+
+    def active(self) -> List[dict]:
+        """
+        Gets the entries for all instances that have not been terminated.
+
+        :return List[dict]: the entries
+
+        """
+        with self._lock:
+            if self.path and os.path.exists(self.path):
+                with self._open():
+                    pass
+
+            return [dict(entry) for entry in self._entries.values()
+                    if entry.get('state') not in FINAL_STATES]
+
+    def is_owner_alive(self, entry: dict, stale_after: float = None) -> bool:
+        """
+        Checks if the process that created an instance is still running.
+
+        Processes on other hosts, i.e. in other containers, can't be
+        checked, so they are assumed to be running until the instance's
+        last record is older than stale_after.
+
+        :param dict entry:
+        :param float stale_after: overrides the journal's stale_after
+
+        :return bool:
+
+        """
+        if stale_after is None:
+            stale_after = self.stale_after
+
+        if entry.get('host') != self._owner['host'] or not entry.get('pid'):
+            return time.time() - entry.get('time', 0) < stale_after
+
+        #
+        # A pid from before the host rebooted is long gone, even if the
+        # number is in use again
+        #
+        if entry.get('boot_id') and self._owner['boot_id'] and \
+                entry['boot_id'] != self._owner['boot_id']:
+            return False
+
+        try:
+            os.kill(entry['pid'], 0)
+        except OSError as ex:
+            if ex.errno != errno.EPERM:
+                return False
+
+        #
+        # The pid may have been reused by another process
+        #
+        if entry.get('pid_start') is not None:
+            return _process_start_time(entry['pid']) == entry['pid_start']
+
+        return True
+
+    def compact(self):
+        """
+        Rewrites the journal, keeping a single record for each instance
+        that has not been terminated.
+
+        """
+        if self.path is None:
+            with self._lock:
+                self._entries = {
+                    instance_id: entry
+                    for instance_id, entry in self._entries.items()
+                    if entry.get('state') not in FINAL_STATES
+                }
+            return
+
+        with self._lock, self._open():
+            self._entries = {
+                instance_id: entry
+                for instance_id, entry in self._entries.items()
+                if entry.get('state') not in FINAL_STATES
+            }
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as tmp_fp:
+                for entry in self._entries.values():
+                    tmp_fp.write(json.dumps(entry) + '\n')
+            os.replace(tmp_path, self.path)
+
+            self._inode = os.stat(self.path).st_ino
+            self._offset = os.path.getsize(self.path)
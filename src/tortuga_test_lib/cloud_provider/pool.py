@@ -0,0 +1,272 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from .base import CloudProviderLauncher
+
+
+logger = logging.getLogger(__name__)
+
+
+class InstancePool:
+    """
+    A pool of warm, pre-launched instances on top of a
+    CloudProviderLauncher.
+
+    Instances are pooled per launch configuration, i.e. the region, image
+    id and instance type, along with the network settings and instance
+    profile, so a leased instance is always interchangeable with a newly
+    launched one. The pool state is kept in a JSON file, protected by a
+    file lock, so that it is shared between robot invocations, and
+    between parallel robot workers.
+
+    """
+    def __init__(self, launcher: CloudProviderLauncher, state_path: str,
+                 size: int = 1, max_idle: float = 3600):
+        """
+        Initialization.
+
+        :param CloudProviderLauncher launcher: the launcher used to create
+                                               and delete instances
+        :param str state_path:                 the path to the pool state
+                                               file
+        :param int size:                       the number of idle instances
+                                               to keep for each launch
+                                               configuration
+        :param float max_idle:                 the number of seconds an
+                                               instance may sit idle before
+                                               it is deleted
+
+        """
+        self.launcher = launcher
+        self.state_path = os.path.expanduser(state_path)
+        self.size = size
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_key(region: str, security_group_id: str, subnet_id: str,
+                  image_id: str, instance_type: str,
+                  instance_profile: str) -> List[str]:
+        return [region, image_id, instance_type, security_group_id,
+                subnet_id, instance_profile]
+
+    @contextlib.contextmanager
+    def _state(self):
+        """
+        Locks, loads, and yields the pool state, saving it again on exit.
+
+        """
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+
+        with self._lock, open(self.state_path + '.lock', 'w') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                state = {'idle': [], 'leased': {}}
+                if os.path.exists(self.state_path):
+                    with open(self.state_path) as fp:
+                        state.update(json.load(fp))
+
+                yield state
+
+                tmp_path = self.state_path + '.tmp'
+                with open(tmp_path, 'w') as fp:
+                    json.dump(state, fp, indent=2)
+                os.replace(tmp_path, self.state_path)
+
+            finally:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def _evict(self, state: dict) -> List[dict]:
+        """
+        Removes idle entries that have exceeded the maximum idle time from
+        the state.
+
+        :return List[dict]: the evicted entries
+
+        """
+        now = time.time()
+        evicted = [entry for entry in state['idle']
+                   if now - entry['idle_since'] > self.max_idle]
+        state['idle'] = [entry for entry in state['idle']
+                         if entry not in evicted]
+
+        return evicted
+
+    def _delete(self, entries: List[dict]):
+        for entry in entries:
+            instance_id = entry['instance'][0]
+            logger.info('Deleting pooled instance: {}'.format(instance_id))
+            try:
+                self.launcher.delete_vm(entry['key'][0], instance_id)
+            except Exception as ex:
+                logger.warning('Error deleting pooled instance {}: {}'.format(
+                    instance_id, ex))
+
+    def lease(self, key: List[str],
+              ready_check: Callable[[str], bool] = None
+              ) -> Optional[Tuple[str, str, str, str]]:
+        """
+        Leases an idle instance from the pool.
+
+        :param List[str] key:        the launch configuration key, as built
+                                     by build_key
+        :param Callable ready_check: called with the hostname of a pooled
+                                     instance, returns False if the
+                                     instance is no longer usable
+
+        :return Optional[Tuple[str, str, str, str]]: the instance tuple, as
+                                                     returned by launch_vm,
+                                                     or None if there are no
+                                                     idle instances
+
+        """
+        while True:
+            with self._state() as state:
+                unusable = self._evict(state)
+                entry = None
+                for candidate in state['idle']:
+                    if candidate['key'] == key:
+                        entry = candidate
+                        break
+                if entry is not None:
+                    state['idle'].remove(entry)
+                    state['leased'][entry['instance'][0]] = {
+                        'key': key,
+                        'instance': entry['instance']
+                    }
+            self._delete(unusable)
+
+            if entry is None:
+                return None
+
+            if ready_check is None or ready_check(entry['instance'][1]):
+                return tuple(entry['instance'])
+
+            #
+            # The instance is no longer usable, so get rid of it and try
+            # the next one
+            #
+            self.forget(entry['instance'][0])
+            self._delete([entry])
+
+    def track(self, key: List[str],
+              instance: Tuple[str, str, str, str]):
+        """
+        Records a newly launched instance as leased, so that it can be
+        returned to the pool when it is released.
+
+        :param List[str] key:  the launch configuration key
+        :param tuple instance: the instance tuple, as returned by launch_vm
+
+        """
+        with self._state() as state:
+            state['leased'][instance[0]] = {
+                'key': key,
+                'instance': list(instance)
+            }
+
+    def forget(self, instance_id: str):
+        """
+        Stops tracking a leased instance.
+
+        :param str instance_id:
+
+        """
+        with self._state() as state:
+            state['leased'].pop(instance_id, None)
+
+    def add(self, key: List[str], instance: Tuple[str, str, str, str]):
+        """
+        Adds an instance to the pool as idle.
+
+        :param List[str] key:  the launch configuration key
+        :param tuple instance: the instance tuple, as returned by launch_vm
+
+        """
+        with self._state() as state:
+            state['idle'].append({
+                'key': key,
+                'instance': list(instance),
+                'idle_since': time.time()
+            })
+
+    def release(self, instance_id: str) -> bool:
+        """
+        Returns a leased instance to the pool, if there is room for it.
+
+        :param str instance_id:
+
+        :return bool: True if the instance was returned to the pool, False
+                      if it was not, and should be deleted by the caller
+
+        """
+        with self._state() as state:
+            unusable = self._evict(state)
+            entry = state['leased'].pop(instance_id, None)
+            pooled = False
+            if entry is not None:
+                idle = [e for e in state['idle'] if e['key'] == entry['key']]
+                if len(idle) < self.size:
+                    entry['idle_since'] = time.time()
+                    state['idle'].append(entry)
+                    pooled = True
+        self._delete(unusable)
+
+        return pooled
+
+    def missing(self, key: List[str]) -> int:
+        """
+        Gets the number of instances needed to fill the pool for a launch
+        configuration.
+
+        :param List[str] key:
+
+        :return int: the number of missing idle instances
+
+        """
+        with self._state() as state:
+            unusable = self._evict(state)
+            idle = [e for e in state['idle'] if e['key'] == key]
+        self._delete(unusable)
+
+        return max(self.size - len(idle), 0)
+
+    def idle_instance_ids(self) -> List[str]:
+        """
+        Gets the ids of the idle instances in the pool.
+
+        :return List[str]:
+
+        """
+        with self._state() as state:
+            return [entry['instance'][0] for entry in state['idle']]
+
+    def drain(self):
+        """
+        Deletes all idle instances in the pool.
+
+        """
+        with self._state() as state:
+            idle = state['idle']
+            state['idle'] = []
+        self._delete(idle)
@@ -0,0 +1,228 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+from typing import Dict
+
+from tortuga_test_lib import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# The error codes AWS APIs use when a caller is being throttled
+#
+THROTTLING_CODES = [
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException'
+]
+
+
+class AdaptiveTokenBucket:
+    """
+    A token bucket rate limiter, whose rate adapts to throttling.
+
+    The rate is cut by a factor each time the API throttles a request, and
+    grows back by a fixed step for each second of unthrottled requests, so
+    it settles just below the API's limit rather than repeatedly
+    overshooting it.
+
+    """
+    def __init__(self, rate: float = 20, burst: float = None,
+                 min_rate: float = 0.5, max_rate: float = None,
+                 decrease: float = 0.5, increase: float = 1):
+        """
+        Initialization.
+
+        :param float rate:     the starting rate, in requests per second
+        :param float burst:    the maximum number of tokens saved up,
+                               defaults to the rate
+        :param float min_rate: the lowest the rate is cut to
+        :param float max_rate: the highest the rate grows to, defaults to
+                               four times the starting rate
+        :param float decrease: the factor the rate is multiplied by when a
+                               request is throttled
+        :param float increase: the requests per second the rate grows by,
+                               for each second without throttling
+
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or self.rate * 4
+        self.decrease = decrease
+        self.increase = increase
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._last_throttle = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'throttled': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0
+        }
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens +
+                           (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting for one if there are none.
+
+        :return float: the number of seconds waited
+
+        """
+        start = time.monotonic()
+        with self._lock:
+            self._refill(start)
+            #
+            # Tokens are taken straight away, going into debt if need be,
+            # so waiting callers are served in order
+            #
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, 0)
+            self._stats['acquired'] += 1
+            self._stats['wait_seconds'] += wait
+            self._stats['max_wait_seconds'] = max(
+                self._stats['max_wait_seconds'], wait)
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+    def throttled(self):
+        """
+        Called when a request was throttled, cuts the rate.
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._stats['throttled'] += 1
+            #
+            # A burst of throttled responses, to requests that were sent
+            # at the same time, only cuts the rate once
+            #
+            if now - self._last_throttle < 1:
+                return
+            self._last_throttle = now
+            self.rate = max(self.rate * self.decrease, self.min_rate)
+            self._tokens = min(self._tokens, 0)
+            logger.info('Throttled, reducing the rate to {:.2f}/s'.format(
+                self.rate))
+
+    def succeeded(self):
+        """
+        Called when a request was not throttled, grows the rate.
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = min(self.rate + self.increase / self.rate,
+                            self.max_rate)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stats, rate=self.rate)
+
+
+class ClientRateLimiter:
+    """
+    Rate limits every HTTP request a botocore client sends, including
+    retries, and adapts the rate to the throttling responses it gets, with
+    one bucket for each region.
+
+    """
+    def __init__(self, rate: float = 20, **kwargs):
+        """
+        Initialization.
+
+        :param float rate: the starting rate for each region, in requests
+                           per second
+        :param kwargs:     passed on to AdaptiveTokenBucket
+
+        """
+        self.rate = rate
+        self.kwargs = kwargs
+        self._buckets: Dict[str, AdaptiveTokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, region: str) -> AdaptiveTokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(region)
+            if bucket is None:
+                bucket = AdaptiveTokenBucket(self.rate, **self.kwargs)
+                self._buckets[region] = bucket
+
+            return bucket
+
+    def install(self, client, service: str, region: str):
+        """
+        Registers the limiter's event handlers on a client.
+
+        :param client:      the botocore client
+        :param str service: the service name, i.e. "ec2"
+        :param str region:
+
+        """
+        bucket = self.bucket(region)
+
+        def before_send(**kwargs):
+            wait = bucket.acquire()
+            metrics.REGISTRY.observe('api_rate_limit_wait_seconds', wait,
+                                     region=region)
+
+        def needs_retry(response=None, **kwargs):
+            #
+            # The response is None when the request failed without one,
+            # i.e. a connection error, which says nothing about the rate
+            #
+            if response is None:
+                return None
+            code = response[1].get('Error', {}).get('Code')
+            if code in THROTTLING_CODES:
+                bucket.throttled()
+            else:
+                bucket.succeeded()
+
+            return None
+
+        client.meta.events.register('before-send.{}'.format(service),
+                                    before_send)
+        client.meta.events.register('needs-retry.{}'.format(service),
+                                    needs_retry)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return Dict[str, Dict[str, float]]: for each region, the current
+                                             rate, the number of requests,
+                                             and throttled responses, and
+                                             the time spent waiting
+
+        """
+        with self._lock:
+            buckets = dict(self._buckets)
+
+        return {region: bucket.stats() for region, bucket in buckets.items()}
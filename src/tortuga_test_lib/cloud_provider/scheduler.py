@@ -0,0 +1,153 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import functools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from tortuga_test_lib import metrics
+from tortuga_test_lib.util.loadtest import summarize_latencies
+
+
+class LaunchScheduler:
+    """
+    Runs launches on a pool of worker threads for each region, so a slow or
+    throttled region doesn't hold up the others, and the number of launches
+    in flight against each regional API is bounded.
+
+    """
+    #
+    # The number of recent queue wait times kept for each region
+    #
+    WAIT_SAMPLES = 1000
+
+    def __init__(self, workers_per_region: int = 4):
+        """
+        Initialization.
+
+        :param int workers_per_region: the maximum number of launches that
+                                       run at once in each region
+
+        """
+        self.workers_per_region = workers_per_region
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._waits: Dict[str, collections.deque] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, region: str, func: Callable[..., Any], *args,
+               **kwargs) -> Future:
+        """
+        Queues a launch in a region.
+
+        :param str region:
+        :param Callable func: the function to run, i.e. launch_vm
+        :param args:
+        :param kwargs:
+
+        :return Future: the future for the result
+
+        """
+        with self._lock:
+            executor = self._executors.get(region)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=self.workers_per_region,
+                    thread_name_prefix='launch-{}'.format(region)
+                )
+                self._executors[region] = executor
+            if region not in self._stats:
+                self._stats[region] = collections.Counter()
+                self._waits[region] = collections.deque(
+                    maxlen=self.WAIT_SAMPLES)
+            self._stats[region]['queued'] += 1
+
+        future = executor.submit(self._run, region, time.monotonic(), func,
+                                 args, kwargs)
+        future.add_done_callback(functools.partial(self._done, region))
+
+        return future
+
+    def _done(self, region: str, future: Future):
+        #
+        # Launches cancelled while queued never reach _run
+        #
+        if future.cancelled():
+            with self._lock:
+                self._stats[region]['queued'] -= 1
+                self._stats[region]['cancelled'] += 1
+
+    def _run(self, region: str, queued_at: float, func: Callable[..., Any],
+             args: tuple, kwargs: dict) -> Any:
+        wait = time.monotonic() - queued_at
+        metrics.REGISTRY.observe('launch_queue_wait_seconds', wait,
+                                 region=region)
+        with self._lock:
+            self._stats[region]['queued'] -= 1
+            self._stats[region]['running'] += 1
+            self._waits[region].append(wait)
+
+        try:
+            result = func(*args, **kwargs)
+
+        except Exception:
+            with self._lock:
+                self._stats[region]['failed'] += 1
+            raise
+
+        else:
+            with self._lock:
+                self._stats[region]['completed'] += 1
+
+        finally:
+            with self._lock:
+                self._stats[region]['running'] -= 1
+
+        return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Gets the state of each region's queue.
+
+        :return Dict[str, Dict[str, Any]]: for each region, the number of
+                                           launches queued, running,
+                                           completed, failed and
+                                           cancelled, and the
+                                           queue wait time percentiles, in
+                                           seconds
+
+        """
+        with self._lock:
+            return {
+                region: {
+                    'queued': stats['queued'],
+                    'running': stats['running'],
+                    'completed': stats['completed'],
+                    'failed': stats['failed'],
+                    'cancelled': stats['cancelled'],
+                    'queue_wait': summarize_latencies(
+                        list(self._waits[region]))
+                }
+                for region, stats in self._stats.items()
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors = {}
+        for executor in executors:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,66 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import inspect
+
+from tortuga_test_lib import metrics
+
+
+def _call(self, func, args, kwargs):
+    if not metrics.REGISTRY.enabled:
+        return func(self, *args, **kwargs)
+
+    with metrics.REGISTRY.timer('keyword_duration_seconds',
+                                library=type(self).__name__,
+                                keyword=func.__name__):
+        return func(self, *args, **kwargs)
+
+
+def _profile(self, func, args, kwargs):
+    profiler = getattr(self, 'profiler', None)
+    if profiler is not None and profiler.wants(func.__name__):
+        with profiler.profile(func.__name__):
+            return _call(self, func, args, kwargs)
+
+    return _call(self, func, args, kwargs)
+
+
+def keyword(func):
+    """
+    Decorates a library keyword, recording how long each call takes,
+    profiling it if the library has a profiler that selects it, and
+    flushing the messages it logged, in one batch, if the library has a
+    log buffer.
+
+    The wrapper keeps the signature and annotations of the keyword, so
+    robot, and the remote server, see the same arguments.
+
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        log_buffer = getattr(self, 'log_buffer', None)
+        if log_buffer is not None:
+            with log_buffer.keyword():
+                return _profile(self, func, args, kwargs)
+
+        return _profile(self, func, args, kwargs)
+
+    #
+    # getfullargspec, used by the remote server, doesn't follow __wrapped__
+    # but does use __signature__
+    #
+    wrapper.__signature__ = inspect.signature(func)
+
+    return wrapper
@@ -0,0 +1,295 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Buffered log messages for keywords run by the remote server.
+
+Rather than printing each message as it is logged, the messages logged by
+a keyword are kept in memory, with their level and the time they were
+logged, and written to stdout in one batch when the keyword returns, using
+robot's *LEVEL:timestamp* syntax. Robot then shows each message at its own
+level and time, however late the batch arrives. Keywords that log for a
+long time, such as streamed commands, can be written in batches as they
+go, see LogBuffer.
+
+Each keyword writes at most a fixed number of messages, the first ones,
+and the most recent ones, with a note of how many were dropped in between.
+
+The remote server can also collect the messages instead of them being
+written to stdout, and return them as structured records alongside the
+keyword output, optionally compressed, see run_keyword_batch.
+
+"""
+import base64
+import collections
+import contextlib
+import json
+import sys
+import threading
+import time
+import zlib
+from typing import List, Tuple, Union
+
+
+#
+# A record is the time it was logged, in seconds since the epoch, the
+# robot log level, and the message
+#
+Record = Tuple[float, str, str]
+
+LEVELS = {
+    'trace': 'TRACE',
+    'debug': 'DEBUG',
+    'info': 'INFO',
+    'html': 'HTML',
+    'warn': 'WARN',
+    'warning': 'WARN',
+    'error': 'ERROR'
+}
+
+#
+# How the remote server returns log messages: as keyword output, as JSON
+# records, or as zlib compressed, base64 encoded, JSON records
+#
+LOG_MODES = ['output', 'json', 'zlib']
+
+_collector = threading.local()
+
+
+def format_records(records: List[Record]) -> str:
+    """
+    Formats records for robot to log.
+
+    :param List[Record] records: the records to format
+
+    :return str: the records, one message per line (or more, for
+                 multi-line messages)
+
+    """
+    return ''.join(
+        '*{}:{}* {}\n'.format(level, int(timestamp * 1000), msg)
+        for timestamp, level, msg in records
+    )
+
+
+def encode_records(records: List[Record], compress: bool = False) -> str:
+    """
+    Encodes records to send over XML-RPC. The JSON is ASCII only, so
+    messages with control characters are still valid XML.
+
+    :param List[Record] records: the records to encode
+    :param bool compress:        whether to zlib compress, and base64
+                                 encode, the JSON
+
+    :return str: the encoded records
+
+    """
+    data = json.dumps(records, separators=(',', ':'))
+    if compress:
+        data = base64.b64encode(zlib.compress(data.encode())).decode()
+
+    return data
+
+
+def decode_records(data: Union[str, bytes]) -> List[Record]:
+    """
+    Decodes records from encode_records.
+
+    :param Union[str, bytes] data: the encoded records
+
+    :return List[Record]: the records
+
+    """
+    if isinstance(data, bytes):
+        data = data.decode()
+    if not data.startswith('['):
+        data = zlib.decompress(base64.b64decode(data)).decode()
+
+    return [tuple(record) for record in json.loads(data)]
+
+
+@contextlib.contextmanager
+def collect(records: List[Record] = None):
+    """
+    Collects the records flushed on the current thread into a list,
+    instead of writing them to stdout.
+
+    :param List[Record] records: the list to collect into, defaults to a
+                                 new list
+
+    :return List[Record]: the list the records are collected into
+
+    """
+    if records is None:
+        records = []
+
+    previous = getattr(_collector, 'records', None)
+    _collector.records = records
+    try:
+        yield records
+    finally:
+        _collector.records = previous
+
+
+class _ThreadState:
+    def __init__(self):
+        self.records = collections.deque()
+        self.dropped = 0
+        self.depth = 0
+        self.written = 0
+        self.buffered_since = None
+
+
+class LogBuffer:
+    """
+    Buffers log messages for the keyword running on each thread.
+
+    Messages logged on a thread that isn't running a keyword are written
+    straight away.
+
+    As the messages that are written still reach robot only when the
+    keyword returns, the cap applies to all of the messages a keyword
+    writes. Messages are only written early until half of the cap is
+    used, the rest is kept for the most recent messages.
+
+    """
+    def __init__(self, max_records: int = 10000,
+                 flush_interval: float = None):
+        """
+        Initialization.
+
+        :param int max_records:      the maximum number of messages to
+                                     write for each keyword, the oldest
+                                     messages that haven't been written
+                                     are dropped after that
+        :param float flush_interval: how long, in seconds, to buffer
+                                     messages before writing them, even if
+                                     the keyword is still running, or None
+                                     to wait for it to return
+
+        """
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+
+    def _state(self) -> _ThreadState:
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            state = self._local.state = _ThreadState()
+
+        return state
+
+    @contextlib.contextmanager
+    def keyword(self):
+        """
+        Buffers the messages logged while a keyword runs, and flushes them
+        when the outermost keyword on the thread returns.
+
+        """
+        state = self._state()
+        state.depth += 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if not state.depth:
+                self.flush()
+                state.written = 0
+
+    def append(self, level: str, msg: str, timestamp: float = None):
+        """
+        Adds a message to the buffer.
+
+        :param str level:       the log level, i.e. info or warning
+        :param str msg:         the message
+        :param float timestamp: the time the message was logged, defaults
+                                to now
+
+        """
+        record = (time.time() if timestamp is None else timestamp,
+                  LEVELS.get(level.lower(), 'INFO'), str(msg))
+
+        state = self._state()
+        if not state.depth:
+            self._write([record])
+            return
+
+        if not state.records:
+            state.buffered_since = time.monotonic()
+        if len(state.records) >= self.max_records - state.written:
+            state.records.popleft()
+            state.dropped += 1
+        state.records.append(record)
+
+        if self.flush_interval is not None and \
+                state.written + len(state.records) <= \
+                self.max_records // 2 and \
+                time.monotonic() - state.buffered_since >= \
+                self.flush_interval:
+            self.flush()
+
+    def extend(self, records: List[Record]):
+        """
+        Adds records, such as those collected on another thread, to the
+        buffer.
+
+        :param List[Record] records: the records to add
+
+        """
+        for timestamp, level, msg in records:
+            self.append(level, msg, timestamp)
+
+    def drain(self) -> List[Record]:
+        """
+        Removes the buffered records for the current thread.
+
+        :return List[Record]: the records, starting with a note of how
+                              many were dropped, if any were
+
+        """
+        state = self._state()
+        records = list(state.records)
+        state.records.clear()
+
+        if state.dropped:
+            records.insert(0, (
+                records[0][0], 'INFO',
+                'Dropped {} earlier log message(s), the buffer holds '
+                '{}'.format(state.dropped, self.max_records)
+            ))
+            state.dropped = 0
+
+        return records
+
+    def flush(self):
+        """
+        Writes the buffered records for the current thread, or adds them
+        to the current collector, see collect.
+
+        """
+        state = self._state()
+        records = self.drain()
+        if records:
+            if state.depth:
+                state.written += len(records)
+            self._write(records)
+
+    def _write(self, records: List[Record]):
+        collected = getattr(_collector, 'records', None)
+        if collected is not None:
+            collected.extend(records)
+            return
+
+        sys.stdout.write(format_records(records))
+        sys.stdout.flush()
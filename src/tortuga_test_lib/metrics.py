@@ -0,0 +1,262 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency histograms for keywords, and the phases within them.
+
+Metrics are disabled by default, and cost a single attribute check per
+timer when disabled. They are enabled by setting the TORTUGA_TEST_METRICS
+environment variable, or by setting TORTUGA_TEST_METRICS_DIR, in which
+case they are also written to that directory, as JSON and Prometheus
+text, when the process exits.
+
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+PREFIX = 'tortuga_test_'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300, 600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),),
+                                self.counts):
+            total += count
+            yield bound, total
+
+
+class _Timer:
+    __slots__ = ('_registry', '_name', '_labels', '_start')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str,
+                 labels: Labels):
+        self._registry = registry
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._registry.observe_labels(self._name, self._labels,
+                                      time.perf_counter() - self._start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+class MetricsRegistry:
+    """
+    A thread-safe collection of histograms, keyed by name and labels.
+
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def timer(self, name: str, **labels):
+        """
+        Times a block of code, and records the duration in a histogram.
+
+            with registry.timer('phase_duration_seconds', phase='ssh_wait'):
+                ...
+
+        :param str name: the histogram name
+        :param labels:   the histogram labels
+
+        :return: a context manager
+
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+
+        return _Timer(self, name, tuple(sorted(labels.items())))
+
+    def observe(self, name: str, value: float, **labels):
+        if self.enabled:
+            self.observe_labels(name, tuple(sorted(labels.items())), value)
+
+    def observe_labels(self, name: str, labels: Labels, value: float):
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(labels)
+            if histogram is None:
+                histogram = histograms[labels] = Histogram()
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def to_dict(self) -> Dict[str, list]:
+        """
+        Gets all of the histograms.
+
+        :return Dict[str, list]: for each histogram name, a list with the
+                                 labels, count, sum, min, max and
+                                 cumulative bucket counts of each series
+
+        """
+        with self._lock:
+            return {
+                name: [
+                    {
+                        'labels': dict(labels),
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'min': histogram.min,
+                        'max': histogram.max,
+                        'buckets': [[str(bound), count] for bound, count
+                                    in histogram.cumulative()]
+                    }
+                    for labels, histogram in sorted(series.items())
+                ]
+                for name, series in sorted(self._histograms.items())
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Gets all of the histograms in the Prometheus text format.
+
+        :return str: the histograms
+
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                metric = PREFIX + name
+                lines.append('# TYPE {} histogram'.format(metric))
+                for labels, histogram in sorted(series.items()):
+                    label_text = ','.join(
+                        '{}="{}"'.format(key, _escape(str(value)))
+                        for key, value in labels)
+                    prefix = label_text + ',' if label_text else ''
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(
+                            float(bound))
+                        lines.append('{}_bucket{{{}le="{}"}} {}'.format(
+                            metric, prefix, le, count))
+                    lines.append('{}_sum{{{}}} {}'.format(
+                        metric, label_text, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(
+                        metric, label_text, histogram.count))
+
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def export(self, path: str, fmt: str = 'json'):
+        """
+        Writes all of the histograms to a file.
+
+        :param str path: the path to the file
+        :param str fmt:  either json or prometheus
+
+        """
+        if fmt == 'json':
+            data = self.to_json()
+
+        elif fmt == 'prometheus':
+            data = self.to_prometheus()
+
+        else:
+            raise Exception('Unsupported metrics format: {}'.format(fmt))
+
+        with open(path, 'w') as fp:
+            fp.write(data)
+
+
+REGISTRY = MetricsRegistry(
+    enabled=os.environ.get('TORTUGA_TEST_METRICS', '').lower() not in
+    ['', '0', 'false', 'no'] or bool(os.environ.get(
+        'TORTUGA_TEST_METRICS_DIR'))
+)
+
+
+def timer(name: str, **labels):
+    """
+    Times a block of code using the default registry.
+
+    """
+    return REGISTRY.timer(name, **labels)
+
+
+def phase(name: str):
+    """
+    Times a phase of a keyword, such as waiting for an instance to be
+    running, using the default registry.
+
+    """
+    return REGISTRY.timer('phase_duration_seconds', phase=name)
+
+
+def _export_on_exit():
+    metrics_dir = os.environ.get('TORTUGA_TEST_METRICS_DIR')
+    if not metrics_dir or not REGISTRY.to_dict():
+        return
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    base = os.path.join(metrics_dir, 'metrics-{}'.format(os.getpid()))
+    REGISTRY.export(base + '.json', 'json')
+    REGISTRY.export(base + '.prom', 'prometheus')
+
+
+atexit.register(_export_on_exit)
@@ -0,0 +1,263 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Opt-in profiling of library keywords.
+
+Profiling is enabled with the profile library argument, or the
+TORTUGA_TEST_PROFILE environment variable, set to a comma separated list
+of keyword names (i.e. run_command,parse_file), or * for all keywords.
+Every call to a selected keyword writes, depending on the mode:
+
+* <keyword>-<pid>-<n>.pstats, from cProfile, for pstats or snakeviz
+* <keyword>-<pid>-<n>.collapsed, sampled stacks in the collapsed format
+  used by flamegraph.pl and speedscope
+* <keyword>-<pid>-<n>.tracemalloc.txt, the top memory allocations made
+  during the call, if memory profiling is enabled
+
+cProfile and the sampler only cover the thread that called the keyword,
+so work a keyword hands off to a thread pool shows up as waiting.
+Memory allocations, on the other hand, are traced for the whole process,
+so when keywords run at the same time, as in the threaded remote server,
+each one's report includes the others' allocations.
+
+The files are written to the profile_dir library argument, or
+TORTUGA_TEST_PROFILE_DIR, defaulting to the robot output directory, or
+a directory under the system temp directory when robot is not running,
+such as in the remote server. TORTUGA_TEST_PROFILE_MODE selects the
+profilers (cprofile, sample, or both, the default), and
+TORTUGA_TEST_PROFILE_MEMORY=1 enables memory profiling.
+
+"""
+import collections
+import contextlib
+import cProfile
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, Optional
+
+
+_active = threading.local()
+
+#
+# tracemalloc is process wide, so it is started by the first keyword that
+# profiles memory, and stopped by the last one, rather than each keyword
+# stopping it under the others
+#
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+
+    with _tracemalloc_lock:
+        if not _tracemalloc_users and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        #
+        # Tracing started by someone else is left running
+        #
+        if not _tracemalloc_users and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+class StackSampler:
+    """
+    Samples the stack of a thread at a fixed interval, counting how often
+    each stack is seen.
+
+    """
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[str, int] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(
+                    os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, 'w') as fp:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write('{} {}\n'.format(stack, count))
+
+
+def _default_output_dir() -> str:
+    try:
+        from robot.libraries.BuiltIn import BuiltIn
+        return BuiltIn().get_variable_value('${OUTPUT DIR}')
+
+    except Exception:
+        return os.path.join(tempfile.gettempdir(), 'tortuga-test-profiles')
+
+
+class KeywordProfiler:
+    def __init__(self, keywords: str, output_dir: str = None,
+                 mode: str = 'both', memory: bool = False,
+                 interval: float = 0.005):
+        """
+        Initialization.
+
+        :param str keywords:   a comma separated list of keyword names to
+                               profile, or * for all keywords
+        :param str output_dir: the directory to write the profiles to
+        :param str mode:       cprofile, sample, or both
+        :param bool memory:    whether to record memory allocations
+        :param float interval: the sampling interval, in seconds
+
+        """
+        self.keywords = {k.strip() for k in keywords.split(',') if k.strip()}
+        self.output_dir = output_dir
+        self.mode = mode
+        self.memory = memory
+        self.interval = interval
+        self._counter = itertools.count(1)
+
+    def wants(self, keyword: str) -> bool:
+        """
+        Whether a keyword should be profiled. Keywords called from inside
+        a profiled keyword are covered by the outer profile.
+
+        """
+        if getattr(_active, 'profiling', False):
+            return False
+
+        return '*' in self.keywords or keyword in self.keywords
+
+    @contextlib.contextmanager
+    def profile(self, keyword: str):
+        """
+        Profiles a block of code, writing the results when it exits.
+
+        :param str keyword: the keyword name, used to name the files
+
+        """
+        output_dir = self.output_dir or _default_output_dir()
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, '{}-{}-{:04d}'.format(
+            keyword, os.getpid(), next(self._counter)))
+
+        profiler = None
+        if self.mode in ['cprofile', 'both']:
+            profiler = cProfile.Profile()
+
+        sampler = None
+        if self.mode in ['sample', 'both']:
+            sampler = StackSampler(threading.get_ident(), self.interval)
+
+        snapshot = None
+        if self.memory:
+            _start_tracemalloc()
+            snapshot = tracemalloc.take_snapshot()
+
+        _active.profiling = True
+        if sampler:
+            sampler.start()
+        if profiler:
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+            if sampler:
+                sampler.stop()
+            _active.profiling = False
+
+            if snapshot is not None:
+                #
+                # Leave out allocations made by the profilers themselves
+                #
+                try:
+                    filters = [tracemalloc.Filter(False, path) for path in
+                               [cProfile.__file__, __file__,
+                                tracemalloc.__file__]]
+                    stats = tracemalloc.take_snapshot().filter_traces(
+                        filters).compare_to(snapshot.filter_traces(filters),
+                                            'lineno')
+                finally:
+                    _stop_tracemalloc()
+
+            if profiler:
+                profiler.dump_stats(base + '.pstats')
+            if sampler:
+                sampler.write(base + '.collapsed')
+            if snapshot is not None:
+                with open(base + '.tracemalloc.txt', 'w') as fp:
+                    fp.write('{} took {:.3f}s\n'.format(keyword, elapsed))
+                    for stat in stats[:25]:
+                        fp.write('{}\n'.format(stat))
+
+
+def get_profiler(keywords: str = None,
+                 output_dir: str = None) -> Optional[KeywordProfiler]:
+    """
+    Creates a keyword profiler from library arguments, falling back to the
+    environment.
+
+    :param str keywords:   the keywords to profile, see KeywordProfiler
+    :param str output_dir: the directory to write the profiles to
+
+    :return Optional[KeywordProfiler]: the profiler, or None if profiling
+                                       is not enabled
+
+    """
+    keywords = keywords or os.environ.get('TORTUGA_TEST_PROFILE')
+    if not keywords:
+        return None
+
+    return KeywordProfiler(
+        keywords,
+        output_dir=output_dir or os.environ.get('TORTUGA_TEST_PROFILE_DIR'),
+        mode=os.environ.get('TORTUGA_TEST_PROFILE_MODE', 'both'),
+        memory=os.environ.get('TORTUGA_TEST_PROFILE_MEMORY', '').lower() in
+        ['1', 'true', 'yes']
+    )
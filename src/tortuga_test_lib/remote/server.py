@@ -0,0 +1,242 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+
+import robotremoteserver
+from robotremoteserver import RobotRemoteServer, StoppableXMLRPCServer
+
+from tortuga_test_lib import logbuffer, metrics
+
+
+_capture = threading.local()
+
+_LOG_PREFIXES = ('*TRACE*', '*DEBUG*', '*INFO*', '*HTML*', '*WARN*',
+                 '*ERROR*')
+
+
+class _ThreadLocalStream:
+    """
+    Stands in for sys.stdout or sys.stderr, sending writes to a buffer
+    for the current thread while its output is being captured, and to the
+    original stream otherwise.
+
+    """
+    def __init__(self, name: str, stream):
+        self._name = name
+        self._stream = stream
+
+    def _target(self):
+        buffers = getattr(_capture, 'buffers', None)
+        if buffers is not None:
+            return buffers[self._name]
+
+        return self._stream
+
+    def write(self, data):
+        return self._target().write(data)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class ThreadLocalStreamInterceptor:
+    """
+    A thread-safe replacement for robotremoteserver's
+    StandardStreamInterceptor, which swaps out sys.stdout and sys.stderr
+    for the whole process, and so mixes up the output of keywords running
+    at the same time.
+
+    """
+    def __init__(self):
+        self.output = ''
+        _capture.buffers = {'stdout': io.StringIO(),
+                            'stderr': io.StringIO()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        buffers = _capture.buffers
+        del _capture.buffers
+        stdout = buffers['stdout'].getvalue()
+        stderr = buffers['stderr'].getvalue()
+
+        #
+        # Combine the streams the same way StandardStreamInterceptor does
+        #
+        if stdout and stderr:
+            if not stderr.startswith(_LOG_PREFIXES):
+                stderr = '*INFO* {}'.format(stderr)
+            if not stdout.endswith('\n'):
+                stdout += '\n'
+        self.output = stdout + stderr
+
+
+def _install_thread_local_streams():
+    if not isinstance(sys.stdout, _ThreadLocalStream):
+        sys.stdout = _ThreadLocalStream('stdout', sys.stdout)
+        sys.stderr = _ThreadLocalStream('stderr', sys.stderr)
+    robotremoteserver.StandardStreamInterceptor = \
+        ThreadLocalStreamInterceptor
+
+
+class ThreadPoolXMLRPCServer(StoppableXMLRPCServer):
+    """
+    An XML-RPC server that handles requests on a bounded pool of worker
+    threads.
+
+    """
+    def __init__(self, host: str, port: int, workers: int):
+        super().__init__(host, port)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='robot-remote')
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request, request,
+                              client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
+
+
+class TortugaRemoteServer(RobotRemoteServer):
+    """
+    A RobotRemoteServer that can run several keywords at the same time.
+
+    With more than one worker, each XML-RPC request is handled on its own
+    thread from a pool, and the output of each keyword is captured
+    separately, so long running keywords from one robot worker don't block
+    the others.
+
+    """
+    def __init__(self, library, host: str = '127.0.0.1', port: int = 8270,
+                 workers: int = 1, serve: bool = True, **kwargs):
+        """
+        Initialization.
+
+        :param library:     the library to serve
+        :param str host:
+        :param int port:
+        :param int workers: the number of requests to handle at once, 1
+                            handles requests one at a time, the same as
+                            RobotRemoteServer
+        :param bool serve:  whether to start serving straight away
+        :param kwargs:      other RobotRemoteServer arguments
+
+        """
+        super().__init__(library, host=host, port=port, serve=False,
+                         **kwargs)
+
+        if workers > 1:
+            _install_thread_local_streams()
+            self._server.server_close()
+            self._server = ThreadPoolXMLRPCServer(host, int(port), workers)
+            self._register_functions(self._server)
+
+        if serve:
+            self.serve()
+
+    def _register_functions(self, server):
+        super()._register_functions(server)
+        server.register_function(self.run_keyword_batch)
+        server.register_function(self.get_metrics)
+
+    def run_keyword_batch(self, calls: List[Union[list, dict]],
+                          stop_on_failure: bool = False,
+                          log_mode: str = 'output') -> List[dict]:
+        """
+        Runs several keywords in a single XML-RPC request.
+
+        :param List[Union[list, dict]] calls: the keywords to run, each
+                                              either a dict with name, args
+                                              and kwargs, or a list with
+                                              the name followed by the
+                                              positional arguments
+        :param bool stop_on_failure:          whether to skip the rest of
+                                              the calls after one fails
+        :param str log_mode:                  how to return the messages
+                                              logged by buffered keywords,
+                                              either output, as part of
+                                              the keyword output, json, as
+                                              JSON records in log, or zlib,
+                                              as compressed and base64
+                                              encoded JSON records in log,
+                                              see tortuga_test_lib.logbuffer
+
+        :return List[dict]: the result of each call that was run, in the
+                            same format as run_keyword, with the elapsed
+                            time in seconds
+
+        """
+        if log_mode not in logbuffer.LOG_MODES:
+            raise Exception('Unsupported log mode: {}'.format(log_mode))
+
+        results = []
+        for call in calls:
+            if isinstance(call, dict):
+                name = call['name']
+                args = call.get('args', [])
+                kwargs = call.get('kwargs', {})
+            else:
+                name, args, kwargs = call[0], call[1:], {}
+
+            start = time.monotonic()
+            if log_mode == 'output':
+                result = self.run_keyword(name, args, kwargs)
+            else:
+                with logbuffer.collect() as records:
+                    result = self.run_keyword(name, args, kwargs)
+                if records:
+                    result['log'] = logbuffer.encode_records(
+                        records, compress=log_mode == 'zlib')
+            result['elapsed'] = time.monotonic() - start
+            results.append(result)
+
+            if stop_on_failure and result['status'] != 'PASS':
+                break
+
+        return results
+
+    def get_metrics(self, fmt: str = 'json') -> str:
+        """
+        Gets the keyword and phase latency histograms recorded by the
+        server.
+
+        :param str fmt: either json or prometheus
+
+        :return str: the histograms
+
+        """
+        if fmt == 'prometheus':
+            return metrics.REGISTRY.to_prometheus()
+
+        return metrics.REGISTRY.to_json()
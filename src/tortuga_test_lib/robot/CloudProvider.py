@@ -12,34 +12,196 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import importlib
+import itertools
 import logging
+import os
 import socket
+import threading
 import time
-from typing import Dict, Tuple
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from typing import Dict, List, Optional, Tuple
 
+from tortuga_test_lib import metrics
 from tortuga_test_lib.cloud_provider.base import CloudProviderLauncher
-from tortuga_test_lib.cloud_provider.aws import AwsLauncher
+from tortuga_test_lib.cloud_provider.pool import InstancePool
+from tortuga_test_lib.cloud_provider.scheduler import LaunchScheduler
+from tortuga_test_lib.instrumentation import keyword
+from tortuga_test_lib.profiling import get_profiler
 
 
 logger = logging.getLogger(__name__)
 
 
+class _LibraryListener:
+    """
+    Tells the library when robot is done with it, which is at the end of
+    each test, as the library has the default test case scope.
+
+    """
+    ROBOT_LISTENER_API_VERSION = 2
+
+    def __init__(self, library: 'CloudProvider'):
+        self.library = library
+
+    def close(self):
+        self.library._close()
+
+
 class CloudProvider:
     """
     A RobotFramework library for managing cloud resources.
 
     """
-    providers: Dict[str, CloudProviderLauncher] = {
-        'aws': AwsLauncher()
+    #
+    # Launchers are registered by name, as "module:class", and are only
+    # imported and created the first time they are used, so that suites
+    # don't pay for loading cloud SDKs they never touch
+    #
+    providers: Dict[str, str] = {
+        'aws': 'tortuga_test_lib.cloud_provider.aws:AwsLauncher'
+    }
+
+    #
+    # Stand-ins for running offline, only available when
+    # TORTUGA_TEST_FAKE_PROVIDERS is set, so a suite can't end up using
+    # one by mistake
+    #
+    fake_providers: Dict[str, str] = {
+        'fake-aws': 'tortuga_test_lib.testing.ec2:FakeAwsLauncher'
     }
 
+    _launchers: Dict[str, CloudProviderLauncher] = {}
+    _launchers_lock = threading.Lock()
+
+    @classmethod
+    def register_provider(cls, provider: str, launcher: str):
+        """
+        Registers a launcher for a provider.
+
+        :param str provider: key for the provider
+        :param str launcher: the launcher class, as "module:class"
+
+        """
+        cls.providers[provider] = launcher
+
+    def __init__(self, pool_size: int = 0, pool_max_idle: float = 3600,
+                 pool_dir: str = '~/.tortuga-test-lib', profile: str = None,
+                 profile_dir: str = None, launch_workers: int = 8,
+                 key_mode: str = None, key_dir: str = None,
+                 api_rate: float = None):
+        """
+        Initialization.
+
+        :param int pool_size:       the number of warm instances to keep
+                                    for each launch configuration, 0
+                                    disables the pool
+        :param float pool_max_idle: the number of seconds a pooled instance
+                                    may sit idle before it is deleted
+        :param str pool_dir:        the directory where the pool state is
+                                    kept between runs
+        :param str profile:         a comma separated list of keywords to
+                                    profile, or * for all of them, see
+                                    tortuga_test_lib.profiling
+        :param str profile_dir:     the directory to write profiles to
+        :param int launch_workers:  the maximum number of background
+                                    launches that run at once in each
+                                    region
+        :param str key_mode:        how launchers manage SSH keys, for AWS
+                                    either "instance" (a key pair per
+                                    launch) or "shared" (one imported key
+                                    pair per region)
+        :param str key_dir:         in shared key mode, a directory to keep
+                                    the key in between runs, which is
+                                    needed for pooled instances to stay
+                                    reachable
+        :param float api_rate:      if set, launchers rate limit their API
+                                    calls in each region, starting at this
+                                    many per second, and adapting to
+                                    throttling
+
+        """
+        self.pool_size = int(pool_size)
+        self.pool_max_idle = float(pool_max_idle)
+        self.pool_dir = pool_dir
+        self.profiler = get_profiler(profile, profile_dir)
+        self.launch_workers = int(launch_workers)
+
+        #
+        # Launchers are shared, so these only apply to launchers created
+        # after this library instance
+        #
+        self.launcher_options = {}
+        if key_mode:
+            self.launcher_options['key_mode'] = key_mode
+        if key_dir:
+            self.launcher_options['key_dir'] = key_dir
+        if api_rate:
+            self.launcher_options['api_rate'] = float(api_rate)
+        self._pools: Dict[str, InstancePool] = {}
+        self._scheduler = LaunchScheduler(self.launch_workers)
+        self._launch_handles: Dict[str, Tuple[Future, str, str]] = {}
+        self._launch_ids = itertools.count(1)
+        self._launch_lock = threading.Lock()
+        self.ROBOT_LIBRARY_LISTENER = _LibraryListener(self)
+
+    def _close(self):
+        """
+        Called when robot is done with the library. Launches that were
+        started, but never waited for, are cancelled, so their instances
+        don't leak, and the launch workers are shut down.
+
+        """
+        self.cancel_vm_launch()
+
+        #
+        # Queued launches were cancelled, so this only waits for the ones
+        # that are already running, which cancel_vm_launch's callbacks
+        # then delete
+        #
+        self._scheduler.shutdown()
+
     def _get_launcher(self, provider: str) -> CloudProviderLauncher:
-        try:
-            return self.providers[provider]
+        with self._launchers_lock:
+            launcher = self._launchers.get(provider)
+            if launcher is not None:
+                return launcher
+
+            providers = self.providers
+            if os.environ.get('TORTUGA_TEST_FAKE_PROVIDERS', '').lower() in \
+                    ['1', 'true', 'yes']:
+                providers = dict(self.fake_providers, **providers)
+
+            try:
+                module_name, class_name = providers[provider].split(':')
+
+            except KeyError:
+                raise Exception('Unsupported provider: {}'.format(provider))
+
+            module = importlib.import_module(module_name)
+            launcher = getattr(module, class_name)(**self.launcher_options)
+            self._launchers[provider] = launcher
+
+            return launcher
+
+    def _get_pool(self, provider: str) -> Optional[InstancePool]:
+        if self.pool_size <= 0:
+            return None
+
+        if provider not in self._pools:
+            self._pools[provider] = InstancePool(
+                self._get_launcher(provider),
+                os.path.join(self.pool_dir, '{}-pool.json'.format(provider)),
+                size=self.pool_size,
+                max_idle=self.pool_max_idle
+            )
 
-        except KeyError:
-            raise Exception('Unsupported provider: {}'.format(provider))
+        return self._pools[provider]
 
+    @keyword
     def launch_vm(self, provider: str, region: str, security_group_id: str,
                   subnet_id: str, image_id: str, instance_type: str,
                   instance_profile: str, **kwargs) -> Tuple[str, str, str, str]:
@@ -62,24 +224,460 @@ class CloudProvider:
         """
         launcher = self._get_launcher(provider)
 
+        #
+        # Lease a warm instance from the pool, if there is one
+        #
+        pool = self._get_pool(provider)
+        if pool:
+            key = pool.build_key(region, security_group_id, subnet_id,
+                                 image_id, instance_type, instance_profile)
+            result = pool.lease(
+                key, ready_check=lambda host: self._is_open(host, 22))
+            if result:
+                return result
+
         result = launcher.launch_vm(region, security_group_id, subnet_id,
                                     image_id, instance_type, instance_profile, **kwargs)
         # Wait for the ssh port to be open
         if len(result) == 4 and result[1]:
-            self.wait_for_port(result[1], 22, 40)
+            with metrics.phase('ssh_wait'):
+                self.wait_for_port(result[1], 22, 40)
+        if pool:
+            pool.track(key, result)
+        return result
+
+    @keyword
+    def start_vm_launch(self, provider: str, region: str,
+                        security_group_id: str, subnet_id: str,
+                        image_id: str, instance_type: str,
+                        instance_profile: str, **kwargs) -> str:
+        """
+        Starts launching a VM instance in the background, and returns
+        straight away, so that other setup can be done while it boots. Use
+        Wait For VM to get the instance, or Cancel VM Launch if it is no
+        longer needed. Launches that are neither waited for, nor cancelled,
+        by the end of the test are cancelled then.
+
+        :param str provider: key for one of the supported providers
+        :param str region:
+        :param str security_group_id:
+        :param str subnet_id:
+        :param str image_id:
+        :param str instance_type:
+        :param str instance_profile
+        :param kwargs:
+
+        :return str: a handle for the launch
+
+        """
+        #
+        # Check the provider now, rather than failing in the background
+        #
+        self._get_launcher(provider)
+
+        future = self._scheduler.submit(
+            region, self.launch_vm, provider, region, security_group_id,
+            subnet_id, image_id, instance_type, instance_profile, **kwargs
+        )
+        with self._launch_lock:
+            handle = 'vm-launch-{}'.format(next(self._launch_ids))
+            self._launch_handles[handle] = (future, provider, region)
+
+        return handle
+
+    @keyword
+    def wait_for_vm(self, handle: str,
+                    timeout: float = None) -> Tuple[str, str, str, str]:
+        """
+        Waits for a launch started with Start VM Launch to finish. If the
+        launch failed, its error is raised here.
+
+        :param str handle:    the handle returned by Start VM Launch
+        :param float timeout: the maximum number of seconds to wait, or
+                              None to wait forever
+
+        :return Tuple[str, str, str, str]: a tuple containing the instance id,
+                                           the public hostname,
+                                           the ssh username, and ssh key path
+
+        """
+        with self._launch_lock:
+            launch = self._launch_handles.get(handle)
+        if launch is None:
+            raise Exception('Unknown VM launch handle: {}'.format(handle))
+        future = launch[0]
+
+        try:
+            result = future.result(
+                None if timeout is None else float(timeout))
+
+        except FutureTimeoutError:
+            raise Exception('Timed out waiting for VM launch: {}'.format(
+                handle))
+
+        finally:
+            if future.done():
+                with self._launch_lock:
+                    self._launch_handles.pop(handle, None)
+
         return result
 
-    def delete_vm(self, provider: str, region: str, instance_id: str):
+    @keyword
+    def cancel_vm_launch(self, handle: str = None):
+        """
+        Cancels a launch started with Start VM Launch. A launch that hasn't
+        started yet is dropped, otherwise the instance is deleted once it
+        has launched.
+
+        :param str handle: the handle returned by Start VM Launch, or None
+                           to cancel all of the launches that haven't been
+                           waited for
+
+        """
+        with self._launch_lock:
+            if handle is None:
+                launches = list(self._launch_handles.values())
+                self._launch_handles = {}
+            else:
+                launch = self._launch_handles.pop(handle, None)
+                if launch is None:
+                    raise Exception('Unknown VM launch handle: {}'.format(
+                        handle))
+                launches = [launch]
+
+        for future, provider, region in launches:
+            if not future.cancel():
+                future.add_done_callback(functools.partial(
+                    self._delete_late_launch, provider, region))
+
+    @keyword
+    def launch_vms_in_regions(self, provider: str, launches: List[dict],
+                              timeout: float = None
+                              ) -> List[Tuple[str, str, str, str]]:
+        """
+        Launches VM instances across several regions at once. Each region
+        has its own pool of workers, see the launch_workers library
+        argument, so a slow or throttled region doesn't hold up the
+        others. Instances that fail to launch are logged, and left as None
+        in the results.
+
+        :param str provider:   key for one of the supported providers
+        :param List[dict] launches: the launches, each a dictionary with
+                                    the region, security_group_id,
+                                    subnet_id, image_id, instance_type and
+                                    instance_profile, and optionally a
+                                    count of instances
+        :param float timeout:  the maximum number of seconds to wait for
+                               all of the launches
+
+        :return List[Tuple[str, str, str, str]]: one entry per requested
+                                                 instance, in the same order
+                                                 as the launches, None for
+                                                 instances that failed to
+                                                 launch
+
+        """
+        self._get_launcher(provider)
+
+        futures = {}
+        for launch in launches:
+            launch = dict(launch)
+            count = int(launch.pop('count', 1))
+            for _ in range(count):
+                future = self._scheduler.submit(
+                    launch['region'],
+                    functools.partial(self.launch_vm, provider, **launch)
+                )
+                futures[future] = launch['region']
+
+        done, not_done = wait(futures, None if timeout is None
+                              else float(timeout))
+
+        #
+        # Launches that are still queued are cancelled, ones that are
+        # already running are left to finish, and then deleted
+        #
+        for future in not_done:
+            if not future.cancel():
+                future.add_done_callback(functools.partial(
+                    self._delete_late_launch, provider, futures[future]))
+
+        results = []
+        for future, region in futures.items():
+            if future in not_done:
+                logger.warning('Timed out waiting for a launch in {}'.format(
+                    region))
+                results.append(None)
+            elif future.exception() is not None:
+                logger.warning('Launch failed in {}: {}'.format(
+                    region, future.exception()))
+                results.append(None)
+            else:
+                results.append(future.result())
+
+        if not any(results):
+            raise Exception('None of the {} launches succeeded'.format(
+                len(futures)))
+
+        return results
+
+    def _delete_late_launch(self, provider: str, region: str,
+                            future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        instance_id = future.result()[0]
+        logger.warning('Deleting instance that is no longer wanted: '
+                       '{}'.format(instance_id))
+        self.delete_vm(provider, region, instance_id, wait=False)
+
+    @keyword
+    def get_launch_stats(self) -> dict:
+        """
+        Gets the state of the background launch queues, for each region,
+        the number of launches queued, running, completed, failed and
+        cancelled, and how long launches waited in the queue.
+
+        :return dict: the statistics
+
+        """
+        return self._scheduler.stats()
+
+    @keyword
+    def launch_vms(self, provider: str, count: int, region: str,
+                   security_group_id: str, subnet_id: str, image_id: str,
+                   instance_type: str, instance_profile: str,
+                   **kwargs) -> List[Tuple[str, str, str, str]]:
         """
-        Deletes a VM instance.
+        Launches several VM instances in a single request, and waits for
+        all of them to be running. Any instances that fail to come up are
+        deleted, and only the ones that are ready are returned.
+
+        :param str provider: key for one of the supported providers
+        :param int count:    the number of instances to launch
+        :param str region:
+        :param str security_group_id:
+        :param str subnet_id:
+        :param str image_id:
+        :param str instance_type:
+        :param str instance_profile
+        :param kwargs:
+
+        :return List[Tuple[str, str, str, str]]: a list of tuples, each
+                                                 containing the instance id,
+                                                 the public hostname,
+                                                 the ssh username, and ssh
+                                                 key path
+
+        """
+        launcher = self._get_launcher(provider)
+
+        results = launcher.launch_vms(int(count), region, security_group_id,
+                                      subnet_id, image_id, instance_type,
+                                      instance_profile, **kwargs)
+
+        #
+        # Wait for the ssh port to be open on all of the instances at once.
+        # Instances without a public hostname, i.e. in a private subnet,
+        # can't be checked, and are returned as they are, the same as
+        # Launch VM.
+        #
+        hosts = [result[1] for result in results if result[1]]
+        wait_times = {}
+        if hosts:
+            with metrics.phase('ssh_wait'):
+                wait_times = self.wait_for_ports(hosts, 22, 120,
+                                                 banner='SSH-')
+        #
+        # Instances that never opened ssh are deleted in the background,
+        # through the teardown queue, see Flush Teardown
+        #
+        ready = []
+        for result in results:
+            if not result[1] or wait_times[result[1]] is not None:
+                ready.append(result)
+            else:
+                logger.warning(
+                    'SSH not available, deleting: {}'.format(result[0]))
+                launcher.queue_delete_vm(region, result[0])
+
+        if not ready:
+            raise Exception('None of the {} instances became ready'.format(
+                count))
+
+        return ready
+
+    @keyword
+    def delete_vm(self, provider: str, region: str, instance_id: str,
+                  wait: bool = True):
+        """
+        Deletes a VM instance. If the instance was leased from the pool, and
+        the pool has room for it, it is returned to the pool instead.
 
         :param str provider:    key for one of the supported providers
         :param str region:
         :param str instance_id:
+        :param bool wait:       whether to wait for the instance to be
+                                deleted, or to queue it for deletion in the
+                                background (see Flush Teardown)
+
+        """
+        launcher = self._get_launcher(provider)
+
+        pool = self._get_pool(provider)
+        if pool and pool.release(instance_id):
+            return
+
+        if wait:
+            launcher.delete_vm(region, instance_id)
+        else:
+            launcher.queue_delete_vm(region, instance_id)
+
+    @keyword
+    def flush_teardown(self, provider: str = None,
+                       timeout: float = None) -> bool:
+        """
+        Waits for VM instances queued by Delete VM with wait=False to be
+        deleted.
+
+        :param str provider:  key for one of the supported providers, or
+                              None for all providers
+        :param float timeout: the maximum number of seconds to wait, or
+                              None to wait forever
+
+        :return bool: True if all deletions finished, False if the timeout
+                      expired first
+
+        """
+        #
+        # Only launchers that have been used can have anything queued
+        #
+        providers = [provider] if provider else list(self._launchers)
+        deadline = None if timeout is None else time.monotonic() + float(
+            timeout)
+
+        flushed = True
+        for name in providers:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            flushed = self._get_launcher(name).flush_teardown(
+                remaining) and flushed
+
+        return flushed
+
+    @keyword
+    def fill_vm_pool(self, provider: str, region: str,
+                     security_group_id: str, subnet_id: str, image_id: str,
+                     instance_type: str, instance_profile: str,
+                     **kwargs) -> int:
+        """
+        Launches enough instances to fill the pool for a launch
+        configuration. This is typically called in suite setup, so that
+        subsequent Launch VM calls are served from the pool.
+
+        :param str provider: key for one of the supported providers
+        :param str region:
+        :param str security_group_id:
+        :param str subnet_id:
+        :param str image_id:
+        :param str instance_type:
+        :param str instance_profile
+        :param kwargs:
+
+        :return int: the number of instances added to the pool
+
+        """
+        pool = self._get_pool(provider)
+        if not pool:
+            raise Exception('The instance pool is not enabled')
+
+        key = pool.build_key(region, security_group_id, subnet_id, image_id,
+                             instance_type, instance_profile)
+        count = pool.missing(key)
+        if not count:
+            return 0
+
+        results = self.launch_vms(provider, count, region, security_group_id,
+                                  subnet_id, image_id, instance_type,
+                                  instance_profile, **kwargs)
+        for result in results:
+            pool.add(key, result)
+
+        return len(results)
+
+    @keyword
+    def drain_vm_pool(self, provider: str):
+        """
+        Deletes all of the idle instances in the pool.
+
+        :param str provider: key for one of the supported providers
+
+        """
+        pool = self._get_pool(provider)
+        if pool:
+            pool.drain()
+
+    @keyword
+    def cleanup_leaked_vms(self, provider: str = 'aws',
+                           include_live: bool = False,
+                           timeout: float = None,
+                           dry_run: bool = False,
+                           stale_after: float = None) -> List[str]:
+        """
+        Deletes the VM instances left behind by runs that crashed, across
+        all regions, using the journal of launched instances. Idle
+        instances in the pool are kept.
+
+        :param str provider:      key for one of the supported providers
+        :param bool include_live: also delete instances created by robot
+                                  processes that are still running
+        :param float timeout:     the maximum number of seconds to wait
+                                  for the instances to be deleted
+        :param bool dry_run:      only list the leaked instances
+        :param float stale_after: how long instances launched from other
+                                  hosts (or containers) are assumed to be
+                                  in use, in seconds, defaults to 12 hours
+
+        :return List[str]: the ids of the leaked instances
 
         """
         launcher = self._get_launcher(provider)
-        launcher.delete_vm(region, instance_id)
+
+        #
+        # The pool state is checked even if the pool is not enabled for
+        # this run, so another run's warm instances are left alone
+        #
+        pool = None
+        state_path = os.path.expanduser(os.path.join(
+            self.pool_dir, '{}-pool.json'.format(provider)))
+        if os.path.exists(state_path):
+            pool = InstancePool(launcher, state_path)
+
+        instance_ids = launcher.cleanup_leaked_vms(
+            exclude=pool.idle_instance_ids() if pool else (),
+            include_live=include_live,
+            timeout=None if timeout is None else float(timeout),
+            dry_run=dry_run,
+            stale_after=None if stale_after is None else float(stale_after)
+        )
+
+        if pool and not dry_run:
+            for instance_id in instance_ids:
+                pool.forget(instance_id)
+
+        return instance_ids
+
+    @keyword
+    def get_provider_stats(self, provider: str) -> dict:
+        """
+        Gets statistics for a provider, such as cache hit rates.
+
+        :param str provider: key for one of the supported providers
+
+        :return dict: the statistics
+
+        """
+        return self._get_launcher(provider).get_stats()
 
     def _is_open(self, host: str, port: int) -> bool:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -93,6 +691,7 @@ class CloudProvider:
         finally:
                 s.close()
 
+    @keyword
     def wait_for_port(self, host: str, port: int, retries: int) -> bool:
         """
         Waits for a port to be open
@@ -111,3 +710,66 @@ class CloudProvider:
                 else:
                         time.sleep(1)
         return host_open
+
+    @keyword
+    def wait_for_ports(self, hosts: List[str], port: int = 22,
+                       timeout: float = 300,
+                       banner: str = None) -> Dict[str, Optional[float]]:
+        """
+        Waits for ports on many hosts to be open, checking all of them
+        concurrently.
+
+        :param List[str] hosts: the hosts to check, each either a hostname,
+                                or a host:port pair
+        :param int port:        the port to check for hosts that don't
+                                specify one
+        :param float timeout:   how long to wait for all of the hosts, in
+                                seconds
+        :param str banner:      if set, a host is only considered ready once
+                                the server sends a line starting with this
+                                string, i.e. "SSH-" for an ssh server
+
+        :return Dict[str, Optional[float]]: the number of seconds each host
+                                            took to become ready, or None
+                                            if it did not become ready
+
+        """
+        targets = {}
+        for host in hosts:
+            name, sep, host_port = host.rpartition(':')
+            if sep and host_port.isdigit():
+                targets[host] = (name, int(host_port))
+            else:
+                targets[host] = (host, int(port))
+
+        #
+        # Imported here, as asyncio is only needed once ports are checked
+        #
+        from tortuga_test_lib.util import ports
+
+        wait_times = ports.wait_for_ports(targets.values(),
+                                          timeout=float(timeout),
+                                          banner=banner)
+
+        return {host: wait_times[target] for host, target in targets.items()}
+
+    def get_metrics(self) -> dict:
+        """
+        Gets the keyword and phase latency histograms recorded so far.
+        Metrics are only recorded when enabled with the
+        TORTUGA_TEST_METRICS environment variable.
+
+        :return dict: the histograms
+
+        """
+        return metrics.REGISTRY.to_dict()
+
+    def export_metrics(self, path: str, fmt: str = 'json'):
+        """
+        Writes the keyword and phase latency histograms to a file.
+
+        :param str path: the path to the file
+        :param str fmt:  either json or prometheus
+
+        """
+        metrics.REGISTRY.export(path, fmt)
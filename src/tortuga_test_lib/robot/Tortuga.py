@@ -12,43 +12,128 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import crypt
-import json
+import importlib
 import os
-import secrets
-import string
 import subprocess
+import threading
 import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from logging import getLogger
-from typing import List, Tuple, Union
+from typing import Iterator, List, Tuple, Union
 from urllib.parse import urlparse
 
-import bs4
-import pam
-import requests
-import yaml
-from oic import rndstr
-from oic.oic import Client
-from oic.oic.message import RegistrationResponse
-from oic.utils.authn.client import CLIENT_AUTHN_METHOD
+from tortuga_test_lib import logbuffer, metrics
+from tortuga_test_lib.instrumentation import keyword
+from tortuga_test_lib.logbuffer import LogBuffer
+from tortuga_test_lib.profiling import get_profiler
+from tortuga_test_lib.util.fswatch import wait_for_file_state
+from tortuga_test_lib.util.loadtest import run_load
+from tortuga_test_lib.util.oidc import OidcProviderCache
+from tortuga_test_lib.util.parsing import (ParsedFileCache,
+                                           iter_ndjson, iter_yaml_documents,
+                                           load_json, load_yaml)
+from tortuga_test_lib.util import passwords
+from tortuga_test_lib.util.process import CommandResult, stream_command
 
 logger = getLogger(__name__)
 
 
+class LoginFailed(Exception):
+    """
+    Raised when the credentials are rejected, as opposed to the login
+    not working at all.
+
+    """
+    pass
+
+
 class Tortuga:
     """
     A collection of all Tortuga commands.
 
     """
-    def __init__(self, remote=False):
+    #
+    # Parsed files are shared between all instances of the library
+    #
+    parse_cache = ParsedFileCache()
+
+    #
+    # OpenID provider data, and connections, are also shared
+    #
+    oidc_cache = OidcProviderCache()
+
+    CLI_BACKENDS = ['subprocess', 'forkserver']
+
+    def __init__(self, remote=False, pam_module='pam', profile=None,
+                 profile_dir=None, cli_backend='subprocess', cli_workers=4,
+                 cli_preload=None, log_buffer_size=10000,
+                 log_flush_interval=10):
         """
         Initialization.
 
-        :param bool remote: if the library is being run in a remote
-                            environment
+        :param bool remote:         if the library is being run in a remote
+                                    environment
+        :param str pam_module:      the module providing the PAM client, use
+                                    tortuga_test_lib.testing.pam for a stand-in
+        :param str profile:         a comma separated list of keywords to
+                                    profile, or * for all of them, see
+                                    tortuga_test_lib.profiling
+        :param str profile_dir:     the directory to write profiles to
+        :param str cli_backend:     how Run Command runs tortuga commands,
+                                    either subprocess, or forkserver to run
+                                    them in warm worker processes with the
+                                    tortuga CLI modules preloaded, falling back
+                                    to a subprocess for anything else
+        :param int cli_workers:     the number of forkserver workers
+        :param str cli_preload:     a comma separated list of more modules for
+                                    the forkserver workers to preload
+        :param int log_buffer_size: in remote mode, the maximum number of
+                                    log messages to keep for each
+                                    keyword, or 0 to print them as they
+                                    are logged
+        :param float log_flush_interval: in remote mode, how often, in
+                                    seconds, to print the messages buffered
+                                    by a keyword that is still running, or
+                                    0 to wait for it to return, see
+                                    tortuga_test_lib.logbuffer
 
         """
+        if cli_backend not in self.CLI_BACKENDS:
+            raise Exception('Unsupported CLI backend: {}'.format(
+                cli_backend))
+
         self.remote = remote
+        self.pam_module = pam_module
+        self.profiler = get_profiler(profile, profile_dir)
+        self.cli_backend = cli_backend
+        self.cli_workers = int(cli_workers)
+        self.cli_preload = [m for m in (cli_preload or '').split(',') if m]
+        self._cli_pool = None
+        self._cli_pool_lock = threading.Lock()
+        self.log_buffer = None
+        if remote and int(log_buffer_size) > 0:
+            self.log_buffer = LogBuffer(
+                int(log_buffer_size),
+                flush_interval=float(log_flush_interval) or None)
+
+    def _get_cli_pool(self):
+        """
+        Gets the forkserver worker pool, creating it the first time it is
+        used. This isn't a property, as robot inspects the library's
+        properties, which would create the pool for every backend.
+
+        """
+        with self._cli_pool_lock:
+            if self._cli_pool is None:
+                #
+                # Imported here, as multiprocessing is only needed for the
+                # forkserver backend
+                #
+                from tortuga_test_lib.util.cliworker import CliWorkerPool
+                self._cli_pool = CliWorkerPool(workers=self.cli_workers,
+                                               preload=self.cli_preload)
+
+            return self._cli_pool
 
     def _log(self, level: str, msg: str):
         log_func = getattr(logger, level.lower())
@@ -58,51 +143,132 @@ class Tortuga:
         # If this is running remotely, then we need to spit out log messages
         # using a print statement so they are properly captured. Warning
         # and error messages seem to be automatically captured, so we
-        # don't need to do anything for those.
+        # don't need to do anything for those. The messages are buffered,
+        # if possible, and printed when the keyword returns.
         #
         if self.remote and level.lower() not in ['warning', 'error']:
-            print('{}: {}'.format(level.upper(), msg))
+            if self.log_buffer is not None:
+                self.log_buffer.append(level, msg)
+            else:
+                print('{}: {}'.format(level.upper(), msg))
 
-    def wait_for_firstboot(self):
+    @keyword
+    def wait_for_firstboot(self, timeout: float = None) -> float:
         """
         Waits for tortuga to finish the boot/initialization process.
 
+        :param float timeout: the maximum number of seconds to wait, or
+                              None to wait forever
+
+        :return float: the number of seconds spent waiting
+
+        """
+        return self.wait_for_file_state('/.tortuga_firstboot', 'absent',
+                                        timeout)
+
+    @keyword
+    def wait_for_file_state(self, path: str, state: str = 'absent',
+                            timeout: float = None) -> float:
         """
-        while os.path.exists('/.tortuga_firstboot'):
-            time.sleep(5)
+        Waits for a file, such as a readiness marker, to be created or
+        removed. Changes are noticed as soon as they happen.
+
+        :param str path:      the path to the file
+        :param str state:     either "present" or "absent"
+        :param float timeout: the maximum number of seconds to wait, or
+                              None to wait forever
+
+        :return float: the number of seconds spent waiting
 
-    def hash_password(self, password: str, escape: bool = True) -> str:
+        """
+        if state not in ['present', 'absent']:
+            raise Exception('Unsupported file state: {}'.format(state))
+
+        try:
+            waited = wait_for_file_state(
+                path,
+                exists=state == 'present',
+                timeout=None if timeout is None else float(timeout)
+            )
+
+        except TimeoutError as ex:
+            raise Exception(str(ex))
+
+        self._log('info', 'Waited {:.1f}s for {} to be {}'.format(
+            waited, path, state))
+
+        return waited
+
+    @keyword
+    def hash_password(self, password: str, escape: bool = True,
+                      scheme: str = 'md5') -> str:
         """
         Creates a password hash, suitable for use in a Linux password file.
 
         :param str password: the unencrypted password
         :param bool escape:  whether or not to escape the string for use
                              in a command line parameter
+        :param str scheme:   the hash scheme, one of md5, sha512, or
+                             yescrypt
 
         :return str: the password hash
 
         """
-        hash_ = crypt.crypt(password, crypt.mksalt(crypt.METHOD_MD5))
+        hash_ = passwords.hash_password(password, scheme)
 
         if escape:
             hash_ = hash_.replace('$', '\$')
 
         return hash_
 
-    def generate_password(self, length: int = 16) -> Tuple[str, str]:
+    @keyword
+    def generate_password(self, length: int = 16,
+                          scheme: str = 'md5') -> Tuple[str, str]:
         """
         Generates a random password, and hash for that password.
 
         :param int length: the length of the password to generate
+        :param str scheme: the hash scheme, one of md5, sha512, or yescrypt
 
         :return Tuple[str, str]: the password, and hash
 
         """
-        alphabet = string.ascii_letters + string.digits
-        password = ''.join(secrets.choice(alphabet) for _ in range(length))
+        password = passwords.generate_password(int(length))
+
+        return password, self.hash_password(password, scheme=scheme)
+
+    @keyword
+    def generate_passwords(self, count: int, length: int = 16,
+                           scheme: str = 'sha512', escape: bool = True,
+                           processes: int = None) -> List[Tuple[str, str]]:
+        """
+        Generates many random passwords, and their hashes, hashing them in
+        parallel on a process pool.
+
+        :param int count:     the number of passwords to generate
+        :param int length:    the length of each password
+        :param str scheme:    the hash scheme, one of md5, sha512, or
+                              yescrypt
+        :param bool escape:   whether or not to escape the hashes for use
+                              in a command line parameter
+        :param int processes: the number of worker processes, defaults to
+                              the number of CPUs
+
+        :return List[Tuple[str, str]]: the passwords, and hashes
+
+        """
+        plain = [passwords.generate_password(int(length))
+                 for _ in range(int(count))]
+        hashes = passwords.hash_passwords(
+            plain, scheme,
+            processes=None if processes is None else int(processes))
+
+        if escape:
+            hashes = [hash_.replace('$', '\\$') for hash_ in hashes]
 
-        return password, self.hash_password(password)
+        return list(zip(plain, hashes))
 
+    @keyword
     def pam_authenticate(self, username: str, password: str):
         """
         Test user authentication using PAM.
@@ -113,10 +279,11 @@ class Tortuga:
         :return bool: True if authentication succeeded, False otherwise
 
         """
-        p = pam.pam()
+        p = importlib.import_module(self.pam_module).pam()
 
         return p.authenticate(username, password)
 
+    @keyword
     def openid_authenticate(
             self,
             issuer: str,
@@ -127,13 +294,31 @@ class Tortuga:
             password: str,
             ca_bundle: str = '/etc/pki/tls/certs/ca-bundle.crt'):
         #
-        # Setup the client
+        # These are imported here, rather than at the top of the module, so
+        # that suites that never use OpenID don't pay for loading them
         #
+        import bs4
+        from oic import rndstr
+        from oic.oic import Client
+        from oic.oic.message import (ProviderConfigurationResponse,
+                                     RegistrationResponse)
+        from oic.utils.authn.client import CLIENT_AUTHN_METHOD
+
+        #
+        # Setup the client, using the cached provider configuration
+        #
+        session = self.oidc_cache.session(issuer, ca_bundle)
+        with metrics.phase('oidc_discovery'):
+            provider_info, jwks = self.oidc_cache.provider(issuer, ca_bundle)
         client = Client(
             client_authn_method=CLIENT_AUTHN_METHOD,
-            verify_ssl='/etc/pki/tls/certs/ca-bundle.crt'
+            verify_ssl=ca_bundle
         )
-        client.provider_config(issuer)
+        client.handle_provider_config(
+            ProviderConfigurationResponse(**provider_info), issuer,
+            keys=False)
+        if jwks and client.keyjar is not None:
+            client.keyjar.import_jwks(jwks, provider_info['issuer'])
         client_registration = RegistrationResponse(
             client_id=client_id,
             client_secret=client_secret
@@ -158,7 +343,8 @@ class Tortuga:
         #
         # Get the login page
         #
-        resp = requests.get(auth_url, verify=ca_bundle)
+        with metrics.phase('oidc_login_page'):
+            resp = session.get(auth_url)
         if not resp.status_code == 200:
             raise Exception(
                 'Error getting login URL: {}'.format(resp.status_code))
@@ -183,21 +369,91 @@ class Tortuga:
             'login': username,
             'password': password
         }
-        resp = requests.post(login_url, data=data,
-                             verify='/etc/pki/tls/certs/ca-bundle.crt')
+        with metrics.phase('oidc_login'):
+            resp = session.post(login_url, data=data)
         if not resp.status_code == 200:
             raise Exception(
                 'Error posting login: {}'.format(resp.status_code))
         if not resp.url.startswith(client_redirect):
             self._log('warning', 'URL: {}'.format(resp.url))
             self._log('warning', resp.text)
-            raise Exception('Login failed')
+            raise LoginFailed('Login failed')
 
         return True
 
+    @keyword
+    def auth_load_test(self, backend: str, users: list,
+                       concurrency: int = 10, duration: float = 30,
+                       iterations: int = None, **kwargs) -> dict:
+        """
+        Drives concurrent logins against an authentication backend, and
+        measures how it behaves under load.
+
+        :param str backend:     either pam or openid
+        :param list users:      the users to log in as, cycled through in
+                                order, each either a "username:password"
+                                string, or a [username, password] pair
+        :param int concurrency: the number of concurrent logins
+        :param float duration:  the number of seconds to run for
+        :param int iterations:  if set, the total number of logins to make,
+                                instead of running for the duration
+        :param kwargs:          for openid, the issuer, client_id,
+                                client_secret, client_redirect, and
+                                optionally ca_bundle arguments of OpenID
+                                Authenticate
+
+        :return dict: the number of requests, successes, failures and
+                      errors, the errors by message, the throughput in
+                      logins per second, and the latency (min, mean, p50,
+                      p95, p99 and max) in seconds
+
+        """
+        if backend == 'pam':
+            def login(username, password):
+                return self.pam_authenticate(username, password)
+
+        elif backend == 'openid':
+            def login(username, password):
+                #
+                # Rejected credentials count as failures, like PAM, rather
+                # than errors
+                #
+                try:
+                    return self.openid_authenticate(
+                        username=username, password=password, **kwargs)
+                except LoginFailed:
+                    return False
+
+        else:
+            raise Exception('Unsupported auth backend: {}'.format(backend))
+
+        credentials = []
+        for user in users:
+            if isinstance(user, str):
+                user = user.split(':', 1)
+            credentials.append(tuple(user))
+
+        result = run_load(
+            login,
+            credentials,
+            concurrency=int(concurrency),
+            duration=None if iterations is not None else float(duration),
+            iterations=None if iterations is None else int(iterations)
+        )
+        self._log('info', 'Auth load test: {}'.format(result))
+
+        return result
+
+    @keyword
     def run_command(self,
                     cmd: str,
-                    exit_code: Union[int, List[int]] = 0) -> str:
+                    exit_code: Union[int, List[int]] = 0,
+                    stream: bool = False,
+                    timeout: float = None,
+                    idle_timeout: float = None,
+                    max_lines: int = 10000,
+                    output_path: str = None,
+                    backend: str = None) -> str:
         """
         Runs a tortuga CLI command.
 
@@ -205,62 +461,257 @@ class Tortuga:
         :param Union[int,List[int]] exit_code: the exit code(s) to expect as
                                                successful (use a list if more
                                                than one is valid)
+        :param bool stream:                    log the output line by line as
+                                               it arrives, and only keep the
+                                               most recent lines in memory
+        :param float timeout:                  the maximum number of seconds
+                                               the command may run for,
+                                               implies stream
+        :param float idle_timeout:             the maximum number of seconds
+                                               the command may run without
+                                               producing output, implies
+                                               stream
+        :param int max_lines:                  when streaming, the number of
+                                               lines of output to keep
+        :param str output_path:                when streaming, write the full
+                                               output to this file
+        :param str backend:                    overrides the cli_backend
+                                               library argument, streamed
+                                               commands always run as a
+                                               subprocess
 
         :return str: the output of the command
 
         """
         self._log('info', cmd)
 
+        exit_code = self._get_exit_codes(exit_code)
+
+        if stream or timeout is not None or idle_timeout is not None:
+            return self._stream_command(cmd, exit_code, timeout,
+                                        idle_timeout, int(max_lines),
+                                        output_path)
+
+        backend = backend or self.cli_backend
+        if backend not in self.CLI_BACKENDS:
+            raise Exception('Unsupported CLI backend: {}'.format(backend))
+
+        #
+        # Run the command, in a warm worker if possible. Once a worker has
+        # taken the command, it is never run again as a subprocess, even if
+        # the worker fails, as it may have partly run.
         #
-        # Convert exit_code to a list of integers
+        result = None
+        if backend == 'forkserver':
+            cli_pool = self._get_cli_pool()
+            if cli_pool.resolve(cmd):
+                with metrics.phase('cli_worker_exec'):
+                    result = cli_pool.run(cmd)
+
+        if result is None:
+            with metrics.phase('cli_exec'):
+                proc = subprocess.run(
+                    [cmd],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    shell=True
+                )
+            result = CommandResult(proc.returncode, proc.stdout.decode(),
+                                   proc.stderr.decode())
+
+        #
+        # Test the exit codes
         #
+        if result.returncode not in exit_code:
+            self._log('info', result.stdout)
+            self._log('warning', result.stderr)
+            raise Exception('Unsuccessful exit code: {}'.format(
+                result.returncode
+            ))
+
+        return result.stdout
+
+    def _get_exit_codes(self, exit_code: Union[int, List[int]]) -> List[int]:
+        """
+        Converts exit_code to a list of integers.
+
+        """
         if not isinstance(exit_code, list):
             exit_code = [exit_code]
-        exit_code = [int(v) for v in exit_code]
+
+        return [int(v) for v in exit_code]
+
+    @keyword
+    def run_commands(self,
+                     commands: list,
+                     exit_code: Union[int, List[int]] = 0,
+                     max_workers: int = 8,
+                     fail_fast: bool = True) -> List[dict]:
+        """
+        Runs several independent tortuga CLI commands in parallel.
+
+        :param list commands:                  the commands to run, each
+                                               either a string, or a
+                                               [command, exit code(s)] pair
+                                               to override exit_code
+        :param Union[int,List[int]] exit_code: the exit code(s) to expect as
+                                               successful
+        :param int max_workers:                the maximum number of commands
+                                               to run at once
+        :param bool fail_fast:                 if True, fail as soon as one
+                                               command fails, without
+                                               starting the rest, otherwise
+                                               run all of the commands and
+                                               report all of the failures
+
+        :return List[dict]: a result for each command, in the same order
+                            as the commands, with the cmd, output, and
+                            duration (in seconds)
+
+        """
+        jobs = []
+        for command in commands:
+            if isinstance(command, (list, tuple)):
+                jobs.append((command[0], self._get_exit_codes(command[1])))
+            else:
+                jobs.append((command, self._get_exit_codes(exit_code)))
 
         #
-        # Run the command
+        # Messages logged on the worker threads are collected for each
+        # command, and added to this keyword's log afterwards, so they
+        # aren't interleaved
         #
-        proc = subprocess.run(
-            [cmd],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True
-        )
+        logs = [[] for _ in jobs]
+
+        def run(job, records):
+            start = time.monotonic()
+            with logbuffer.collect(records):
+                output = self.run_command(*job)
+            return {
+                'cmd': job[0],
+                'output': output,
+                'duration': time.monotonic() - start
+            }
+
+        with ThreadPoolExecutor(max_workers=int(max_workers)) as executor:
+            futures = [executor.submit(run, job, records)
+                       for job, records in zip(jobs, logs)]
+            if fail_fast:
+                wait(futures, return_when=FIRST_EXCEPTION)
+                for future in futures:
+                    future.cancel()
+            else:
+                wait(futures)
+
+        if self.log_buffer is not None:
+            for records in logs:
+                self.log_buffer.extend(records)
+
+        errors = []
+        for job, future in zip(jobs, futures):
+            if not future.cancelled() and future.exception():
+                errors.append('{}: {}'.format(job[0], future.exception()))
+        if errors:
+            raise Exception('{} command(s) failed:\n{}'.format(
+                len(errors), '\n'.join(errors)))
+
+        return [future.result() for future in futures]
+
+    def _stream_command(self, cmd: str, exit_code: List[int],
+                        timeout: float, idle_timeout: float,
+                        max_lines: int, output_path: str) -> str:
+        def on_line(stream: str, line: str):
+            if stream == 'stderr':
+                line = '[stderr] {}'.format(line)
+            self._log('info', line)
+
+        with metrics.phase('cli_exec'):
+            result = stream_command(
+                cmd,
+                on_line=on_line,
+                timeout=None if timeout is None else float(timeout),
+                idle_timeout=None if idle_timeout is None else float(
+                    idle_timeout),
+                max_lines=max_lines,
+                output_path=output_path
+            )
 
         #
-        # Test the exit codes
+        # The output has already been logged as it arrived, so there is no
+        # need to log it again on failure
         #
-        if proc.returncode not in exit_code:
-            self._log('info', proc.stdout.decode())
-            self._log('warning', proc.stderr.decode())
+        if result.timed_out:
+            raise Exception('Command {}: {}'.format(result.timed_out, cmd))
+
+        if result.returncode not in exit_code:
             raise Exception('Unsuccessful exit code: {}'.format(
-                proc.returncode
+                result.returncode
             ))
 
-        return proc.stdout.decode()
+        return result.stdout
 
-    def parse_file(self, path: str, fmt='json') -> Union[list, dict]:
+    @keyword
+    def parse_file(self, path: str, fmt='json',
+                   cache: bool = False) -> Union[list, dict, Iterator]:
         """
         Opens, reads, and parses a file, returning the result as a Python
         data structure.
 
-        :param str path: path to the file
-        :param str fmt:  format of the file, default is json
+        The ndjson and yaml-multi formats return an iterator that parses
+        one record, or document, at a time.
+
+        :param str path:   path to the file
+        :param str fmt:    format of the file, one of json (the default),
+                           yaml, ndjson, or yaml-multi
+        :param bool cache: whether to cache json and yaml files until they
+                           change, the cached result is shared between
+                           callers, so it must not be modified
 
-        :return Union[list, dict]: parsed data structure
+        :return Union[list, dict, Iterator]: parsed data structure
 
         """
         path = path.strip()
         if not os.path.exists(path):
             raise Exception('File not found: {}'.format(path))
 
+        if fmt == 'ndjson':
+            return iter_ndjson(path)
+
+        elif fmt == 'yaml-multi':
+            return iter_yaml_documents(path)
+
+        elif fmt == 'json':
+            loader = load_json
+
+        elif fmt == 'yaml':
+            loader = load_yaml
+
+        else:
+            raise Exception('Unsupported file format: {}'.format(fmt))
+
+        if cache:
+            return self.parse_cache.get(path, fmt, loader)
+
         with open(path) as fp:
-            if fmt == 'json':
-                return json.load(fp)
+            return loader(fp)
 
-            elif fmt == 'yaml':
-                return yaml.load(fp)
+    def get_metrics(self) -> dict:
+        """
+        Gets the keyword and phase latency histograms recorded so far.
+        Metrics are only recorded when enabled with the
+        TORTUGA_TEST_METRICS environment variable.
 
-            else:
-                raise Exception('Unsupported file format: {}'.format(fmt))
+        :return dict: the histograms
+
+        """
+        return metrics.REGISTRY.to_dict()
+
+    def export_metrics(self, path: str, fmt: str = 'json'):
+        """
+        Writes the keyword and phase latency histograms to a file.
+
+        :param str path: the path to the file
+        :param str fmt:  either json or prometheus
+
+        """
+        metrics.REGISTRY.export(path, fmt)
@@ -0,0 +1,108 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import xmlrpc.client
+from typing import List
+
+from tortuga_test_lib import logbuffer
+
+
+class TortugaRemote:
+    """
+    A RobotFramework library for talking to the Tortuga remote test server
+    beyond the standard Remote library protocol.
+
+    """
+    def __init__(self, uri: str = 'http://127.0.0.1:8270'):
+        """
+        Initialization.
+
+        :param str uri: the URI of the remote test server
+
+        """
+        if '://' not in uri:
+            uri = 'http://{}'.format(uri)
+        self.uri = uri
+
+    def run_keyword_batch(self, calls: list,
+                          stop_on_failure: bool = True,
+                          fail_on_error: bool = True,
+                          log_mode: str = 'output') -> List[dict]:
+        """
+        Runs several keywords on the remote test server in a single round
+        trip.
+
+        :param list calls:           the keywords to run, each a list with
+                                     the keyword name, i.e. "Run Command",
+                                     followed by its arguments, or a dict
+                                     with name, args and kwargs
+        :param bool stop_on_failure: whether to skip the rest of the calls
+                                     after one fails
+        :param bool fail_on_error:   whether to fail if any of the calls
+                                     failed
+        :param str log_mode:         how the server returns the messages
+                                     logged by the keywords, either output,
+                                     json, or zlib to compress them
+
+        :return List[dict]: the result of each call that was run, with the
+                            name, status, return value, output, error,
+                            elapsed time in seconds, and the log records,
+                            if the log mode isn't output
+
+        """
+        requests = []
+        for call in calls:
+            if isinstance(call, dict):
+                call = dict(call)
+                call['name'] = self._keyword_name(call['name'])
+            else:
+                call = [self._keyword_name(call[0])] + list(call[1:])
+            requests.append(call)
+
+        server = xmlrpc.client.ServerProxy(self.uri, allow_none=True)
+        if log_mode == 'output':
+            #
+            # Servers without structured logs only take two arguments
+            #
+            results = server.run_keyword_batch(requests, stop_on_failure)
+        else:
+            results = server.run_keyword_batch(requests, stop_on_failure,
+                                               log_mode)
+
+        errors = []
+        for request, result in zip(requests, results):
+            name = request['name'] if isinstance(request, dict) \
+                else request[0]
+            result['name'] = name
+
+            #
+            # Print the output so that robot picks up the log messages,
+            # the same way the Remote library does
+            #
+            if result.get('output'):
+                print(result['output'].rstrip('\n'))
+            if result.get('log'):
+                result['log'] = logbuffer.decode_records(result['log'])
+                print(logbuffer.format_records(result['log']).rstrip('\n'))
+            if result['status'] != 'PASS':
+                errors.append('{}: {}'.format(name, result.get('error')))
+
+        if errors and fail_on_error:
+            raise Exception('{} keyword(s) failed:\n{}'.format(
+                len(errors), '\n'.join(errors)))
+
+        return results
+
+    def _keyword_name(self, name: str) -> str:
+        return name.strip().lower().replace(' ', '_')
@@ -0,0 +1,58 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+
+from tortuga_test_lib.robot.CloudProvider import CloudProvider
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Deletes the VM instances left behind by test runs '
+                    'that crashed')
+    parser.add_argument('--provider', default='aws')
+    parser.add_argument('--pool-dir', default='~/.tortuga-test-lib',
+                        help='the directory where the pool state is kept, '
+                             'idle pooled instances are not deleted')
+    parser.add_argument('--include-live', action='store_true',
+                        help='also delete instances created by test runs '
+                             'that are still running')
+    parser.add_argument('--stale-after', type=float,
+                        help='how long instances launched from other '
+                             'hosts, or containers, are assumed to be in '
+                             'use, in seconds, defaults to 12 hours')
+    parser.add_argument('--timeout', type=float,
+                        help='the maximum number of seconds to wait for '
+                             'the instances to be deleted')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only list the leaked instances')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    instance_ids = CloudProvider(pool_dir=args.pool_dir).cleanup_leaked_vms(
+        args.provider,
+        include_live=args.include_live,
+        timeout=args.timeout,
+        dry_run=args.dry_run,
+        stale_after=args.stale_after
+    )
+
+    for instance_id in instance_ids:
+        print(instance_id)
+
+
+if __name__ == '__main__':
+    main()
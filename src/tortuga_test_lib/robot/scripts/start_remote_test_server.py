@@ -11,22 +11,65 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import argparse
+import functools
+
 from daemonize import Daemonize
-from robotremoteserver import RobotRemoteServer
 
+from tortuga_test_lib.remote.server import TortugaRemoteServer
 from tortuga_test_lib.robot.Tortuga import Tortuga
 
 pid = "/tmp/robot_server.pid"
 
 
-def serve():
-    RobotRemoteServer(
-        Tortuga(remote=True),
-        host='0.0.0.0',
+def serve(host: str = '0.0.0.0', port: int = 8270, workers: int = 1,
+          log_buffer_size: int = 10000, log_flush_interval: float = 10):
+    TortugaRemoteServer(
+        Tortuga(remote=True, log_buffer_size=log_buffer_size,
+                log_flush_interval=log_flush_interval),
+        host=host,
+        port=port,
+        workers=workers,
         allow_remote_stop=True,
     )
 
 
 def main():
-    daemon = Daemonize(app="robot_server", pid=pid, action=serve)
-    daemon.start()
+    parser = argparse.ArgumentParser(
+        description='Starts the Tortuga remote test server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8270)
+    parser.add_argument('--mode', choices=['single', 'threaded'],
+                        default='single',
+                        help='handle requests one at a time, or on a pool '
+                             'of worker threads')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='the number of worker threads in threaded mode')
+    parser.add_argument('--log-buffer-size', type=int, default=10000,
+                        help='the maximum number of log messages to keep '
+                             'for each keyword, 0 prints them as they are '
+                             'logged')
+    parser.add_argument('--log-flush-interval', type=float, default=10,
+                        help='how often, in seconds, to print the log '
+                             'messages of a keyword that is still running, '
+                             '0 waits for it to return')
+    parser.add_argument('--foreground', action='store_true',
+                        help='do not daemonize')
+    parser.add_argument('--pid', default=pid,
+                        help='the pid file used when daemonized')
+    args = parser.parse_args()
+
+    action = functools.partial(
+        serve,
+        host=args.host,
+        port=args.port,
+        workers=args.workers if args.mode == 'threaded' else 1,
+        log_buffer_size=args.log_buffer_size,
+        log_flush_interval=args.log_flush_interval
+    )
+
+    if args.foreground:
+        action()
+    else:
+        daemon = Daemonize(app="robot_server", pid=args.pid, action=action)
+        daemon.start()
@@ -0,0 +1,160 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A stand-in for the tortuga CLI, producing output shaped like the real
+commands, for running the Tortuga library offline.
+
+    python -m tortuga_test_lib.testing.cli get-node-list
+
+install writes a script for each command into a directory, to put at the
+front of the PATH, and ENTRY_POINTS maps each command to command_main, to
+run it in a CLI worker pool. TORTUGA_TEST_FAKE_CLI_LATENCY sets a delay, in seconds,
+for each command, and TORTUGA_TEST_FAKE_CLI_NODES the number of nodes.
+
+"""
+import os
+import stat
+import sys
+import time
+from typing import Callable, Dict, List
+
+
+def _nodes() -> List[str]:
+    count = int(os.environ.get('TORTUGA_TEST_FAKE_CLI_NODES', 4))
+
+    return ['compute-{:02d}.private'.format(i + 1) for i in range(count)]
+
+
+def get_node_list(args: List[str]) -> int:
+    for node in _nodes():
+        print(node)
+
+    return 0
+
+
+def get_node_status(args: List[str]) -> int:
+    for node in _nodes():
+        print('{}: state=Installed, locked=Unlocked'.format(node))
+
+    return 0
+
+
+def get_software_profile_list(args: List[str]) -> int:
+    print('Installer')
+    print('Compute')
+
+    return 0
+
+
+def get_hardware_profile_list(args: List[str]) -> int:
+    print('Installer')
+    print('LocalIron')
+    print('aws')
+
+    return 0
+
+
+def get_kit_list(args: List[str]) -> int:
+    print('base-7.1.0-0')
+    print('awsadapter-7.1.0-0')
+
+    return 0
+
+
+def add_nodes(args: List[str]) -> int:
+    print('Add host session [00000000-0000-0000-0000-000000000000] '
+          'created successfully.')
+
+    return 0
+
+
+def delete_node(args: List[str]) -> int:
+    if not args:
+        print('Error: --node is required', file=sys.stderr)
+        return 1
+
+    return 0
+
+
+COMMANDS: Dict[str, Callable[[List[str]], int]] = {
+    'get-node-list': get_node_list,
+    'get-node-status': get_node_status,
+    'get-software-profile-list': get_software_profile_list,
+    'get-hardware-profile-list': get_hardware_profile_list,
+    'get-kit-list': get_kit_list,
+    'add-nodes': add_nodes,
+    'delete-node': delete_node
+}
+
+
+def run(command: str, args: List[str]) -> int:
+    latency = float(os.environ.get('TORTUGA_TEST_FAKE_CLI_LATENCY', 0))
+    if latency:
+        time.sleep(latency)
+
+    if command not in COMMANDS:
+        print('{}: command not found'.format(command), file=sys.stderr)
+        return 127
+
+    return COMMANDS[command](args)
+
+
+ENTRY_POINTS: Dict[str, str] = {
+    command: '{}:command_main'.format(__name__) for command in COMMANDS
+}
+
+
+def install(directory: str) -> List[str]:
+    """
+    Writes a script for each command into a directory.
+
+    :param str directory: the directory, created if it does not exist
+
+    :return List[str]: the paths of the scripts
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for command in COMMANDS:
+        path = os.path.join(directory, command)
+        with open(path, 'w') as fp:
+            fp.write('#!/bin/sh\nexec {} -m {} {} "$@"\n'.format(
+                sys.executable, __name__, command))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP |
+                 stat.S_IXOTH)
+        paths.append(path)
+
+    return paths
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('usage: {} COMMAND [ARGS...]'.format(sys.argv[0]),
+              file=sys.stderr)
+        sys.exit(2)
+
+    sys.exit(run(sys.argv[1], sys.argv[2:]))
+
+
+def command_main():
+    """
+    The entry point for a single command, named by sys.argv[0].
+
+    """
+    sys.exit(run(os.path.basename(sys.argv[0]), sys.argv[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local stand-in OpenID Connect identity provider, serving just enough of
+the discovery, authorization and login flow for openid_authenticate.
+
+    python -m tortuga_test_lib.testing.idp --port 8900 --user alice:secret
+
+"""
+import argparse
+import collections
+import html
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+LOGIN_FORM = '''<html>
+<body>
+<form method="post" action="/login?session={session}">
+<input type="text" name="login">
+<input type="password" name="password">
+<input type="submit" value="Log in">
+</form>
+</body>
+</html>
+'''
+
+
+class _IdpRequestHandler(BaseHTTPRequestHandler):
+    #
+    # Keep-alive, so that connection reuse by clients can be measured
+    #
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.idp.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str = '',
+              content_type: str = 'text/html', headers: dict = None):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        idp = self.server.idp
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        idp.delay()
+
+        if url.path == '/.well-known/openid-configuration':
+            idp.count('discovery')
+            self._send(200, json.dumps(idp.provider_info()),
+                       'application/json')
+
+        elif url.path == '/jwks':
+            idp.count('jwks')
+            self._send(200, json.dumps({'keys': []}), 'application/json')
+
+        elif url.path == '/authorize':
+            idp.count('authorize')
+            session = idp.start_session(query['redirect_uri'][0],
+                                        query.get('state', [''])[0])
+            self._send(200, LOGIN_FORM.format(session=html.escape(session)))
+
+        elif url.path == '/callback':
+            self._send(200, 'Logged in')
+
+        else:
+            self._send(404, 'Not found')
+
+    def do_POST(self):
+        idp = self.server.idp
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        idp.delay()
+
+        if url.path != '/login':
+            self._send(404, 'Not found')
+            return
+
+        idp.count('login')
+        session = query.get('session', [''])[0]
+        redirect = idp.login(session, form.get('login', [''])[0],
+                             form.get('password', [''])[0])
+        if redirect:
+            self._send(302, headers={'Location': redirect})
+        else:
+            idp.count('login_failed')
+            self._send(200, LOGIN_FORM.format(session=html.escape(session)))
+
+
+class LocalIdp:
+    """
+    A local OpenID Connect identity provider, running in a background
+    thread.
+
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 users: Dict[str, str] = None, latency: float = 0):
+        """
+        Initialization.
+
+        :param str host:
+        :param int port:            the port to listen on, 0 picks a free
+                                    port
+        :param Dict[str, str] users: usernames, and their passwords
+        :param float latency:       a delay, in seconds, added to every
+                                    request
+
+        """
+        self.users = dict(users or {})
+        self.latency = latency
+        self.stats: Dict[str, int] = collections.Counter()
+        self._sessions: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _IdpRequestHandler)
+        self._server.daemon_threads = True
+        self._server.idp = self
+        self._thread = None
+
+    @property
+    def issuer(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def client_redirect(self) -> str:
+        return '{}/callback'.format(self.issuer)
+
+    def provider_info(self) -> dict:
+        return {
+            'issuer': self.issuer,
+            'authorization_endpoint': '{}/authorize'.format(self.issuer),
+            'token_endpoint': '{}/token'.format(self.issuer),
+            'jwks_uri': '{}/jwks'.format(self.issuer),
+            'response_types_supported': ['code'],
+            'subject_types_supported': ['public'],
+            'id_token_signing_alg_values_supported': ['RS256']
+        }
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def start_session(self, redirect_uri: str, state: str) -> str:
+        session = secrets.token_urlsafe(16)
+        with self._lock:
+            self._sessions[session] = (redirect_uri, state)
+
+        return session
+
+    def login(self, session: str, username: str, password: str) -> str:
+        """
+        Logs in a user.
+
+        :return str: the URL to redirect to, or None if the login failed
+
+        """
+        with self._lock:
+            if session not in self._sessions or \
+                    self.users.get(username) != password:
+                return None
+            redirect_uri, state = self._sessions.pop(session)
+
+        return '{}?{}'.format(redirect_uri, urlencode({
+            'code': secrets.token_urlsafe(16),
+            'state': state
+        }))
+
+    def start(self) -> 'LocalIdp':
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='local-idp', daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'LocalIdp':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='A local stand-in OpenID Connect identity provider')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--user', action='append', default=[],
+                        help='a username:password pair, may be repeated')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='a delay, in seconds, added to every request')
+    args = parser.parse_args()
+
+    users = dict(user.split(':', 1) for user in args.user)
+    idp = LocalIdp(args.host, args.port, users, args.latency).start()
+    print('Issuer: {}'.format(idp.issuer))
+    print('Client redirect: {}'.format(idp.client_redirect))
+    try:
+        idp._thread.join()
+    except KeyboardInterrupt:
+        idp.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A stand-in for the python-pam module, for testing without a real PAM
+stack. Load it with the Tortuga library argument
+pam_module=tortuga_test_lib.testing.pam.
+
+Users are read from the TORTUGA_TEST_PAM_USERS environment variable, as a
+comma separated list of username:password pairs, or added with add_user.
+TORTUGA_TEST_PAM_LATENCY sets a delay, in seconds, for each
+authentication.
+
+"""
+import os
+import threading
+import time
+from typing import Dict
+
+
+_lock = threading.Lock()
+_users: Dict[str, str] = {}
+
+for _entry in os.environ.get('TORTUGA_TEST_PAM_USERS', '').split(','):
+    if ':' in _entry:
+        _username, _password = _entry.split(':', 1)
+        _users[_username] = _password
+
+
+def add_user(username: str, password: str):
+    with _lock:
+        _users[username] = password
+
+
+class pam:
+    def __init__(self):
+        self.code = 0
+        self.reason = None
+        self.latency = float(os.environ.get('TORTUGA_TEST_PAM_LATENCY', 0))
+
+    def authenticate(self, username: str, password: str,
+                     service: str = 'login', **kwargs) -> bool:
+        if self.latency:
+            time.sleep(self.latency)
+
+        with _lock:
+            ok = _users.get(username) == password
+
+        if ok:
+            self.code, self.reason = 0, 'Success'
+        else:
+            self.code, self.reason = 7, 'Authentication failure'
+
+        return ok
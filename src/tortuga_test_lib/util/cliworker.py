@@ -0,0 +1,343 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs Python CLI entry points, such as the tortuga commands, in worker
+processes forked from a server that has already imported them, rather than
+starting a new interpreter, and importing everything, for every command.
+
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import re
+import select
+import shlex
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tortuga_test_lib.util.process import CommandResult
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Commands using any of these need a shell
+#
+_SHELL_SYNTAX = re.compile(r'[|&;<>()$`*?\[\]~{}#\n]|^\s*\w+=')
+
+#
+# How much longer than the command timeout to wait for a worker, which
+# enforces the timeout itself, before giving up on it
+#
+_RESULT_GRACE = 30
+
+
+def console_scripts(module_prefixes: Iterable[str]) -> Dict[str, str]:
+    """
+    Gets the installed console scripts whose entry points are in modules
+    with one of the prefixes.
+
+    :param Iterable[str] module_prefixes: i.e. "tortuga."
+
+    :return Dict[str, str]: the entry points, as "module:function", by
+                            command name
+
+    """
+    from importlib.metadata import entry_points
+
+    module_prefixes = tuple(module_prefixes)
+    scripts = {}
+    for entry_point in entry_points(group='console_scripts'):
+        if entry_point.value.startswith(module_prefixes):
+            scripts[entry_point.name] = entry_point.value
+
+    return scripts
+
+
+def _exec_entry_point(entry_point: str, argv: List[str],
+                      env: Dict[str, str], cwd: str, stdout_fd: int,
+                      stderr_fd: int) -> int:
+    """
+    Runs an entry point in a forked child.
+
+    :return int: the exit code
+
+    """
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+    sys.argv = argv
+
+    #
+    # Output is captured at the file descriptor level, so that output from
+    # C extensions, and child processes, is included
+    #
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    sys.stdin = open(0, closefd=False)
+    sys.stdout = open(1, 'w', closefd=False)
+    sys.stderr = open(2, 'w', closefd=False)
+
+    try:
+        module_name, _, attr = entry_point.partition(':')
+        func = importlib.import_module(module_name)
+        for name in attr.split('.'):
+            func = getattr(func, name)
+        result = func()
+        returncode = result if isinstance(result, int) else 0
+
+    except SystemExit as ex:
+        if ex.code is None:
+            returncode = 0
+        elif isinstance(ex.code, int):
+            returncode = ex.code
+        else:
+            print(ex.code, file=sys.stderr)
+            returncode = 1
+
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    return returncode
+
+
+def _preload(modules: List[str]):
+    """
+    Imports the entry point modules when a worker starts, so the children
+    it forks for each command start warm.
+
+    :param List[str] modules: the modules to import, modules that fail to
+                              import are skipped
+
+    """
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            logger.debug('Failed to preload {}'.format(module),
+                         exc_info=True)
+
+
+def _run_entry_point(entry_point: str, argv: List[str], env: Dict[str, str],
+                     cwd: str, timeout: float = None
+                     ) -> Optional[Tuple[int, bytes, bytes]]:
+    """
+    Runs an entry point from a worker process. The worker forks a child
+    for each command, so commands start from the worker's warm state, and
+    can't change it for the commands that follow.
+
+    :return Optional[Tuple[int, bytes, bytes]]: the exit code, stdout and
+                                                stderr, or None if the
+                                                command timed out, and was
+                                                killed
+
+    """
+    with tempfile.TemporaryFile() as stdout_fp, \
+            tempfile.TemporaryFile() as stderr_fp:
+        #
+        # The child holds the write end of the pipe until it exits, so the
+        # worker can wait for it with a timeout
+        #
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            returncode = 1
+            try:
+                returncode = _exec_entry_point(
+                    entry_point, argv, env, cwd, stdout_fp.fileno(),
+                    stderr_fp.fileno())
+            finally:
+                os._exit(returncode & 0xff)
+
+        os.close(write_fd)
+        try:
+            exited, _, _ = select.select([read_fd], [], [], timeout)
+            if not exited:
+                os.kill(pid, signal.SIGKILL)
+        finally:
+            os.close(read_fd)
+
+        _, status = os.waitpid(pid, 0)
+        if not exited:
+            return None
+
+        stdout_fp.seek(0)
+        stderr_fp.seek(0)
+
+        return (os.waitstatus_to_exitcode(status), stdout_fp.read(),
+                stderr_fp.read())
+
+
+class CliWorkerPool:
+    """
+    A pool of worker processes for running CLI entry points.
+
+    Workers are started by the forkserver, and import the entry point
+    modules when they start. Each worker forks again for every command, so
+    each command starts from a warm, but clean, copy of the interpreter.
+    Commands that aren't known entry points, or that need a shell, are not
+    run, and should be run as a subprocess instead.
+
+    """
+    def __init__(self, workers: int = 4,
+                 module_prefixes: Iterable[str] = ('tortuga.',),
+                 preload: Iterable[str] = (),
+                 entry_points: Dict[str, str] = None,
+                 timeout: float = 600):
+        """
+        Initialization.
+
+        :param int workers:                   the maximum number of commands
+                                              to run at once
+        :param Iterable[str] module_prefixes: console scripts with entry
+                                              points in these modules are
+                                              run in the workers
+        :param Iterable[str] preload:         more modules to preload
+        :param Dict[str, str] entry_points:   more commands to run in the
+                                              workers, as "module:function"
+                                              by command name
+        :param float timeout:                 the maximum number of seconds
+                                              a command may run in a worker
+
+        """
+        self.workers = workers
+        self.entry_points = console_scripts(module_prefixes)
+        self.entry_points.update(entry_points or {})
+        self.preload = list(preload)
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                modules = {value.partition(':')[0]
+                           for value in self.entry_points.values()}
+                #
+                # The forkserver is shared with everything else in the
+                # process, so rather than changing its preload list, the
+                # workers import the modules themselves
+                #
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=_preload,
+                    initargs=(sorted(modules) + self.preload,)
+                )
+
+            return self._executor
+
+    def resolve(self, cmd: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        Gets the entry point for a command, if it can be run in a worker.
+
+        :param str cmd: the command line
+
+        :return Optional[Tuple[str, List[str]]]: the entry point, and the
+                                                 arguments, or None
+
+        """
+        if _SHELL_SYNTAX.search(cmd):
+            return None
+        try:
+            argv = shlex.split(cmd)
+        except ValueError:
+            return None
+        if not argv:
+            return None
+
+        name = os.path.basename(argv[0])
+        entry_point = self.entry_points.get(name)
+        if entry_point is None:
+            return None
+
+        #
+        # A path has to be to the installed script itself, and not, say, a
+        # different build of the same command
+        #
+        if argv[0] != name:
+            script = shutil.which(name)
+            if script is None or \
+                    os.path.realpath(argv[0]) != os.path.realpath(script):
+                return None
+
+        return entry_point, argv
+
+    def run(self, cmd: str) -> Optional[CommandResult]:
+        """
+        Runs a command in a worker.
+
+        :param str cmd: the command line
+
+        :return Optional[CommandResult]: the result, or None if the command
+                                         can't be run in a worker
+
+        :raises Exception: if the command timed out, or the worker failed,
+                           as the command may have partly run, it mustn't
+                           be run again
+
+        """
+        resolved = self.resolve(cmd)
+        if resolved is None:
+            return None
+        entry_point, argv = resolved
+
+        try:
+            result = self._get_executor().submit(
+                _run_entry_point, entry_point, argv, dict(os.environ),
+                os.getcwd(), self.timeout
+            ).result(None if self.timeout is None
+                     else self.timeout + _RESULT_GRACE)
+
+        except BrokenProcessPool:
+            self.shutdown()
+            raise Exception('The CLI worker pool broke running: {}'.format(
+                cmd))
+
+        except TimeoutError:
+            self.shutdown()
+            raise Exception('The CLI worker pool stopped responding '
+                            'running: {}'.format(cmd))
+
+        if result is None:
+            raise Exception(
+                'Timed out after {} seconds running in a CLI worker: '
+                '{}'.format(self.timeout, cmd))
+        returncode, stdout, stderr = result
+
+        return CommandResult(returncode, stdout.decode(errors='replace'),
+                             stderr.decode(errors='replace'))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,131 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from typing import Optional
+
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_WATCH_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_MOVE_SELF
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+_libc = _load_libc()
+
+
+def _inotify_watch(directory: str) -> Optional[int]:
+    """
+    Sets up an inotify watch for entries being created, deleted or moved
+    in a directory.
+
+    :param str directory: the directory to watch
+
+    :return Optional[int]: the inotify file descriptor, or None if inotify
+                           is not available
+
+    """
+    if _libc is None:
+        return None
+
+    fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+
+    if _libc.inotify_add_watch(fd, os.fsencode(directory), _WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def wait_for_file_state(path: str, exists: bool = False,
+                        timeout: float = None,
+                        poll_interval: float = 5) -> float:
+    """
+    Waits for a file to exist, or not exist. Changes are picked up as
+    soon as they happen using inotify, falling back to polling when
+    inotify is not available.
+
+    :param str path:            the path to the file
+    :param bool exists:         whether to wait for the file to exist, or
+                                to be removed
+    :param float timeout:       the maximum number of seconds to wait, or
+                                None to wait forever
+    :param float poll_interval: how often to check the file when inotify
+                                is not available, it is also checked this
+                                often with inotify, in case the directory
+                                is replaced
+
+    :return float: the number of seconds spent waiting
+
+    :raises TimeoutError: if the timeout expired first
+
+    """
+    start = time.monotonic()
+    fd = _inotify_watch(os.path.dirname(os.path.abspath(path)))
+
+    try:
+        while os.path.exists(path) != exists:
+            wait = poll_interval
+            if timeout is not None:
+                remaining = start + timeout - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        'Timed out waiting for {} to {}'.format(
+                            path, 'exist' if exists else 'be removed'))
+                wait = min(wait, remaining)
+
+            if fd is None:
+                time.sleep(wait)
+                continue
+
+            #
+            # The events themselves don't matter, the file is checked again
+            # after anything happens in the directory
+            #
+            if select.select([fd], [], [], wait)[0]:
+                try:
+                    while os.read(fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+    return time.monotonic() - start
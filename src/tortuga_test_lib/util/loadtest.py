@@ -0,0 +1,139 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import itertools
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    """
+    Gets a percentile of a sorted sequence, using the nearest-rank method.
+
+    :param Sequence[float] values: the sorted values
+    :param float pct:              the percentile, between 0 and 100
+
+    :return Optional[float]: the percentile, or None if there are no values
+
+    """
+    if not values:
+        return None
+    #
+    # The rank is the smallest one that covers pct percent of the values,
+    # pct * n is worked out first so it is exact for whole percentiles
+    #
+    rank = max(math.ceil(pct * len(values) / 100) - 1, 0)
+
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, Optional[float]]:
+    latencies = sorted(latencies)
+
+    return {
+        'min': latencies[0] if latencies else None,
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else None
+    }
+
+
+def run_load(func: Callable[..., Any], args: List[tuple],
+             concurrency: int = 10, duration: float = None,
+             iterations: int = None) -> Dict[str, Any]:
+    """
+    Calls a function repeatedly from several threads at once, and measures
+    the throughput and latency.
+
+    Each thread takes the next set of arguments from args, cycling through
+    them, until the duration has passed, or the number of iterations have
+    been made.
+
+    :param Callable func:     the function to call, it succeeds if it
+                              returns a true value, fails if it returns a
+                              false value, and errors if it raises
+    :param List[tuple] args:  the arguments for each call
+    :param int concurrency:   the number of threads
+    :param float duration:    the number of seconds to run for
+    :param int iterations:    the total number of calls to make
+
+    :return Dict[str, Any]: the number of requests, successes and
+                            failures, the errors by message, the
+                            throughput in requests per second, and the
+                            latency percentiles in seconds
+
+    """
+    if duration is None and iterations is None:
+        raise Exception('Either duration or iterations is required')
+
+    lock = threading.Lock()
+    arg_cycle = itertools.cycle(args)
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors: Dict[str, int] = collections.Counter()
+    results = {'successes': 0, 'failures': 0}
+
+    start = time.monotonic()
+    deadline = None if duration is None else start + duration
+
+    def worker():
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            with lock:
+                if iterations is not None and next(counter) >= iterations:
+                    return
+                call_args = next(arg_cycle)
+
+            call_start = time.monotonic()
+            try:
+                ok = func(*call_args)
+                error = None
+            except Exception as ex:
+                ok = False
+                error = '{}: {}'.format(type(ex).__name__, ex)
+            latency = time.monotonic() - call_start
+
+            with lock:
+                latencies.append(latency)
+                if error:
+                    errors[error] += 1
+                elif ok:
+                    results['successes'] += 1
+                else:
+                    results['failures'] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True)
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    return {
+        'requests': len(latencies),
+        'successes': results['successes'],
+        'failures': results['failures'],
+        'errors': dict(errors),
+        'error_count': sum(errors.values()),
+        'duration': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'latency': summarize_latencies(latencies)
+    }
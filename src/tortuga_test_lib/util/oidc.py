@@ -0,0 +1,122 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import requests
+
+
+class OidcProviderCache:
+    """
+    Caches OpenID Connect provider data, and HTTP connections, per issuer.
+
+    The discovery document and JWKS are kept for a limited time. HTTP
+    connections are pooled per (issuer, CA bundle) in a shared adapter.
+    Each login still gets its own session, so cookies from one login are
+    never sent with another, while the TLS connections are reused.
+
+    """
+    def __init__(self, ttl: float = 300, pool_maxsize: int = 10):
+        """
+        Initialization.
+
+        :param float ttl:        the number of seconds to cache discovery
+                                 documents and JWKS
+        :param int pool_maxsize: the maximum number of connections to keep
+                                 open to each host
+
+        """
+        self.ttl = ttl
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._adapters: Dict[Tuple[str, str], object] = {}
+        self._providers: Dict[Tuple[str, str],
+                              Tuple[float, dict, Optional[dict]]] = {}
+
+    def session(self, issuer: str, ca_bundle: str) -> 'requests.Session':
+        """
+        Creates a new session that shares pooled connections with all other
+        sessions for the same issuer and CA bundle.
+
+        :param str issuer:
+        :param str ca_bundle: the CA bundle used to verify certificates
+
+        :return requests.Session: the session
+
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        key = (issuer, ca_bundle)
+        with self._lock:
+            adapter = self._adapters.get(key)
+            if adapter is None:
+                adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize)
+                self._adapters[key] = adapter
+
+        session = requests.Session()
+        session.verify = ca_bundle
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
+
+    def provider(self, issuer: str,
+                 ca_bundle: str) -> Tuple[dict, Optional[dict]]:
+        """
+        Gets the discovery document and JWKS for an issuer, fetching them if
+        they are not cached, or have expired.
+
+        :param str issuer:
+        :param str ca_bundle: the CA bundle used to verify certificates
+
+        :return Tuple[dict, Optional[dict]]: the discovery document, and the
+                                             JWKS, if the provider has one
+
+        """
+        key = (issuer, ca_bundle)
+        with self._lock:
+            entry = self._providers.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1], entry[2]
+
+        session = self.session(issuer, ca_bundle)
+        resp = session.get('{}/.well-known/openid-configuration'.format(
+            issuer.rstrip('/')))
+        if not resp.status_code == 200:
+            raise Exception(
+                'Error getting provider configuration: {}'.format(
+                    resp.status_code))
+        provider_info = resp.json()
+
+        jwks = None
+        if provider_info.get('jwks_uri'):
+            resp = session.get(provider_info['jwks_uri'])
+            if not resp.status_code == 200:
+                raise Exception('Error getting JWKS: {}'.format(
+                    resp.status_code))
+            jwks = resp.json()
+
+        with self._lock:
+            self._providers[key] = (time.monotonic() + self.ttl,
+                                    provider_info, jwks)
+
+        return provider_info, jwks
+
+    def clear(self):
+        with self._lock:
+            self._providers.clear()
@@ -0,0 +1,150 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import os
+import threading
+from typing import Any, Callable, Iterator, Tuple
+
+
+def yaml_loader():
+    """
+    Gets the YAML loader to use. PyYAML is imported on first use, as it is
+    only needed by suites that parse YAML.
+
+    :return: the libyaml based loader if PyYAML was built with it, it is
+             many times faster than the pure-Python one
+
+    """
+    import yaml
+
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def load_json(fp) -> Any:
+    return json.load(fp)
+
+
+def load_yaml(fp) -> Any:
+    import yaml
+
+    return yaml.load(fp, Loader=yaml_loader())
+
+
+def iter_ndjson(path: str) -> Iterator[Any]:
+    """
+    Lazily parses a newline-delimited JSON file, one record per line.
+
+    :param str path: path to the file
+
+    :return Iterator[Any]: the records, blank lines are skipped
+
+    """
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_yaml_documents(path: str) -> Iterator[Any]:
+    """
+    Lazily parses a multi-document YAML file.
+
+    :param str path: path to the file
+
+    :return Iterator[Any]: the documents
+
+    """
+    import yaml
+
+    with open(path) as fp:
+        yield from yaml.load_all(fp, Loader=yaml_loader())
+
+
+class ParsedFileCache:
+    """
+    A thread-safe LRU cache of parsed files.
+
+    Entries are keyed by the path, modification time, size and format of
+    the file, so a file that changes is parsed again. The memory used by
+    the cache is capped using the size of the files as an estimate of the
+    size of the parsed data.
+
+    Cached data is shared between callers, and must not be modified.
+
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024,
+                 max_entries: int = 128):
+        """
+        Initialization.
+
+        :param int max_bytes:   the maximum total size of the cached files
+        :param int max_entries: the maximum number of cached files
+
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'collections.OrderedDict[Tuple, Tuple[Any, int]]' = \
+            collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str, fmt: str, loader: Callable[[Any], Any]) -> Any:
+        """
+        Gets the parsed contents of a file, parsing it if it isn't cached,
+        or has changed.
+
+        :param str path:        path to the file
+        :param str fmt:         the format of the file, part of the cache
+                                key
+        :param Callable loader: parses an open file
+
+        :return Any: the parsed data
+
+        """
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, fmt)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        with open(path) as fp:
+            data = loader(fp)
+
+        if st.st_size > self.max_bytes:
+            return data
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (data, st.st_size)
+                self._bytes += st.st_size
+            while (self._bytes > self.max_bytes or
+                   len(self._entries) > self.max_entries):
+                _, (_, size) = self._entries.popitem(last=False)
+                self._bytes -= size
+
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,296 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Password generation and crypt(3) compatible password hashing, without the
+deprecated crypt module.
+
+MD5-crypt and SHA-512-crypt are implemented in pure Python. yescrypt, the
+default scheme on current Linux distributions, is provided by libxcrypt.
+
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import string
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional
+
+
+ALPHABET = string.ascii_letters + string.digits
+
+_ITOA64 = './0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+_MD5_ORDER = [(0, 6, 12), (1, 7, 13), (2, 8, 14), (3, 9, 15), (4, 10, 5)]
+
+_SHA512_ORDER = [
+    (0, 21, 42), (22, 43, 1), (44, 2, 23), (3, 24, 45), (25, 46, 4),
+    (47, 5, 26), (6, 27, 48), (28, 49, 7), (50, 8, 29), (9, 30, 51),
+    (31, 52, 10), (53, 11, 32), (12, 33, 54), (34, 55, 13), (56, 14, 35),
+    (15, 36, 57), (37, 58, 16), (59, 17, 38), (18, 39, 60), (40, 61, 19),
+    (62, 20, 41)
+]
+
+SHA512_DEFAULT_ROUNDS = 5000
+
+
+def generate_password(length: int = 16, alphabet: str = ALPHABET) -> str:
+    """
+    Generates a random password, using a single read from the OS random
+    number generator rather than one call per character.
+
+    :param int length:     the length of the password
+    :param str alphabet:   the characters to choose from
+
+    :return str: the password
+
+    """
+    #
+    # Bytes above the largest multiple of the alphabet size are rejected,
+    # so that every character is equally likely
+    #
+    limit = 256 - 256 % len(alphabet)
+    password = []
+    while len(password) < length:
+        for b in os.urandom(length * 2):
+            if b < limit:
+                password.append(alphabet[b % len(alphabet)])
+                if len(password) == length:
+                    break
+
+    return ''.join(password)
+
+
+def _gen_salt(length: int) -> str:
+    return generate_password(length, _ITOA64)
+
+
+def _encode(data: bytes, order: list, tail: tuple) -> str:
+    out = []
+    for group in order + [tail]:
+        *indexes, count = group if len(group) == 4 else group + (4,)
+        value = 0
+        for index in indexes:
+            value = (value << 8) | (data[index] if index is not None else 0)
+        for _ in range(count):
+            out.append(_ITOA64[value & 0x3f])
+            value >>= 6
+
+    return ''.join(out)
+
+
+def md5_crypt(password: str, salt: str = None) -> str:
+    """
+    Hashes a password using MD5-crypt ($1$).
+
+    :param str password:
+    :param str salt:     up to 8 salt characters, generated if not set
+
+    :return str: the password hash
+
+    """
+    pw = password.encode()
+    salt = (salt if salt is not None else _gen_salt(8))[:8]
+    s = salt.encode()
+
+    final = hashlib.md5(pw + s + pw).digest()
+    ctx = hashlib.md5(pw + b'$1$' + s)
+    for pl in range(len(pw), 0, -16):
+        ctx.update(final[:min(16, pl)])
+    i = len(pw)
+    while i:
+        ctx.update(b'\0' if i & 1 else pw[:1])
+        i >>= 1
+    final = ctx.digest()
+
+    for i in range(1000):
+        ctx = hashlib.md5(pw if i & 1 else final)
+        if i % 3:
+            ctx.update(s)
+        if i % 7:
+            ctx.update(pw)
+        ctx.update(final if i & 1 else pw)
+        final = ctx.digest()
+
+    return '$1${}${}'.format(salt,
+                             _encode(final, _MD5_ORDER, (None, None, 11, 2)))
+
+
+def sha512_crypt(password: str, salt: str = None,
+                 rounds: int = None) -> str:
+    """
+    Hashes a password using SHA-512-crypt ($6$).
+
+    :param str password:
+    :param str salt:     up to 16 salt characters, generated if not set
+    :param int rounds:   the number of rounds, the default of 5000 is used if
+                         not set
+
+    :return str: the password hash
+
+    """
+    pw = password.encode()
+    salt = (salt if salt is not None else _gen_salt(16))[:16]
+    s = salt.encode()
+    prefix = '$6$'
+    if rounds is None:
+        rounds = SHA512_DEFAULT_ROUNDS
+    else:
+        rounds = max(1000, min(int(rounds), 999999999))
+        prefix += 'rounds={}$'.format(rounds)
+
+    b = hashlib.sha512(pw + s + pw).digest()
+    ctx = hashlib.sha512(pw + s)
+    for _ in range(len(pw) // 64):
+        ctx.update(b)
+    ctx.update(b[:len(pw) % 64])
+    i = len(pw)
+    while i:
+        ctx.update(b if i & 1 else pw)
+        i >>= 1
+    a = ctx.digest()
+
+    dp = hashlib.sha512(pw * len(pw)).digest()
+    p = (dp * (len(pw) // 64 + 1))[:len(pw)]
+    ds = hashlib.sha512(s * (16 + a[0])).digest()
+    s_seq = (ds * (len(s) // 64 + 1))[:len(s)]
+
+    c = a
+    for r in range(rounds):
+        ctx = hashlib.sha512(p if r & 1 else c)
+        if r % 3:
+            ctx.update(s_seq)
+        if r % 7:
+            ctx.update(p)
+        ctx.update(c if r & 1 else p)
+        c = ctx.digest()
+
+    return '{}{}${}'.format(prefix, salt,
+                            _encode(c, _SHA512_ORDER, (None, None, 63, 2)))
+
+
+def _load_libcrypt():
+    try:
+        libcrypt = ctypes.CDLL(ctypes.util.find_library('crypt'))
+        libcrypt.crypt_rn
+        libcrypt.crypt_gensalt_rn
+    except (OSError, TypeError, AttributeError):
+        return None
+
+    libcrypt.crypt_rn.restype = ctypes.c_char_p
+    libcrypt.crypt_gensalt_rn.restype = ctypes.c_char_p
+
+    return libcrypt
+
+
+_libcrypt = None
+_libcrypt_loaded = False
+
+#
+# The size of struct crypt_data in libxcrypt
+#
+_CRYPT_DATA_SIZE = 32768
+
+
+def libxcrypt_crypt(password: str, prefix: str) -> str:
+    """
+    Hashes a password using libxcrypt, for schemes such as yescrypt ($y$)
+    that have no pure-Python implementation here.
+
+    :param str password:
+    :param str prefix:   the hash prefix, i.e. "$y$"
+
+    :return str: the password hash
+
+    """
+    global _libcrypt, _libcrypt_loaded
+    if not _libcrypt_loaded:
+        _libcrypt = _load_libcrypt()
+        _libcrypt_loaded = True
+    if _libcrypt is None:
+        raise Exception('libxcrypt is not available')
+
+    setting = ctypes.create_string_buffer(256)
+    if not _libcrypt.crypt_gensalt_rn(prefix.encode(), 0, None, 0, setting,
+                                      len(setting)):
+        raise Exception('Unsupported hash prefix: {}'.format(prefix))
+
+    data = ctypes.create_string_buffer(_CRYPT_DATA_SIZE)
+    result = _libcrypt.crypt_rn(password.encode(), setting.value, data,
+                                len(data))
+    if not result or result.startswith(b'*'):
+        raise Exception('Error hashing password with prefix: {}'.format(
+            prefix))
+
+    return result.decode()
+
+
+SCHEMES = ['md5', 'sha512', 'yescrypt']
+
+
+def hash_password(password: str, scheme: str = 'sha512') -> str:
+    """
+    Hashes a password, suitable for use in a Linux password file.
+
+    :param str password:
+    :param str scheme:   one of md5, sha512, or yescrypt
+
+    :return str: the password hash
+
+    """
+    if scheme == 'md5':
+        return md5_crypt(password)
+
+    elif scheme == 'sha512':
+        return sha512_crypt(password)
+
+    elif scheme == 'yescrypt':
+        return libxcrypt_crypt(password, '$y$')
+
+    raise Exception('Unsupported password scheme: {}'.format(scheme))
+
+
+def _hash_chunk(passwords: List[str], scheme: str) -> List[str]:
+    return [hash_password(password, scheme) for password in passwords]
+
+
+def hash_passwords(passwords: Iterable[str], scheme: str = 'sha512',
+                   processes: Optional[int] = None,
+                   chunk_size: int = 16) -> List[str]:
+    """
+    Hashes many passwords in parallel, on a process pool.
+
+    :param Iterable[str] passwords:
+    :param str scheme:              one of md5, sha512, or yescrypt
+    :param int processes:           the number of worker processes, defaults
+                                    to the number of CPUs, 1 hashes in the
+                                    current process
+    :param int chunk_size:          the number of passwords sent to a worker
+                                    at a time
+
+    :return List[str]: the password hashes, in the same order
+
+    """
+    passwords = list(passwords)
+    chunks = [passwords[i:i + chunk_size]
+              for i in range(0, len(passwords), chunk_size)]
+
+    if processes == 1 or len(chunks) <= 1:
+        return _hash_chunk(passwords, scheme)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = executor.map(_hash_chunk, chunks, [scheme] * len(chunks))
+
+        return [hash_ for chunk in results for hash_ in chunk]
@@ -0,0 +1,153 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import random
+from typing import Dict, Iterable, Optional, Tuple
+
+
+Target = Tuple[str, int]
+
+
+async def _probe(target: Target, connect_timeout: float,
+                 banner: Optional[bytes]) -> bool:
+    """
+    Makes a single connection attempt to a target.
+
+    :param Target target:         the (host, port) to connect to
+    :param float connect_timeout: how long to wait for the connection, and
+                                  the banner if one is expected
+    :param bytes banner:          if set, the port is only considered open
+                                  once the server sends a line starting with
+                                  these bytes
+
+    :return bool: True if the port is ready, False otherwise
+
+    """
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(*target), connect_timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    try:
+        if banner is None:
+            return True
+        line = await asyncio.wait_for(reader.readline(), connect_timeout)
+        return line.startswith(banner)
+
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def _wait_for_target(target: Target, deadline: float,
+                           semaphore: asyncio.Semaphore,
+                           connect_timeout: float, banner: Optional[bytes],
+                           initial_delay: float,
+                           max_delay: float) -> Optional[float]:
+    """
+    Probes a target until it is ready, or the deadline passes, backing off
+    between attempts.
+
+    :return Optional[float]: the number of seconds it took for the target
+                             to become ready, or None if it never did
+
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    delay = initial_delay
+
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return None
+
+        async with semaphore:
+            ready = await _probe(target, min(connect_timeout, remaining),
+                                 banner)
+        if ready:
+            return loop.time() - start
+
+        #
+        # Back off, with some jitter so that hundreds of hosts don't all
+        # retry in lock-step
+        #
+        sleep = min(delay, deadline - loop.time())
+        if sleep <= 0:
+            return None
+        await asyncio.sleep(sleep * random.uniform(0.8, 1.2))
+        delay = min(delay * 2, max_delay)
+
+
+async def _wait_for_targets(targets: Iterable[Target], timeout: float,
+                            **kwargs) -> Dict[Target, Optional[float]]:
+    targets = list(dict.fromkeys(targets))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    semaphore = asyncio.Semaphore(kwargs.pop('max_concurrency'))
+
+    results = await asyncio.gather(*[
+        _wait_for_target(target, deadline, semaphore, **kwargs)
+        for target in targets
+    ])
+
+    return dict(zip(targets, results))
+
+
+def wait_for_ports(targets: Iterable[Target],
+                   timeout: float = 300,
+                   connect_timeout: float = 5,
+                   banner: Optional[str] = None,
+                   initial_delay: float = 0.25,
+                   max_delay: float = 5,
+                   max_concurrency: int = 256) -> Dict[Target,
+                                                       Optional[float]]:
+    """
+    Waits for many ports to be open at the same time. All of the targets
+    are probed concurrently using non-blocking sockets, and each target is
+    retried with exponential backoff until it is ready, or the timeout
+    expires.
+
+    :param Iterable[Target] targets: the (host, port) pairs to wait for
+    :param float timeout:            the overall time to wait, in seconds
+    :param float connect_timeout:    the timeout for each connection attempt
+    :param str banner:               if set, a target is only considered
+                                     ready once the server sends a line
+                                     starting with this string, i.e. "SSH-"
+    :param float initial_delay:      the delay after the first failed attempt
+    :param float max_delay:          the maximum delay between attempts
+    :param int max_concurrency:      the maximum number of connection
+                                     attempts in flight at once
+
+    :return Dict[Target, Optional[float]]: the number of seconds each target
+                                           took to become ready, or None if
+                                           it did not become ready in time
+
+    """
+    return asyncio.run(_wait_for_targets(
+        targets,
+        timeout,
+        connect_timeout=connect_timeout,
+        banner=banner.encode() if banner else None,
+        initial_delay=initial_delay,
+        max_delay=max_delay,
+        max_concurrency=max_concurrency
+    ))
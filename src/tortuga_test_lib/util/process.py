@@ -0,0 +1,222 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import codecs
+import collections
+import os
+import selectors
+import signal
+import subprocess
+import time
+from typing import Callable, NamedTuple, Optional
+
+
+#
+# Output without newlines is split into lines of at most this many
+# characters, so a single line can't use up unbounded memory
+#
+MAX_LINE_LENGTH = 65536
+
+
+class CommandResult(NamedTuple):
+    returncode: Optional[int]
+    stdout: str
+    stderr: str
+    #
+    # Set to a description of the timeout if the command was killed
+    #
+    timed_out: Optional[str] = None
+
+
+class _StreamReader:
+    """
+    Decodes the output of a stream incrementally, splitting it into lines
+    and keeping only the most recent lines. Lines longer than
+    max_line_length are split.
+
+    """
+    def __init__(self, name: str, max_lines: int,
+                 on_line: Callable[[str, str], None] = None,
+                 spill_fp=None, max_line_length: int = MAX_LINE_LENGTH):
+        self.name = name
+        self.lines = collections.deque(maxlen=max_lines)
+        self._on_line = on_line
+        self._spill_fp = spill_fp
+        self._decoder = codecs.getincrementaldecoder('utf-8')(
+            errors='replace')
+        self._partial = ''
+        self._max_line_length = max_line_length
+
+    def feed(self, data: bytes):
+        text = self._partial + self._decoder.decode(data, final=not data)
+        lines = text.split('\n')
+        self._partial = lines.pop()
+        if not data and self._partial:
+            lines.append(self._partial)
+            self._partial = ''
+
+        #
+        # Emit overlong lines in chunks, rather than buffering them until a
+        # newline turns up
+        #
+        chunked = []
+        for line in lines:
+            while len(line) > self._max_line_length:
+                chunked.append(line[:self._max_line_length])
+                line = line[self._max_line_length:]
+            chunked.append(line)
+        lines = chunked
+        while len(self._partial) >= self._max_line_length:
+            lines.append(self._partial[:self._max_line_length])
+            self._partial = self._partial[self._max_line_length:]
+
+        for line in lines:
+            self.lines.append(line)
+            if self._spill_fp:
+                self._spill_fp.write(line + '\n')
+            if self._on_line:
+                self._on_line(self.name, line)
+
+    def getvalue(self) -> str:
+        output = '\n'.join(self.lines)
+        if output:
+            output += '\n'
+
+        return output
+
+
+def _kill_process_group(proc: subprocess.Popen, grace_period: float = 5):
+    """
+    Kills a process, and everything it started, first with SIGTERM, then
+    with SIGKILL if it is still around after the grace period.
+
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            proc.wait(grace_period)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def stream_command(cmd: str,
+                   on_line: Callable[[str, str], None] = None,
+                   timeout: float = None,
+                   idle_timeout: float = None,
+                   max_lines: int = 10000,
+                   output_path: str = None) -> CommandResult:
+    """
+    Runs a shell command, reading its output incrementally rather than
+    buffering all of it in memory.
+
+    :param str cmd:            the command (and arguments)
+    :param Callable on_line:   called with the stream name ("stdout" or
+                               "stderr") and the line, for each line of
+                               output as it arrives
+    :param float timeout:      the maximum number of seconds the command may
+                               run for
+    :param float idle_timeout: the maximum number of seconds the command may
+                               run without producing any output
+    :param int max_lines:      the maximum number of lines of each stream to
+                               keep for the result, older lines are dropped
+    :param str output_path:    if set, the full stdout is written to this
+                               file
+
+    :return CommandResult: the result, the process group is killed if
+                           either of the timeouts expire
+
+    """
+    proc = subprocess.Popen(
+        [cmd],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        shell=True,
+        start_new_session=True
+    )
+
+    spill_fp = open(output_path, 'w') if output_path else None
+    readers = {
+        proc.stdout: _StreamReader('stdout', max_lines, on_line, spill_fp),
+        proc.stderr: _StreamReader('stderr', max_lines, on_line)
+    }
+    timed_out = None
+
+    start = last_output = time.monotonic()
+
+    def remaining(now: float):
+        """
+        :return: the number of seconds until the first of the timeouts
+                 expires, or None if there are none, and the reason it
+                 would expire
+
+        """
+        wait = None
+        reason = None
+        if timeout is not None:
+            wait = start + timeout - now
+            reason = 'timed out after {}s'.format(timeout)
+        if idle_timeout is not None:
+            idle_wait = last_output + idle_timeout - now
+            if wait is None or idle_wait < wait:
+                wait = idle_wait
+                reason = 'no output for {}s'.format(idle_timeout)
+
+        return wait, reason
+
+    try:
+        with selectors.DefaultSelector() as selector:
+            for pipe in readers:
+                selector.register(pipe, selectors.EVENT_READ)
+
+            while selector.get_map():
+                wait, reason = remaining(time.monotonic())
+                if wait is not None and wait <= 0:
+                    timed_out = reason
+                    _kill_process_group(proc)
+                    break
+
+                for key, _ in selector.select(wait):
+                    data = os.read(key.fd, 65536)
+                    readers[key.fileobj].feed(data)
+                    if data:
+                        last_output = time.monotonic()
+                    else:
+                        selector.unregister(key.fileobj)
+
+        #
+        # The command may close its output, and keep running, so the
+        # timeouts still apply while waiting for it to exit
+        #
+        if timed_out is None:
+            wait, reason = remaining(time.monotonic())
+            try:
+                proc.wait(None if wait is None else max(wait, 0))
+            except subprocess.TimeoutExpired:
+                timed_out = reason
+                _kill_process_group(proc)
+        returncode = proc.wait()
+
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+        if spill_fp:
+            spill_fp.close()
+
+    stdout, stderr = [reader.getvalue() for reader in readers.values()]
+
+    return CommandResult(returncode, stdout, stderr, timed_out)
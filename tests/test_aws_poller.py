@@ -0,0 +1,38 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from tortuga_test_lib.cloud_provider.aws_poller import AwsInstancePoller
+
+
+class BrokenClient:
+    """
+    An EC2 client that can't reach the API.
+
+    """
+    def get_paginator(self, name):
+        raise ConnectionError('Could not connect to the endpoint URL')
+
+
+def test_wait_times_out_while_polls_fail():
+    poller = AwsInstancePoller(lambda region: BrokenClient(),
+                               min_interval=0.05, max_interval=0.1)
+    future = poller.wait_for('us-east-1', 'i-1', ['running'], timeout=0.5)
+
+    with pytest.raises(Exception, match='Timed out waiting for instance '
+                                        'i-1 to be running: Could not'):
+        future.result(timeout=5)
+
+    assert poller.stats()['pending'] == 0
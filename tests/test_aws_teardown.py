@@ -0,0 +1,90 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+botocore_exceptions = pytest.importorskip('botocore.exceptions')
+
+from tortuga_test_lib.cloud_provider.aws_teardown import AwsTeardownQueue
+from tortuga_test_lib.testing.ec2 import FakeEc2, FakeEc2Client
+
+
+REGION = 'us-east-1'
+
+
+class FlakyClient(FakeEc2Client):
+    """
+    Fails the first TerminateInstances calls with a connection error.
+
+    """
+    def __init__(self, ec2: FakeEc2, region: str, failures: int):
+        super().__init__(ec2, region)
+        self.failures = failures
+
+    def terminate_instances(self, InstanceIds, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise botocore_exceptions.EndpointConnectionError(
+                endpoint_url='https://ec2.{}.amazonaws.com'.format(REGION))
+
+        return super().terminate_instances(InstanceIds=InstanceIds,
+                                           **kwargs)
+
+
+def _launch(ec2: FakeEc2, count: int = 1):
+    return [instance['InstanceId']
+            for instance in ec2.run_instances(REGION, count)]
+
+
+def test_terminate_retried_after_connection_error():
+    ec2 = FakeEc2()
+    client = FlakyClient(ec2, REGION, failures=1)
+    terminated = []
+    queue = AwsTeardownQueue(
+        lambda region: client, batch_delay=0.01, poll_interval=0.05,
+        on_terminated=lambda region, instance: terminated.append(
+            instance['InstanceId']))
+
+    instance_ids = _launch(ec2, 2)
+    for instance_id in instance_ids:
+        queue.put(REGION, instance_id)
+
+    assert queue.flush(timeout=10)
+    assert client.failures == 0
+    assert sorted(terminated) == sorted(instance_ids)
+    for instance_id in instance_ids:
+        assert ec2.describe(REGION, instance_id)['State']['Name'] == \
+            'terminated'
+
+
+def test_flush_times_out_while_terminate_keeps_failing():
+    ec2 = FakeEc2()
+    client = FlakyClient(ec2, REGION, failures=1000)
+    queue = AwsTeardownQueue(lambda region: client, batch_delay=0.01,
+                             poll_interval=0.01, max_retry_delay=0.05)
+
+    instance_id = _launch(ec2)[0]
+    queue.put(REGION, instance_id)
+
+    #
+    # The instance is never dropped from the queue, so the flush can't
+    # report success
+    #
+    assert not queue.flush(timeout=0.5)
+    assert ec2.describe(REGION, instance_id)['State']['Name'] == 'running'
+
+    client.failures = 0
+    assert queue.flush(timeout=10)
+    assert ec2.describe(REGION, instance_id)['State']['Name'] == \
+        'terminated'
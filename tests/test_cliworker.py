@@ -0,0 +1,72 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import time
+
+import pytest
+
+from tortuga_test_lib.util.cliworker import CliWorkerPool
+
+
+def _hello():
+    print('hello {}'.format(' '.join(sys.argv[1:])))
+
+
+def _hang():
+    time.sleep(60)
+
+
+@pytest.fixture
+def pool():
+    pool = CliWorkerPool(workers=1, module_prefixes=(), timeout=1,
+                         entry_points={'hello': 'test_cliworker:_hello',
+                                       'hang': 'test_cliworker:_hang'})
+    yield pool
+    pool.shutdown()
+
+
+def test_resolve_accepts_only_the_installed_script(pool, tmp_path,
+                                                   monkeypatch):
+    script = tmp_path / 'bin' / 'hello'
+    script.parent.mkdir()
+    script.write_text('#!/bin/sh\n')
+    script.chmod(0o755)
+    other = tmp_path / 'hello'
+    other.write_text('#!/bin/sh\n')
+    other.chmod(0o755)
+    monkeypatch.setenv('PATH', str(script.parent))
+
+    assert pool.resolve('hello world') == (
+        'test_cliworker:_hello', ['hello', 'world'])
+    assert pool.resolve('{} world'.format(script))
+    assert pool.resolve('{} world'.format(other)) is None
+    assert pool.resolve('hello world | cat') is None
+    assert pool.resolve('other world') is None
+
+
+def test_run(pool):
+    result = pool.run('hello world')
+
+    assert result.returncode == 0
+    assert result.stdout == 'hello world\n'
+
+
+def test_run_times_out(pool):
+    started = time.monotonic()
+    with pytest.raises(Exception, match='Timed out after 1 seconds'):
+        pool.run('hang')
+    assert time.monotonic() - started < 10
+
+    assert pool.run('hello again').stdout == 'hello again\n'
@@ -0,0 +1,163 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+pytest.importorskip('botocore')
+
+from tortuga_test_lib.robot.CloudProvider import CloudProvider
+from tortuga_test_lib.testing.ec2 import FakeAwsLauncher, FakeEc2
+
+
+REGION = 'us-east-1'
+LAUNCH_ARGS = ('sg-1', 'subnet-1', 'ami-1', 't2.micro', 'profile')
+
+
+@pytest.fixture
+def ec2():
+    #
+    # Without a public hostname, launches don't wait for SSH
+    #
+    return FakeEc2(hostname='')
+
+
+@pytest.fixture
+def library(monkeypatch, ec2):
+    monkeypatch.setattr(CloudProvider, '_launchers',
+                        {'fake': FakeAwsLauncher(ec2)})
+    monkeypatch.setattr(CloudProvider, 'providers',
+                        dict(CloudProvider.providers))
+    monkeypatch.delenv('TORTUGA_TEST_FAKE_PROVIDERS', raising=False)
+
+    return CloudProvider()
+
+
+def test_fake_provider_needs_opt_in(library, monkeypatch):
+    with pytest.raises(Exception, match='Unsupported provider: fake-aws'):
+        library._get_launcher('fake-aws')
+
+    monkeypatch.setenv('TORTUGA_TEST_FAKE_PROVIDERS', '1')
+    assert isinstance(library._get_launcher('fake-aws'), FakeAwsLauncher)
+
+
+def _states(ec2):
+    return sorted(ec2.describe(REGION, instance_id)['State']['Name']
+                  for instance_id in ec2.instances)
+
+
+def test_launch_vms_without_hostname(library, ec2):
+    results = library.launch_vms('fake', 3, REGION, *LAUNCH_ARGS)
+
+    assert len(results) == 3
+    assert _states(ec2) == ['running'] * 3
+
+
+def test_cancel_vm_launch(library, ec2):
+    handle = library.start_vm_launch('fake', REGION, *LAUNCH_ARGS)
+    library.cancel_vm_launch(handle)
+    library._scheduler.shutdown()
+
+    with pytest.raises(Exception, match='Unknown VM launch handle'):
+        library.wait_for_vm(handle)
+
+    assert library.flush_teardown('fake', timeout=10)
+    assert _states(ec2) in [[], ['terminated']]
+
+
+def test_close_deletes_unclaimed_launches(library, ec2):
+    claimed = library.start_vm_launch('fake', REGION, *LAUNCH_ARGS)
+    library.start_vm_launch('fake', REGION, *LAUNCH_ARGS)
+    instance_id = library.wait_for_vm(claimed, timeout=10)[0]
+
+    library._close()
+    assert library.flush_teardown('fake', timeout=10)
+
+    assert ec2.describe(REGION, instance_id)['State']['Name'] == 'running'
+    assert _states(ec2) == ['running', 'terminated']
+
+
+def test_queued_delete_keeps_batch_key_pair(ec2):
+    launcher = FakeAwsLauncher(ec2)
+    results = launcher.launch_vms(2, REGION, *LAUNCH_ARGS)
+    key_pairs = list(ec2.key_pairs[REGION])
+    private_key = results[0][3]
+
+    launcher.queue_delete_vm(REGION, results[0][0])
+    assert launcher.flush_teardown(timeout=10)
+    assert list(ec2.key_pairs[REGION]) == key_pairs
+    assert os.path.exists(private_key)
+
+    launcher.queue_delete_vm(REGION, results[1][0])
+    assert launcher.flush_teardown(timeout=10)
+    assert ec2.key_pairs[REGION] == {}
+    assert not os.path.exists(private_key)
+
+
+def test_launch_vms_in_regions_keeps_failed_slots(library, ec2):
+    launch = dict(zip(('security_group_id', 'subnet_id', 'image_id',
+                       'instance_type', 'instance_profile'), LAUNCH_ARGS),
+                  region=REGION)
+    broken = dict(launch)
+    del broken['image_id']
+
+    results = library.launch_vms_in_regions(
+        'fake', [dict(launch, count=2), broken, launch], timeout=10)
+
+    assert [result is None for result in results] == \
+        [False, False, True, False]
+    assert _states(ec2) == ['running'] * 3
+
+
+class FailingEc2(FakeEc2):
+    """
+    Terminates the first instance of every launch before it starts.
+
+    """
+    def run_instances(self, region, count, **kwargs):
+        instances = super().run_instances(region, count, **kwargs)
+        self.terminate(region, instances[0]['InstanceId'])
+
+        return instances
+
+
+def test_partial_batch_failure_releases_key_pair():
+    ec2 = FailingEc2(hostname='')
+    launcher = FakeAwsLauncher(ec2)
+    results = launcher.launch_vms(3, REGION, *LAUNCH_ARGS)
+    assert len(results) == 2
+    private_key = results[0][3]
+
+    for result in results:
+        launcher.queue_delete_vm(REGION, result[0])
+    assert launcher.flush_teardown(timeout=10)
+
+    assert launcher.journal.active() == []
+    assert ec2.key_pairs[REGION] == {}
+    assert not os.path.exists(private_key)
+
+
+def test_launch_vms_queues_deletes_without_ssh(library, ec2, monkeypatch):
+    ec2.hostname = 'host.example.com'
+    launcher = library._get_launcher('fake')
+    monkeypatch.setattr(library, 'wait_for_ports',
+                        lambda hosts, *args, **kwargs: dict.fromkeys(hosts))
+    monkeypatch.setattr(launcher, 'delete_vm', None)
+
+    with pytest.raises(Exception, match='None of the 2 instances'):
+        library.launch_vms('fake', 2, REGION, *LAUNCH_ARGS)
+
+    assert library.flush_teardown('fake', timeout=10)
+    assert _states(ec2) in [[], ['terminated'] * 2]
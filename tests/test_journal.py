@@ -0,0 +1,96 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+import time
+
+import pytest
+
+from tortuga_test_lib.cloud_provider.journal import InstanceJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return InstanceJournal(str(tmp_path / 'instances.jsonl'),
+                           stale_after=60)
+
+
+def _entry(journal, instance_id='i-1'):
+    journal.record([instance_id], region='us-east-1', state='pending')
+
+    return journal.get(instance_id)
+
+
+def test_owner_alive(journal):
+    assert journal.is_owner_alive(_entry(journal))
+
+
+def test_owner_exited(journal):
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+
+    entry = _entry(journal)
+    entry['pid'] = proc.pid
+    entry['pid_start'] = None
+
+    assert not journal.is_owner_alive(entry)
+
+
+def test_owner_pid_reused(journal):
+    entry = _entry(journal)
+    entry['pid_start'] -= 1
+
+    assert not journal.is_owner_alive(entry)
+
+
+def test_owner_host_rebooted(journal):
+    entry = _entry(journal)
+    if not entry.get('boot_id'):
+        pytest.skip('The boot id is not available')
+    entry['boot_id'] = 'another-boot'
+
+    assert not journal.is_owner_alive(entry)
+
+
+def test_other_host_becomes_stale(journal):
+    entry = _entry(journal)
+    entry['host'] = 'another-container'
+    assert journal.is_owner_alive(entry)
+
+    entry['time'] = time.time() - 120
+    assert not journal.is_owner_alive(entry)
+    assert journal.is_owner_alive(entry, stale_after=3600)
+
+
+def test_shared_between_journals(journal):
+    other = InstanceJournal(journal.path)
+    other.record(['i-1', 'i-2'], region='us-east-1', state='pending')
+    other.record(['i-1'], state='terminated')
+
+    assert [entry['instance_id'] for entry in journal.active()] == ['i-2']
+    assert journal.get('i-1')['state'] == 'terminated'
+
+    #
+    # Compacting drops the terminated instances, without losing the ones
+    # that are recorded afterwards
+    #
+    journal.compact()
+    other.record(['i-3'], region='us-east-1', state='pending')
+
+    assert sorted(entry['instance_id'] for entry in other.active()) == \
+        ['i-2', 'i-3']
+    assert journal.get('i-1') is None
+    with open(journal.path) as fp:
+        assert len(fp.readlines()) == 2
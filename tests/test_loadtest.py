@@ -0,0 +1,47 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from tortuga_test_lib.util.loadtest import percentile, run_load
+
+
+@pytest.mark.parametrize('values, pct, expected', [
+    ([1, 2, 3, 4, 5, 6], 50, 3),
+    (list(range(1, 11)), 50, 5),
+    (list(range(1, 11)), 95, 10),
+    (list(range(1, 101)), 7, 7),
+    (list(range(1, 101)), 99, 99),
+    ([1, 2, 3], 0, 1),
+    ([1, 2, 3], 100, 3),
+    ([5], 50, 5),
+    ([], 50, None),
+])
+def test_percentile(values, pct, expected):
+    assert percentile(values, pct) == expected
+
+
+def test_run_load_counts_failures_and_errors():
+    def call(value):
+        if value == 'error':
+            raise Exception('broken')
+        return value == 'ok'
+
+    result = run_load(call, [('ok',), ('fail',), ('error',)],
+                      concurrency=1, iterations=6)
+
+    assert result['requests'] == 6
+    assert result['successes'] == 2
+    assert result['failures'] == 2
+    assert result['errors'] == {'Exception: broken': 2}
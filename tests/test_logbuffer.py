@@ -0,0 +1,92 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tortuga_test_lib import logbuffer
+from tortuga_test_lib.logbuffer import LogBuffer
+
+
+def test_cap_drops_oldest_messages():
+    buffer = LogBuffer(max_records=3)
+    with logbuffer.collect() as records:
+        with buffer.keyword():
+            for i in range(5):
+                buffer.append('info', 'message {}'.format(i), timestamp=i)
+
+    assert records == [
+        (2, 'INFO', 'Dropped 2 earlier log message(s), the buffer holds 3'),
+        (2, 'INFO', 'message 2'),
+        (3, 'INFO', 'message 3'),
+        (4, 'INFO', 'message 4'),
+    ]
+
+
+def test_nested_keywords_flush_once_in_order():
+    buffer = LogBuffer()
+    with logbuffer.collect() as records:
+        with buffer.keyword():
+            buffer.append('info', 'outer', timestamp=1)
+            with buffer.keyword():
+                buffer.append('warning', 'inner', timestamp=2)
+            assert records == []
+            buffer.append('debug', 'outer again', timestamp=3)
+
+    assert records == [(1, 'INFO', 'outer'), (2, 'WARN', 'inner'),
+                       (3, 'DEBUG', 'outer again')]
+
+
+def test_messages_outside_keywords_are_written_straight_away(capsys):
+    buffer = LogBuffer()
+    buffer.append('info', 'hello', timestamp=1.5)
+
+    assert capsys.readouterr().out == '*INFO:1500* hello\n'
+
+
+def test_flush_interval():
+    buffer = LogBuffer(flush_interval=0)
+    with logbuffer.collect() as records:
+        with buffer.keyword():
+            buffer.append('info', 'first', timestamp=1)
+            assert records == [(1, 'INFO', 'first')]
+
+
+def test_cap_applies_to_the_whole_keyword():
+    buffer = LogBuffer(max_records=4, flush_interval=0)
+    with logbuffer.collect() as records:
+        with buffer.keyword():
+            for i in range(10):
+                buffer.append('info', 'message {}'.format(i), timestamp=i)
+            assert len(records) == 2
+
+    assert records == [
+        (0, 'INFO', 'message 0'),
+        (1, 'INFO', 'message 1'),
+        (8, 'INFO', 'Dropped 6 earlier log message(s), the buffer holds 4'),
+        (8, 'INFO', 'message 8'),
+        (9, 'INFO', 'message 9'),
+    ]
+
+
+def test_format_records():
+    assert logbuffer.format_records([(1, 'INFO', 'a'),
+                                     (2.25, 'WARN', 'b\nc')]) == \
+        '*INFO:1000* a\n*WARN:2250* b\nc\n'
+
+
+def test_encode_round_trip():
+    records = [(1.5, 'INFO', 'café \x1b[0m'), (2, 'ERROR', 'b')]
+    for compress in (False, True):
+        data = logbuffer.encode_records(records, compress=compress)
+        data.encode('ascii')
+        assert logbuffer.decode_records(data) == records
+        assert logbuffer.decode_records(data.encode()) == records
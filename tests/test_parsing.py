@@ -0,0 +1,84 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import pytest
+
+from tortuga_test_lib.robot.Tortuga import Tortuga
+from tortuga_test_lib.util.parsing import ParsedFileCache, load_json
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'a': 1}))
+
+    return str(path)
+
+
+def test_cache_hits_until_the_file_changes(path):
+    cache = ParsedFileCache()
+    first = cache.get(path, 'json', load_json)
+    assert cache.get(path, 'json', load_json) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    #
+    # A change in size
+    #
+    with open(path, 'w') as fp:
+        json.dump({'a': 22}, fp)
+    assert cache.get(path, 'json', load_json) == {'a': 22}
+
+    #
+    # A change in modification time only
+    #
+    with open(path, 'w') as fp:
+        json.dump({'a': 33}, fp)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.get(path, 'json', load_json) == {'a': 33}
+
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ParsedFileCache(max_entries=2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / '{}.json'.format(i)
+        path.write_text(str(i))
+        paths.append(str(path))
+
+    for path in paths[:2] + paths[:1] + paths[2:]:
+        cache.get(path, 'json', load_json)
+    cache.get(paths[0], 'json', load_json)
+    cache.get(paths[1], 'json', load_json)
+
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_parse_file_does_not_cache_by_default(path, monkeypatch):
+    monkeypatch.setattr(Tortuga, 'parse_cache', ParsedFileCache())
+    tortuga = Tortuga()
+
+    first = tortuga.parse_file(path)
+    first['a'] = 2
+    assert tortuga.parse_file(path) == {'a': 1}
+    assert Tortuga.parse_cache.misses == 0
+
+    assert tortuga.parse_file(path, cache=True) is \
+        tortuga.parse_file(path, cache=True)
+    assert Tortuga.parse_cache.misses == 1
@@ -0,0 +1,117 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ctypes
+
+import pytest
+
+from tortuga_test_lib.util import passwords
+from tortuga_test_lib.util.passwords import (
+    generate_password, hash_password, hash_passwords, md5_crypt,
+    sha512_crypt
+)
+
+
+#
+# The test vectors from Ulrich Drepper's SHA-crypt specification, as the
+# password, salt, rounds, and the expected hash
+#
+SHA512_VECTORS = [
+    ('Hello world!', 'saltstring', None,
+     '$6$saltstring$svn8UoSVapNtMuq1ukKS4tPQd8iKwSMHWjl/O817G3uBnIFNjnQJu'
+     'esI68u4OTLiBFdcbYEdFCoEOfaS35inz1'),
+    ('Hello world!', 'saltstringsaltstring', 10000,
+     '$6$rounds=10000$saltstringsaltst$OW1/O6BYHV6BcXZu8QVeXbDWra3Oeqh0sb'
+     'HbbMCVNSnCM/UrjmM0Dp8vOuZeHBy/YTBmSK6H9qs/y3RnOaw5v.'),
+    ('This is just a test', 'toolongsaltstring', 5000,
+     '$6$rounds=5000$toolongsaltstrin$lQ8jolhgVRVhY4b5pZKaysCLi0QBxGoNeKQ'
+     'zQ3glMhwllF7oGDZxUhx1yxdYcz/e1JSbq3y6JMxxl8audkUEm0'),
+    ('a very much longer text to encrypt.  This one even stretches over '
+     'morethan one line.', 'anotherlongsaltstring', 1400,
+     '$6$rounds=1400$anotherlongsalts$POfYwTEok97VWcjxIiSOjiykti.o/pQs.wP'
+     'vMxQ6Fm7I6IoYN3CmLs66x9t0oSwbtEW7o7UmJEiDwGqd8p4ur1'),
+    ('we have a short salt string but not a short password', 'short',
+     77777,
+     '$6$rounds=77777$short$WuQyW2YR.hBNpjjRhpYD/ifIw05xdfeEyQoMxIXbkvr0g'
+     'ge1a1x3yRULJ5CCaUeOxFmtlcGZelFl5CxtgfiAc0'),
+    ('a short string', 'asaltof16chars..', 123456,
+     '$6$rounds=123456$asaltof16chars..$BtCwjqMJGx5hrJhZywWvt0RLE8uZ4oPwc'
+     'elCjmw2kSYu.Ec6ycULevoBK25fs2xXgMNrCzIMVcgEJAstJeonj1'),
+    ('the minimum number is still observed', 'roundstoolow', 10,
+     '$6$rounds=1000$roundstoolow$kUMsbe306n21p9R.FRkW3IGn.S9NPN0x50YhH1x'
+     'hLsPuWGsUSklZt58jaTfF4ZEQpyUNGc0dqbpBYYBaHHrsX.'),
+    ('', 'saltstring', None,
+     '$6$saltstring$kyGrqt6gmjAdtFLPrflEFifSYLCWWq1pyx95SvqinLDy2UHmj0sTF'
+     '0MSLMwxPFZc3tu5kQckI8fks0zOPda3n1'),
+]
+
+#
+# MD5-crypt reference hashes, as produced by glibc, as the password, salt,
+# and the expected hash
+#
+MD5_VECTORS = [
+    ('', '', '$1$$qRPK7m23GJusamGpoGLby/'),
+    ('password', '', '$1$$I2o9Z7NcvQAKp7wyCTlia0'),
+    ('', 'abcdefgh', '$1$abcdefgh$M55TzYaaccxVGbptZWaxX/'),
+    ('password', 'abcdefgh', '$1$abcdefgh$G//4keteveJp0qb8z2DxG/'),
+    ('Hello world!', 'saltstring', '$1$saltstri$YMyguxXMBpd2TEZ.vS/3q1'),
+]
+
+
+@pytest.mark.parametrize('password,salt,rounds,expected', SHA512_VECTORS)
+def test_sha512_crypt(password, salt, rounds, expected):
+    assert sha512_crypt(password, salt, rounds) == expected
+
+
+@pytest.mark.parametrize('password,salt,expected', MD5_VECTORS)
+def test_md5_crypt(password, salt, expected):
+    assert md5_crypt(password, salt) == expected
+
+
+def test_generated_salts():
+    assert md5_crypt('password').startswith('$1$')
+    assert len(sha512_crypt('password').split('$')[2]) == 16
+
+
+def test_generate_password():
+    password = generate_password(32, 'ab')
+
+    assert len(password) == 32
+    assert set(password) <= {'a', 'b'}
+
+
+def test_hash_passwords_keeps_order():
+    hashes = hash_passwords(['a', 'b', 'c'], scheme='md5', processes=2,
+                            chunk_size=1)
+
+    assert [md5_crypt(password, hash_.split('$')[2])
+            for password, hash_ in zip('abc', hashes)] == hashes
+
+
+def test_yescrypt():
+    libcrypt = passwords._load_libcrypt()
+    if libcrypt is None:
+        pytest.skip('libxcrypt is not available')
+
+    hash_ = hash_password('password', 'yescrypt')
+    assert hash_.startswith('$y$')
+
+    data = ctypes.create_string_buffer(passwords._CRYPT_DATA_SIZE)
+    assert libcrypt.crypt_rn(b'password', hash_.encode(), data,
+                             len(data)) == hash_.encode()
+
+
+def test_unsupported_scheme():
+    with pytest.raises(Exception, match='Unsupported password scheme'):
+        hash_password('password', 'des')
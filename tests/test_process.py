@@ -0,0 +1,44 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from tortuga_test_lib.util.process import _StreamReader, stream_command
+
+
+def test_timeout_applies_after_output_is_closed():
+    start = time.monotonic()
+    result = stream_command('exec >/dev/null 2>&1; sleep 30', timeout=0.5)
+
+    assert result.timed_out == 'timed out after 0.5s'
+    assert result.returncode != 0
+    assert time.monotonic() - start < 10
+
+
+def test_result():
+    result = stream_command('echo a; echo b >&2; exit 3', timeout=10)
+
+    assert result == (3, 'a\n', 'b\n', None)
+
+
+def test_long_lines_are_split():
+    lines = []
+    reader = _StreamReader('stdout', 100,
+                           lambda name, line: lines.append(line),
+                           max_line_length=4)
+    reader.feed(b'abcdefghij')
+    reader.feed(b'kl\nmn')
+    reader.feed(b'')
+
+    assert lines == ['abcd', 'efgh', 'ijkl', 'mn']
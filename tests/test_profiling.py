@@ -0,0 +1,69 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import tracemalloc
+
+from tortuga_test_lib.profiling import KeywordProfiler
+
+
+def test_overlapping_memory_profiles(tmp_path):
+    profiler = KeywordProfiler('*', str(tmp_path), mode='cprofile',
+                               memory=True)
+    first_started = threading.Event()
+    second_started = threading.Event()
+    first_done = threading.Event()
+    errors = []
+
+    def first():
+        try:
+            with profiler.profile('first'):
+                first_started.set()
+                second_started.wait()
+        except Exception as ex:
+            errors.append(ex)
+        first_done.set()
+
+    def second():
+        try:
+            with profiler.profile('second'):
+                second_started.set()
+                data = [bytearray(1024) for _ in range(100)]
+                first_done.wait()
+            assert len(data) == 100
+        except Exception as ex:
+            errors.append(ex)
+
+    #
+    # The first keyword starts tracing, and finishes while the second one
+    # is still being profiled
+    #
+    threads = [threading.Thread(target=first),
+               threading.Thread(target=second)]
+    threads[0].start()
+    first_started.wait()
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(list(tmp_path.glob('*.tracemalloc.txt'))) == 2
+
+    #
+    # The second keyword's allocations were still traced after the first
+    # one finished
+    #
+    report = next(tmp_path.glob('second-*.tracemalloc.txt')).read_text()
+    assert 'test_profiling.py' in report
+    assert not tracemalloc.is_tracing()
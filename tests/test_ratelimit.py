@@ -0,0 +1,47 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tortuga_test_lib.cloud_provider.ratelimit import AdaptiveTokenBucket
+
+
+def test_throttling_cuts_the_rate_once_per_burst():
+    bucket = AdaptiveTokenBucket(rate=8, min_rate=3)
+
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 4
+    assert bucket.stats()['throttled'] == 2
+
+    bucket._last_throttle -= 1
+    bucket.throttled()
+    assert bucket.rate == 3
+
+
+def test_success_grows_the_rate_up_to_the_maximum():
+    bucket = AdaptiveTokenBucket(rate=2, max_rate=3)
+
+    bucket.succeeded()
+    assert bucket.rate == 2.5
+
+    for _ in range(10):
+        bucket.succeeded()
+    assert bucket.rate == 3
+
+
+def test_acquire_waits_once_the_burst_is_used():
+    bucket = AdaptiveTokenBucket(rate=100, burst=2)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert 0 < bucket.acquire() <= 0.01
@@ -0,0 +1,107 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import sys
+import threading
+import xmlrpc.client
+
+import pytest
+
+robotremoteserver = pytest.importorskip('robotremoteserver')
+
+from tortuga_test_lib.remote.server import TortugaRemoteServer
+
+
+class Library:
+    def __init__(self):
+        self.started = threading.Barrier(2, timeout=10)
+
+    def echo(self, msg):
+        print('{} start'.format(msg))
+        #
+        # Both keywords are running, and writing, at the same time
+        #
+        self.started.wait()
+        print('{} end'.format(msg))
+        return msg
+
+    def double(self, value):
+        return value * 2
+
+    def fail(self, msg):
+        raise Exception(msg)
+
+
+@contextlib.contextmanager
+def serve(monkeypatch):
+    """
+    Serves the library on a thread. This is used from the tests, rather
+    than a fixture, as pytest resets sys.stdout between fixture setup and
+    the test, which would remove the server's thread-local streams.
+
+    """
+    monkeypatch.setattr(sys, 'stdout', sys.stdout)
+    monkeypatch.setattr(sys, 'stderr', sys.stderr)
+    monkeypatch.setattr(robotremoteserver, 'StandardStreamInterceptor',
+                        robotremoteserver.StandardStreamInterceptor)
+
+    server = TortugaRemoteServer(Library(), port=0, workers=2, serve=False)
+    port = server.activate()
+    thread = threading.Thread(target=server.serve, kwargs={'log': False})
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(port)
+    finally:
+        server.stop()
+        thread.join(10)
+
+
+def test_concurrent_keywords_capture_their_own_output(monkeypatch):
+    results = {}
+
+    def run(msg):
+        proxy = xmlrpc.client.ServerProxy(server)
+        results[msg] = proxy.run_keyword('echo', [msg])
+
+    with serve(monkeypatch) as server:
+        threads = [threading.Thread(target=run, args=(msg,))
+                   for msg in ['one', 'two']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for msg in ['one', 'two']:
+        assert results[msg]['status'] == 'PASS'
+        assert results[msg]['return'] == msg
+        assert results[msg]['output'] == '{0} start\n{0} end\n'.format(msg)
+
+
+def test_run_keyword_batch(monkeypatch):
+    calls = [['double', 1], {'name': 'fail', 'args': ['second']},
+             {'name': 'double', 'kwargs': {'value': 3}}]
+
+    with serve(monkeypatch) as server:
+        proxy = xmlrpc.client.ServerProxy(server)
+        results = proxy.run_keyword_batch(calls)
+        stopped = proxy.run_keyword_batch(calls, True)
+
+    assert [result['status'] for result in results] == \
+        ['PASS', 'FAIL', 'PASS']
+    assert [result['return'] for result in results[::2]] == [2, 6]
+    assert results[1]['error'] == 'second'
+    assert all(result['elapsed'] >= 0 for result in results)
+
+    assert [result['status'] for result in stopped] == ['PASS', 'FAIL']
@@ -0,0 +1,76 @@
+# Copyright 2008-2018 Univa Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from tortuga_test_lib.cloud_provider.scheduler import LaunchScheduler
+
+
+def _blocker(started: threading.Event, release: threading.Event):
+    started.set()
+    return release.wait(10)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = LaunchScheduler(workers_per_region=1)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_stats(scheduler):
+    started = threading.Event()
+    release = threading.Event()
+    running = scheduler.submit('us-east-1', _blocker, started, release)
+    queued = scheduler.submit('us-east-1', lambda: 1 / 0)
+    assert started.wait(10)
+
+    stats = scheduler.stats()['us-east-1']
+    assert (stats['queued'], stats['running']) == (1, 1)
+
+    release.set()
+    assert running.result(timeout=10)
+    with pytest.raises(ZeroDivisionError):
+        queued.result(timeout=10)
+
+    stats = scheduler.stats()['us-east-1']
+    assert (stats['queued'], stats['running'], stats['completed'],
+            stats['failed']) == (0, 0, 1, 1)
+    assert stats['queue_wait']['max'] is not None
+
+
+def test_cancelled_launches_leave_the_queue(scheduler):
+    release = threading.Event()
+    running = scheduler.submit('us-east-1', release.wait, 10)
+    queued = scheduler.submit('us-east-1', release.wait, 10)
+
+    assert queued.cancel()
+    release.set()
+    running.result(timeout=10)
+
+    stats = scheduler.stats()['us-east-1']
+    assert (stats['queued'], stats['running'], stats['completed'],
+            stats['cancelled']) == (0, 0, 1, 1)
+
+
+def test_regions_run_independently(scheduler):
+    release = threading.Event()
+    scheduler.submit('us-east-1', release.wait, 10)
+    try:
+        assert scheduler.submit('eu-west-1', lambda: 'ok').result(
+            timeout=10) == 'ok'
+    finally:
+        release.set()